@@ -3,12 +3,17 @@ __all__ = [
     "binding_filter",
     "calculate_manufacturability",
     "call_iedb",
+    "iedb_client",
+    "prediction_cache",
+    "unique_epitopes",
     "combine_parsed_outputs",
     "csq_parser",
     "input_file_converter",
     "download_example_data",
     "fasta_generator",
     "output_parser",
+    "key_file",
+    "reference_proteome_index",
     "valid_alleles",
     'net_chop',
     "netmhc_stab",
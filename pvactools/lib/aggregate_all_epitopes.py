@@ -8,6 +8,7 @@ import shutil
 from abc import ABCMeta, abstractmethod
 
 from pvactools.lib.prediction_class import PredictionClass
+from pvactools.lib.run_utils import read_report_headers, read_report_table
 
 class AggregateAllEpitopes:
     def __init__(self, input_file, output_file):
@@ -29,7 +30,11 @@ class AggregateAllEpitopes:
         raise Exception("Must implement method in child class")
     
     @abstractmethod
-    def get_sub_df(self, df, key):
+    def get_key_indices(self, df):
+        raise Exception("Must implement method in child class")
+
+    @abstractmethod
+    def get_sub_df(self, df, key_indices, key):
         raise Exception("Must implement method in child class")
 
     @abstractmethod
@@ -37,7 +42,7 @@ class AggregateAllEpitopes:
         raise Exception("Must implement method in child class")
 
     @abstractmethod
-    def get_tier(self, mutation, vaf_clonal):
+    def get_tiers(self, mutations, vaf_clonal):
         raise Exception("Must implement method in child class")
 
     @abstractmethod
@@ -119,10 +124,10 @@ class AggregateAllEpitopes:
         out_dict = self.assemble_result_line(best, key, vaf_clonal, hla, anno_count, peptide_count);
 
         metric = self.get_metrics(df, peptides, best)
-        return (out_dict, metric)
+        return (best, out_dict, metric)
 
     def determine_used_prediction_algorithms(self):
-        headers = pd.read_csv(self.input_file, delimiter="\t", nrows=0).columns.tolist()
+        headers = read_report_headers(self.input_file)
         potential_algorithms = PredictionClass.prediction_methods()
         prediction_algorithms = []
         for algorithm in potential_algorithms:
@@ -170,7 +175,7 @@ class AggregateAllEpitopes:
         dtypes = self.set_column_types(prediction_algorithms)
 
         ## get a list of all represented hla types
-        hla_types = pd.read_csv(self.input_file, delimiter="\t", usecols=["HLA Allele"])['HLA Allele'].unique()
+        hla_types = read_report_table(self.input_file, usecols=["HLA Allele"])['HLA Allele'].unique()
 
         ## get a list of unique mutations
         keys = self.get_list_unique_mutation_keys()
@@ -188,12 +193,19 @@ class AggregateAllEpitopes:
             metrics = {}
 
         data = []
+        bests = []
         all_epitopes_df = self.read_input_file(used_columns, dtypes)
+        #group the rows of each mutation once instead of filtering the whole
+        #table for every key
+        key_indices = self.get_key_indices(all_epitopes_df)
         for key in keys:
-            (df, key_str) = self.get_sub_df(all_epitopes_df, key)
-            (best_mut_line, metrics_for_key) = self.get_best_mut_line(df, key_str, hla_types, prediction_algorithms, vaf_clonal, 1000)
+            (df, key_str) = self.get_sub_df(all_epitopes_df, key_indices, key)
+            (best, best_mut_line, metrics_for_key) = self.get_best_mut_line(df, key_str, hla_types, prediction_algorithms, vaf_clonal, 1000)
+            bests.append(best)
             data.append(best_mut_line)
             metrics[key_str] = metrics_for_key
+        for (best_mut_line, tier) in zip(data, self.get_tiers(bests, vaf_clonal)):
+            best_mut_line['Tier'] = tier
         peptide_table = pd.DataFrame(data=data)
         peptide_table = self.sort_table(peptide_table)
 
@@ -219,7 +231,7 @@ class PvacseqAggregateAllEpitopes(AggregateAllEpitopes, metaclass=ABCMeta):
             'Reference': str,
             'Variant': str
         }
-        key_df = pd.read_csv(self.input_file, delimiter="\t", usecols=key_columns.keys(), dtype=key_columns)
+        key_df = read_report_table(self.input_file, usecols=key_columns.keys(), dtype=key_columns)
         keys = key_df[['Chromosome', 'Start', 'Stop', 'Reference', 'Variant']].values.tolist()
         keys = [list(i) for i in set(tuple(i) for i in keys)]
         return sorted(keys)
@@ -231,7 +243,7 @@ class PvacseqAggregateAllEpitopes(AggregateAllEpitopes, metaclass=ABCMeta):
             return vaf_clonal
         else:
         #if no tumor purity is provided, make a rough estimate by taking the list of VAFs < 0.6 (assumption is that these are CN-neutral) and return the largest as the marker of the founding clone
-            vafs = np.sort(pd.read_csv(self.input_file, delimiter="\t", usecols=["Tumor DNA VAF"])['Tumor DNA VAF'].unique())[::-1]
+            vafs = np.sort(read_report_table(self.input_file, usecols=["Tumor DNA VAF"])['Tumor DNA VAF'].unique())[::-1]
             vafs_clonal = list(filter(lambda vaf: vaf < 0.6, vafs))
             if len(vafs_clonal) == 0:
                 vaf_clonal = 0.6
@@ -241,16 +253,26 @@ class PvacseqAggregateAllEpitopes(AggregateAllEpitopes, metaclass=ABCMeta):
             return vaf_clonal
 
     def read_input_file(self, used_columns, dtypes):
-        return pd.read_csv(self.input_file, delimiter='\t', float_precision='high', low_memory=False, na_values="NA", keep_default_na=False, usecols=used_columns, dtype=dtypes)
-
-    def get_sub_df(self, all_epitopes_df, key):
+        return read_report_table(self.input_file, usecols=used_columns, dtype=dtypes, float_precision='high', low_memory=False, na_values="NA", keep_default_na=False)
+
+    def get_key_indices(self, all_epitopes_df):
+        #fill the columns whose missing values don't depend on the rest of the
+        #mutation's rows for the whole table at once
+        all_epitopes_df.fillna(value={"Tumor RNA Depth": 0, "Tumor RNA VAF": 0, "Tumor DNA VAF": 0, "Gene Expression": 0}, inplace=True)
+        all_epitopes_df['Variant Type'] = all_epitopes_df['Variant Type'].cat.add_categories('NA').fillna('NA')
+        all_epitopes_df['Mutation Position'] = all_epitopes_df['Mutation Position'].cat.add_categories('NA').fillna('NA')
+        annotation_columns = ['Transcript', 'Gene Name', 'Mutation', 'Protein Position']
+        all_epitopes_df.fillna(value={column: "NA" for column in annotation_columns}, inplace=True)
+        all_epitopes_df['annotation'] = all_epitopes_df['Transcript'] + '-' + all_epitopes_df['Gene Name'] + '-' + all_epitopes_df['Mutation'] + '-' + all_epitopes_df['Protein Position']
+        #the remaining columns are only filled per mutation since filling a
+        #float column with "NA" changes how its values are written out
+        self.na_columns = [column for column in all_epitopes_df.columns if all_epitopes_df[column].hasnans]
+        return all_epitopes_df.groupby(['Chromosome', 'Start', 'Stop', 'Reference', 'Variant'], sort=False, dropna=False).indices
+
+    def get_sub_df(self, all_epitopes_df, key_indices, key):
         key_str = "{}-{}-{}-{}-{}".format(key[0], key[1], key[2], key[3], key[4])
-        df = (all_epitopes_df[lambda x: (x['Chromosome'] == key[0]) & (x['Start'] == key[1]) & (x['Stop'] == key[2]) & (x['Reference'] == key[3]) & (x['Variant'] == key[4])]).copy()
-        df.fillna(value={"Tumor RNA Depth": 0, "Tumor RNA VAF": 0, "Tumor DNA VAF": 0, "Gene Expression": 0}, inplace=True)
-        df['Variant Type'] = df['Variant Type'].cat.add_categories('NA')
-        df['Mutation Position'] = df['Mutation Position'].cat.add_categories('NA')
-        df.fillna(value="NA", inplace=True)
-        df['annotation'] = df[['Transcript', 'Gene Name', 'Mutation', 'Protein Position']].agg('-'.join, axis=1)
+        df = all_epitopes_df.take(key_indices[tuple(key)])
+        df.fillna(value={column: "NA" for column in self.na_columns}, inplace=True)
         df['key'] = key_str
         return (df, key_str)
 
@@ -259,66 +281,50 @@ class PvacseqAggregateAllEpitopes(AggregateAllEpitopes, metaclass=ABCMeta):
         return df.iloc[0].to_dict()
 
     #assign mutations to a "Classification" based on their favorability
-    def get_tier(self, mutation, vaf_clonal):
-        anchor_residue_pass = True
-        anchors = [1, 2, len(mutation["MT Epitope Seq"])-1, len(mutation["MT Epitope Seq"])]
-        position = mutation["Mutation Position"]
-        if position != "NA":
-            if int(float(position)) in anchors:
-                if mutation["Median WT Score"] == "NA":
-                      anchor_residue_pass = False
-                elif mutation["Median WT Score"] < 1000:
-                      anchor_residue_pass = False
-
-        #writing these out as explicitly as possible for ease of understanding
-        if (mutation["Median MT Score"] < 500 and
-           mutation["Tumor RNA VAF"] * mutation["Gene Expression"] > 3 and
-           mutation["Tumor DNA VAF"] >= (vaf_clonal/2) and
-           anchor_residue_pass):
-            return "Pass"
-
-        #relax mt and expr
-        if (mutation["Median MT Score"] < 1000 and
-           mutation["Tumor RNA VAF"] * mutation["Gene Expression"] > 1 and
-           mutation["Tumor DNA VAF"] >= (vaf_clonal/2) and
-           anchor_residue_pass):
-            return "Relaxed"
-
-        #anchor residues
-        if (mutation["Median MT Score"] < 1000 and
-           mutation["Tumor RNA VAF"] * mutation["Gene Expression"] > 1 and
-           mutation["Tumor DNA VAF"] >= (vaf_clonal/2) and
-           not anchor_residue_pass):
-            return "Anchor"
-
-        #not in founding clone
-        if (mutation["Median MT Score"] < 1000 and
-           mutation["Tumor RNA VAF"] * mutation["Gene Expression"] > 1 and
-           mutation["Tumor DNA VAF"] < (vaf_clonal/2) and
-           anchor_residue_pass):
-            return "Subclonal"
-
+    def get_tiers(self, mutations, vaf_clonal):
+        if len(mutations) == 0:
+            return []
+        def column(name):
+            return np.array([mutation[name] for mutation in mutations], dtype=float)
+        mt_score = column("Median MT Score")
+        rna_vaf = column("Tumor RNA VAF")
+        gene_expr = column("Gene Expression")
+        rna_depth = column("Tumor RNA Depth")
+        dna_vaf = column("Tumor DNA VAF")
+
+        anchor_residue_pass = []
+        for mutation in mutations:
+            anchors = [1, 2, len(mutation["MT Epitope Seq"])-1, len(mutation["MT Epitope Seq"])]
+            position = mutation["Mutation Position"]
+            anchor_residue_pass.append(not (
+                position != "NA" and int(float(position)) in anchors and
+                (mutation["Median WT Score"] == "NA" or mutation["Median WT Score"] < 1000)
+            ))
+        anchor_residue_pass = np.array(anchor_residue_pass, dtype=bool)
+
+        allele_expr = rna_vaf * gene_expr
+        clonal = dna_vaf >= (vaf_clonal/2)
+        subclonal = dna_vaf < (vaf_clonal/2)
         #relax expression.  Include sites that have reasonable vaf but zero overall gene expression
-        lowexpr=False
-        if ((mutation["Tumor RNA VAF"] * mutation["Gene Expression"] > 0) or
-           (mutation["Gene Expression"] == 0 and
-           mutation["Tumor RNA Depth"] > 50 and
-           mutation["Tumor RNA VAF"] > 0.10)):
-             lowexpr=True
-
-        #if low expression is the only strike against it, it gets lowexpr label (multiple strikes will pass through to poor)
-        if (mutation["Median MT Score"] < 1000 and
-            lowexpr==True and
-            mutation["Tumor DNA VAF"] >= (vaf_clonal/2) and
-            anchor_residue_pass):
-            return "LowExpr"
-
-        #zero expression
-        if (mutation["Gene Expression"] == 0 or mutation["Tumor RNA VAF"] == 0) and lowexpr==False:
-            return "NoExpr"
-
+        lowexpr = (allele_expr > 0) | ((gene_expr == 0) & (rna_depth > 50) & (rna_vaf > 0.10))
+
+        #the conditions are checked in order, the first one a mutation meets determines its tier
+        tiers = [
+            #writing these out as explicitly as possible for ease of understanding
+            ("Pass", (mt_score < 500) & (allele_expr > 3) & clonal & anchor_residue_pass),
+            #relax mt and expr
+            ("Relaxed", (mt_score < 1000) & (allele_expr > 1) & clonal & anchor_residue_pass),
+            #anchor residues
+            ("Anchor", (mt_score < 1000) & (allele_expr > 1) & clonal & ~anchor_residue_pass),
+            #not in founding clone
+            ("Subclonal", (mt_score < 1000) & (allele_expr > 1) & subclonal & anchor_residue_pass),
+            #if low expression is the only strike against it, it gets lowexpr label (multiple strikes will pass through to poor)
+            ("LowExpr", (mt_score < 1000) & lowexpr & clonal & anchor_residue_pass),
+            #zero expression
+            ("NoExpr", ((gene_expr == 0) | (rna_vaf == 0)) & ~lowexpr),
+        ]
         #everything else
-        return "Poor"
+        return np.select([condition for (tier, condition) in tiers], [tier for (tier, condition) in tiers], default="Poor").tolist()
 
     def get_good_binders(self, df, max_ic50):
         return df[df["Median MT Score"] < max_ic50]
@@ -330,11 +336,11 @@ class PvacseqAggregateAllEpitopes(AggregateAllEpitopes, metaclass=ABCMeta):
         peptides = defaultdict(lambda: defaultdict(lambda: defaultdict(list)))
         good_peptides = good_binders["MT Epitope Seq"].unique()
         good_transcripts = good_binders['annotation'].unique()
+        peptide_annotation_indices = good_binders.groupby(['annotation', 'MT Epitope Seq'], sort=False).indices
         for annotation in good_transcripts:
-            good_binders_annotation = good_binders[good_binders['annotation'] == annotation]
             for peptide in good_peptides:
-                good_binders_peptide_annotation = good_binders_annotation[good_binders_annotation['MT Epitope Seq'] == peptide]
-                if len(good_binders_peptide_annotation) > 0:
+                if (annotation, peptide) in peptide_annotation_indices:
+                    good_binders_peptide_annotation = good_binders.iloc[peptide_annotation_indices[(annotation, peptide)]]
                     individual_ic50_calls = { 'algorithms': prediction_algorithms }
                     individual_percentile_calls = { 'algorithms': prediction_algorithms }
                     for peptide_type in ['MT', 'WT']:
@@ -402,7 +408,6 @@ class PvacseqAggregateAllEpitopes(AggregateAllEpitopes, metaclass=ABCMeta):
 
     def assemble_result_line(self, best, key, vaf_clonal, hla, anno_count, peptide_count):
         allele_expr = self.calculate_allele_expr(best)
-        tier = self.get_tier(mutation=best, vaf_clonal=vaf_clonal)
 
         out_dict = { 'ID': key }
         out_dict.update({ k.replace('HLA-', ''):v for k,v in sorted(hla.items()) })
@@ -422,17 +427,20 @@ class PvacseqAggregateAllEpitopes(AggregateAllEpitopes, metaclass=ABCMeta):
             'Allele Expr': allele_expr,
             'RNA Depth': best["Tumor RNA Depth"],
             'DNA VAF': best["Tumor DNA VAF"],
-            'Tier': tier,
+            #assigned for all mutations at once, see get_tiers
+            'Tier': None,
             'Evaluation': 'Pending',
         })
         return out_dict
 
     def get_metrics(self, df, peptides, best):
         transcripts = list(peptides.keys())
+        first_annotation_rows = df.drop_duplicates(subset=['annotation'])
+        transcript_expr = dict(zip(first_annotation_rows['annotation'], first_annotation_rows['Transcript Expression']))
         return {
             'good_binders': peptides,
             'good_binders_transcripts': transcripts,
-            'transcript_expr': [df[df["annotation"] == x]['Transcript Expression'].iloc[0] for x in transcripts],
+            'transcript_expr': [transcript_expr[x] for x in transcripts],
             'DNA VAF': float(best['Tumor DNA VAF']),
             'RNA VAF': float(best['Tumor RNA VAF']),
             'gene_expr': float(best['Gene Expression']),
@@ -478,7 +486,7 @@ class PvacseqAggregateAllEpitopes(AggregateAllEpitopes, metaclass=ABCMeta):
 
 class UnmatchedSequenceAggregateAllEpitopes(AggregateAllEpitopes, metaclass=ABCMeta):
     def get_list_unique_mutation_keys(self):
-        key_df = pd.read_csv(self.input_file, delimiter="\t", usecols=["Mutation"], dtype={"Mutation": str})
+        key_df = read_report_table(self.input_file, usecols=["Mutation"], dtype={"Mutation": str})
         keys = key_df["Mutation"].values.tolist()
         return sorted(list(set(keys)))
 
@@ -486,18 +494,21 @@ class UnmatchedSequenceAggregateAllEpitopes(AggregateAllEpitopes, metaclass=ABCM
         return None
 
     def read_input_file(self, used_columns, dtypes):
-        return pd.read_csv(self.input_file, delimiter='\t', float_precision='high', low_memory=False, na_values="NA", keep_default_na=False, dtype={"Mutation": str})
+        return read_report_table(self.input_file, dtype={"Mutation": str}, float_precision='high', low_memory=False, na_values="NA", keep_default_na=False)
 
-    def get_sub_df(self, all_epitopes_df, key):
-        df = (all_epitopes_df[lambda x: (x['Mutation'] == key)]).copy()
+    def get_key_indices(self, all_epitopes_df):
+        return all_epitopes_df.groupby('Mutation', sort=False, dropna=False).indices
+
+    def get_sub_df(self, all_epitopes_df, key_indices, key):
+        df = all_epitopes_df.take(key_indices[key])
         return (df, key)
 
     def get_best_binder(self, df):
         df.sort_values(by=["Median Score"], inplace=True, ascending=True)
         return df.iloc[0]
 
-    def get_tier(self, mutation, vaf_clonal):
-        return "NA"
+    def get_tiers(self, mutations, vaf_clonal):
+        return ["NA"] * len(mutations)
 
     def get_good_binders(self, df, max_ic50):
         return df[df["Median Score"] < max_ic50]
@@ -525,7 +536,6 @@ class UnmatchedSequenceAggregateAllEpitopes(AggregateAllEpitopes, metaclass=ABCM
 
     def assemble_result_line(self, best, key, vaf_clonal, hla, anno_count, peptide_count):
         allele_expr = self.calculate_allele_expr(best)
-        tier = self.get_tier(mutation=best, vaf_clonal=vaf_clonal)
 
         out_dict = { 'ID': key }
         out_dict.update({ k.replace('HLA-', ''):v for k,v in sorted(hla.items()) })
@@ -549,7 +559,8 @@ class UnmatchedSequenceAggregateAllEpitopes(AggregateAllEpitopes, metaclass=ABCM
             'Allele Expr': allele_expr,
             'RNA Depth': "NA",
             'DNA VAF': "NA",
-            'Tier': tier,
+            #assigned for all mutations at once, see get_tiers
+            'Tier': None,
             'Evaluation': 'Pending',
             'ID':key,
         })
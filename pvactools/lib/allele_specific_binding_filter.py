@@ -1,9 +1,11 @@
-import csv
 import sys
+import numpy as np
 from pvactools.lib.prediction_class import PredictionClass
+from pvactools.lib.filter import numeric_column
+import pvactools.lib.run_utils
 
 class AlleleSpecificBindingFilter:
-    def __init__(self, input_file, output_file, default_threshold, minimum_fold_change, top_score_metric, exclude_nas, percentile_threshold, file_type='pVACseq'):
+    def __init__(self, input_file, output_file, default_threshold, minimum_fold_change, top_score_metric, exclude_nas, percentile_threshold, file_type='pVACseq', chunk_size=None):
         self.input_file = input_file
         self.output_file = output_file
         self.default_threshold = default_threshold
@@ -12,51 +14,50 @@ class AlleleSpecificBindingFilter:
         self.exclude_nas = exclude_nas
         self.percentile_threshold = percentile_threshold
         self.file_type = file_type
+        self.chunk_size = chunk_size
 
     def execute(self):
-        with open(self.input_file, 'r') as input_fh:
-            reader = csv.DictReader(input_fh, delimiter='\t')
-            fieldnames = reader.fieldnames
-            output_fh = open(self.output_file, 'w')
-            writer = csv.DictWriter(output_fh, fieldnames, delimiter = '\t', lineterminator = '\n')
-            writer.writeheader()
-
-            for entry in reader:
-                if self.file_type == 'pVACbind' or self.file_type == 'pVACfuse':
-                    if self.top_score_metric == 'median':
-                        score = float(entry['Median Score'])
-                        percentile_column = 'Median Percentile'
-                    elif self.top_score_metric == 'lowest':
-                        score = float(entry['Best Score'])
-                        percentile_column = 'Best Percentile'
-                else:
-                    if self.top_score_metric == 'median':
-                        score = float(entry['Median MT Score'])
-                        if self.exclude_nas and entry['Median Fold Change'] == 'NA':
-                            continue
-                        else:
-                            fold_change = sys.maxsize if entry['Median Fold Change'] == 'NA' else float(entry['Median Fold Change'])
-                        percentile_column = 'Median MT Percentile'
-                    elif self.top_score_metric == 'lowest':
-                        score = float(entry['Best MT Score'])
-                        if self.exclude_nas and entry['Corresponding Fold Change'] == 'NA':
-                            continue
-                        else:
-                            fold_change = sys.maxsize if entry['Corresponding Fold Change'] == 'NA' else float(entry['Corresponding Fold Change'])
-                        percentile_column = 'Best MT Percentile'
-
-                if self.percentile_threshold is not None:
-                    if float(entry[percentile_column]) > self.percentile_threshold:
-                        continue
-
-                threshold = PredictionClass.cutoff_for_allele(entry['HLA Allele'])
-                threshold = self.default_threshold if threshold is None else float(threshold)
-
-                if score > threshold:
-                    continue
-
-                if self.minimum_fold_change is not None and fold_change < self.minimum_fold_change:
-                    continue
-
-                writer.writerow(entry)
-            output_fh.close()
+        pvactools.lib.run_utils.filter_report(self.input_file, self.output_file, self.filter_df, self.chunk_size)
+
+    def filter_df(self, df):
+        if self.file_type == 'pVACbind' or self.file_type == 'pVACfuse':
+            if self.top_score_metric == 'median':
+                score_column = 'Median Score'
+                percentile_column = 'Median Percentile'
+            elif self.top_score_metric == 'lowest':
+                score_column = 'Best Score'
+                percentile_column = 'Best Percentile'
+            fold_change_column = None
+        else:
+            if self.top_score_metric == 'median':
+                score_column = 'Median MT Score'
+                fold_change_column = 'Median Fold Change'
+                percentile_column = 'Median MT Percentile'
+            elif self.top_score_metric == 'lowest':
+                score_column = 'Best MT Score'
+                fold_change_column = 'Corresponding Fold Change'
+                percentile_column = 'Best MT Percentile'
+
+        passes = np.ones(len(df), dtype=bool)
+        if fold_change_column is not None:
+            fold_change_nas = (df[fold_change_column] == 'NA').to_numpy()
+            if self.exclude_nas:
+                passes &= ~fold_change_nas
+            fold_change = df[fold_change_column].mask(fold_change_nas, str(sys.maxsize)).astype(float).to_numpy()
+            if self.minimum_fold_change is not None:
+                passes &= ~(fold_change < self.minimum_fold_change)
+
+        if self.percentile_threshold is not None:
+            #NA percentiles are kept, same as in the non allele-specific binding filter
+            (percentile, percentile_nas) = numeric_column(df[percentile_column])
+            passes &= ~(percentile > self.percentile_threshold) | percentile_nas
+
+        #Cutoffs are looked up once per allele rather than once per row
+        thresholds = {}
+        for allele in df['HLA Allele'].unique():
+            threshold = PredictionClass.cutoff_for_allele(allele)
+            thresholds[allele] = self.default_threshold if threshold is None else float(threshold)
+        threshold = df['HLA Allele'].map(thresholds).to_numpy(dtype=float)
+        passes &= ~(df[score_column].astype(float).to_numpy() > threshold)
+
+        return df[passes]
@@ -6,7 +6,7 @@ from pvactools.lib.filter import Filter
 from pvactools.lib.allele_specific_binding_filter import AlleleSpecificBindingFilter
 
 class BindingFilter:
-    def __init__(self, input_file, output_file, binding_threshold, minimum_fold_change, top_score_metric, exclude_nas, allele_specific_cutoffs, percentile_threshold, file_type='pVACseq'):
+    def __init__(self, input_file, output_file, binding_threshold, minimum_fold_change, top_score_metric, exclude_nas, allele_specific_cutoffs, percentile_threshold, file_type='pVACseq', chunk_size=None):
         self.input_file = input_file
         self.output_file = output_file
         self.binding_threshold = binding_threshold
@@ -16,39 +16,47 @@ class BindingFilter:
         self.exclude_nas = exclude_nas
         self.allele_specific_cutoffs = allele_specific_cutoffs
         self.file_type = file_type
+        self.chunk_size = chunk_size
 
     def execute(self):
-        filter_criteria = []
+        self.filter().execute()
+
+    def filter_df(self, df):
+        return self.filter().filter_df(df)
 
+    def filter(self):
         if self.allele_specific_cutoffs:
-            AlleleSpecificBindingFilter(self.input_file, self.output_file, self.binding_threshold, self.minimum_fold_change, self.top_score_metric, self.exclude_nas, self.percentile_threshold, self.file_type).execute()
+            return AlleleSpecificBindingFilter(self.input_file, self.output_file, self.binding_threshold, self.minimum_fold_change, self.top_score_metric, self.exclude_nas, self.percentile_threshold, self.file_type, self.chunk_size)
         else:
-            if self.file_type == 'pVACbind' or self.file_type == 'pVACfuse':
-                if self.top_score_metric == 'median':
-                    ic50_column = 'Median Score'
-                    percentile_column = 'Median Percentile'
-                elif self.top_score_metric == 'lowest':
-                    ic50_column = 'Best Score'
-                    percentile_column = 'Best Percentile'
-            else:
-                if self.top_score_metric == 'median':
-                    ic50_column = 'Median MT Score'
-                    percentile_column = 'Median MT Percentile'
-                elif self.top_score_metric == 'lowest':
-                    ic50_column = 'Best MT Score'
-                    percentile_column = 'Best MT Percentile'
-            filter_criteria.append({'column': ic50_column, 'operator': '<=', 'threshold': self.binding_threshold, 'exclude_nas': self.exclude_nas})
-            if self.percentile_threshold is not None:
-                filter_criteria.append({'column': percentile_column, 'operator': '<=', 'threshold': self.percentile_threshold, 'exclude_nas': False})
+            return Filter(self.input_file, self.output_file, self.filter_criteria(), chunk_size=self.chunk_size)
 
-            if self.minimum_fold_change is not None:
-                if self.top_score_metric == 'median':
-                    column = 'Median Fold Change'
-                elif self.top_score_metric == 'lowest':
-                    column = 'Corresponding Fold Change'
-                filter_criteria.append({'column': column, 'operator': '>=', 'threshold': self.minimum_fold_change, 'exclude_nas': self.exclude_nas})
+    def filter_criteria(self):
+        filter_criteria = []
+        if self.file_type == 'pVACbind' or self.file_type == 'pVACfuse':
+            if self.top_score_metric == 'median':
+                ic50_column = 'Median Score'
+                percentile_column = 'Median Percentile'
+            elif self.top_score_metric == 'lowest':
+                ic50_column = 'Best Score'
+                percentile_column = 'Best Percentile'
+        else:
+            if self.top_score_metric == 'median':
+                ic50_column = 'Median MT Score'
+                percentile_column = 'Median MT Percentile'
+            elif self.top_score_metric == 'lowest':
+                ic50_column = 'Best MT Score'
+                percentile_column = 'Best MT Percentile'
+        filter_criteria.append({'column': ic50_column, 'operator': '<=', 'threshold': self.binding_threshold, 'exclude_nas': self.exclude_nas})
+        if self.percentile_threshold is not None:
+            filter_criteria.append({'column': percentile_column, 'operator': '<=', 'threshold': self.percentile_threshold, 'exclude_nas': False})
 
-            Filter(self.input_file, self.output_file, filter_criteria).execute()
+        if self.minimum_fold_change is not None:
+            if self.top_score_metric == 'median':
+                column = 'Median Fold Change'
+            elif self.top_score_metric == 'lowest':
+                column = 'Corresponding Fold Change'
+            filter_criteria.append({'column': column, 'operator': '>=', 'threshold': self.minimum_fold_change, 'exclude_nas': self.exclude_nas})
+        return filter_criteria
 
     @classmethod
     def parser(cls, tool):
@@ -107,4 +115,8 @@ class BindingFilter:
             default=False,
             action='store_true',
         )
+        parser.add_argument(
+            '--chunk-size', type=int,
+            help="Filter the input file in chunks of this many rows instead of loading it into memory at once.",
+        )
         return parser
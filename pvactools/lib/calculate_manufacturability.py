@@ -2,6 +2,8 @@ import csv
 from vaxrank.manufacturability import ManufacturabilityScores
 from Bio import SeqIO
 
+import pvactools.lib.run_utils
+
 class CalculateManufacturability:
     def __init__(self, input_file, output_file, file_type='pVACseq'):
         self.input_file = input_file
@@ -48,16 +50,23 @@ class CalculateManufacturability:
                         line = self.append_manufacturability_metrics(line, scores)
                     writer.writerow(line)
         else:
-            with open(self.input_file) as input_fh, open(self.output_file, 'w') as output_fh:
-                reader = csv.DictReader(input_fh, delimiter = "\t")
-                writer = csv.DictWriter(output_fh, delimiter = "\t", fieldnames=reader.fieldnames + self.manufacturability_headers(), extrasaction='ignore', restval='NA')
-                writer.writeheader()
-                for line in reader:
-                    if self.file_type == 'pVACbind' or self.file_type == 'pVACfuse':
-                        sequence = line['Epitope Seq']
-                    else:
-                        sequence = line['MT Epitope Seq']
-                    if len(sequence) >= 7:
-                        scores = ManufacturabilityScores.from_amino_acids(sequence)
-                        line = self.append_manufacturability_metrics(line, scores)
-                    writer.writerow(line)
+            df = pvactools.lib.run_utils.read_report(self.input_file)
+            pvactools.lib.run_utils.write_report(self.append_manufacturability_metrics_df(df), self.output_file, lineterminator='\r\n')
+
+    def append_manufacturability_metrics_df(self, df):
+        if self.file_type == 'pVACbind' or self.file_type == 'pVACfuse':
+            sequences = df['Epitope Seq']
+        else:
+            sequences = df['MT Epitope Seq']
+        #Metrics are calculated once per unique epitope
+        metrics = {}
+        for sequence in sequences.unique():
+            line = {}
+            if len(sequence) >= 7:
+                scores = ManufacturabilityScores.from_amino_acids(sequence)
+                line = self.append_manufacturability_metrics(line, scores)
+            metrics[sequence] = line
+        df = df.copy()
+        for header in self.manufacturability_headers():
+            df[header] = [str(metrics[sequence].get(header, 'NA')) for sequence in sequences]
+        return df
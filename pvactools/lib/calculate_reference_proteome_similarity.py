@@ -10,11 +10,43 @@ import shutil
 import re
 import os
 import sys
-from collections import defaultdict
+from collections import defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from subprocess import run, DEVNULL, STDOUT
 import tempfile
 from time import sleep
 import pymp
+from Bio.SubsMat import MatrixInfo
+
+from pvactools.lib.reference_proteome_index import ReferenceProteomeIndex
+
+#Minimal stand-ins for the Bio.Blast.Record classes so that hits parsed from
+#tabular blastp output can be processed the same way as XML results
+BlastRecord = namedtuple('BlastRecord', ['alignments'])
+BlastAlignment = namedtuple('BlastAlignment', ['hit_id', 'hit_def', 'title', 'hsps'])
+BlastHsp = namedtuple('BlastHsp', ['query', 'match', 'sbjct_start', 'sbjct_end'])
+
+BLAST_TABULAR_FIELDS = ['qseqid', 'sallseqid', 'salltitles', 'qseq', 'sseq', 'sstart', 'send']
+
+def blast_match_line(query, subject):
+    #Reconstructs the match line of a BLAST alignment: identities are shown as the
+    #amino acid, positive substitutions as '+' and everything else as a space
+    match = []
+    for (query_amino_acid, subject_amino_acid) in zip(query, subject):
+        if query_amino_acid == subject_amino_acid:
+            match.append(query_amino_acid)
+        elif MatrixInfo.blosum62.get((query_amino_acid, subject_amino_acid), MatrixInfo.blosum62.get((subject_amino_acid, query_amino_acid), 0)) > 0:
+            match.append('+')
+        else:
+            match.append(' ')
+    return ''.join(match)
+
+def blast_hit_definition(all_ids, all_titles):
+    #Identical reference sequences are merged into one hit. The XML output lists
+    #them in the hit definition as "title >id title >id title".
+    ids = all_ids.split(';')
+    titles = all_titles.split('<>')
+    return ' >'.join([titles[0]] + ["{} {}".format(hit_id, title) for (hit_id, title) in zip(ids[1:], titles[1:])])
 
 class CalculateReferenceProteomeSimilarity:
     '''
@@ -51,6 +83,10 @@ class CalculateReferenceProteomeSimilarity:
     n_threads : int
         The number of threads for multiprocessing
 
+    reference_index : str
+        A path to a reference proteome index directory built with `pvactools build_reference_proteome_index`.
+        If provided, matches are looked up in the index instead of running BLAST
+
 
     Methods
     -------
@@ -76,16 +112,23 @@ class CalculateReferenceProteomeSimilarity:
         Returns the full_peptide and it's respective n_mer from the line in self.input_file
 
     _call_blast(self, full_peptide, peptide, p)
-        Performs blast operations and returns tmp file that the results are written to.
+        Performs blast operations with the NCBI API and returns the handle that the results are written to.
         Note:
             TMP FILE NEEDS TO BE CLOSED OUTSIDE OF FUNCTION
 
+    _call_local_blast(self, unique_peptides)
+        Performs local blastp operations on all unique peptides at once, split into one query file per thread,
+        and returns a dictionary of the parsed blast records for each peptide
+
     _needs_processing(full_peptide, processed_peptides)
         Returns true if protein has not been processed and false otherwise
 
     _generate_reference_match_dict(self, full_peptide, processed_peptides, peptide, p)
         Returns a dictionary that contains information about matches
 
+    _generate_index_match_dict(self, index, peptide)
+        Returns a dictionary that contains information about matches from the reference proteome index
+
     _write_outputs(input_fh, processed_peptides, mt_records_dict, wt_records_dict)
         Uses the blast records in processed_peptides to add results to information in the input_file and
         writes the new data to files.
@@ -97,7 +140,7 @@ class CalculateReferenceProteomeSimilarity:
         Peforms the calculation of reference proteome similarity. The only method that should be 
         called from outside of the class
     '''
-    def __init__(self, input_file, input_fasta, output_file, match_length=8, species='human', file_type='pVACseq', blastp_path=None, blastp_db='refseq_select_prot', n_threads=1):
+    def __init__(self, input_file, input_fasta, output_file, match_length=8, species='human', file_type='pVACseq', blastp_path=None, blastp_db='refseq_select_prot', n_threads=1, reference_index=None):
         self.input_file = input_file
         self.input_fasta = input_fasta
         output_dir = os.path.dirname(output_file)
@@ -110,7 +153,8 @@ class CalculateReferenceProteomeSimilarity:
         self.file_type = file_type
         self.blastp_path = blastp_path
         self.blastp_db = blastp_db
-        if self.blastp_db == 'refseq_select_prot' and self.species != 'human' and self.species != 'mouse':
+        self.reference_index = reference_index
+        if self.reference_index is None and self.blastp_db == 'refseq_select_prot' and self.species != 'human' and self.species != 'mouse':
             raise Exception("refseq_select_prot blastp database is only compatible with human and mouse species.")
         self.species_to_organism = {
             'human': 'Homo sapiens',
@@ -237,29 +281,51 @@ class CalculateReferenceProteomeSimilarity:
 
 
     def _call_blast(self, full_peptide, p):
-        if self.blastp_path is not None: # if blastp installed locally, perform BLAST with it
-
-            # create a SeqRecord of full_peptide and write it to a tmp file
-            record = SeqRecord(Seq(full_peptide, IUPAC.protein), id="1", description="")
-            tmp_peptide_fh = tempfile.NamedTemporaryFile('w', delete=False)
-            SeqIO.write([record], tmp_peptide_fh.name, "fasta")
-
-            # configure args for local blastp, run it and put results in new tmp file
-            arguments = [self.blastp_path, '-query', tmp_peptide_fh.name, '-db', self.blastp_db, '-outfmt', '16', '-word_size', str(min(self.match_length, 7)), '-gapopen', '32767', '-gapextend', '32767']
-            result_handle = tempfile.NamedTemporaryFile(delete=False)
-            response = run(arguments, stdout=result_handle, check=True)
-            result_handle.seek(0)
-            tmp_peptide_fh.close()
-
-        else: # else perform BLAST with api
-            with p.lock: # stagger calls to qblast
-                if not os.environ.get('TEST_FLAG') or os.environ.get('TEST_FLAG') == '0': # we don't need to sleep during testing since this is mocked and not actually calling the API
-                    sleep(10)
-            result_handle = NCBIWWW.qblast("blastp", self.blastp_db, full_peptide, entrez_query="{} [Organism]".format(self.species_to_organism[self.species]), word_size=min(self.match_length, 7), gapcosts='32767 32767')
+        with p.lock: # stagger calls to qblast
+            if not os.environ.get('TEST_FLAG') or os.environ.get('TEST_FLAG') == '0': # we don't need to sleep during testing since this is mocked and not actually calling the API
+                sleep(10)
+        result_handle = NCBIWWW.qblast("blastp", self.blastp_db, full_peptide, entrez_query="{} [Organism]".format(self.species_to_organism[self.species]), word_size=min(self.match_length, 7), gapcosts='32767 32767')
 
         return result_handle
 
 
+    def _call_local_blast(self, unique_peptides):
+        processed_peptides = {}
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            shard_count = max(1, min(self.n_threads, len(unique_peptides)))
+            shards = []
+            for i in range(shard_count):
+                query_file = os.path.join(tmp_dir, 'query_{}.fa'.format(i))
+                records = [SeqRecord(Seq(unique_peptides[j], IUPAC.protein), id=str(j), description="") for j in range(i, len(unique_peptides), shard_count)]
+                SeqIO.write(records, query_file, "fasta")
+                shards.append((query_file, os.path.join(tmp_dir, 'result_{}.tsv'.format(i))))
+
+            def run_shard(shard):
+                (query_file, result_file) = shard
+                arguments = [self.blastp_path, '-query', query_file, '-db', self.blastp_db, '-outfmt', '6 {}'.format(' '.join(BLAST_TABULAR_FIELDS)), '-word_size', str(min(self.match_length, 7)), '-gapopen', '32767', '-gapextend', '32767']
+                with open(result_file, 'w') as result_fh:
+                    run(arguments, stdout=result_fh, check=True)
+
+            with ThreadPoolExecutor(max_workers=shard_count) as executor:
+                list(executor.map(run_shard, shards))
+
+            #Tabular output has one line per HSP, grouped by query and subject
+            alignments = defaultdict(dict)
+            for (query_file, result_file) in shards:
+                with open(result_file, 'r') as result_fh:
+                    for line in result_fh:
+                        hit = dict(zip(BLAST_TABULAR_FIELDS, line.rstrip('\n').split('\t')))
+                        query_alignments = alignments[int(hit['qseqid'])]
+                        hit_id = hit['sallseqid'].split(';')[0]
+                        if hit_id not in query_alignments:
+                            hit_definition = blast_hit_definition(hit['sallseqid'], hit['salltitles'])
+                            query_alignments[hit_id] = BlastAlignment(hit_id, hit_definition, "{} {}".format(hit_id, hit_definition), [])
+                        query_alignments[hit_id].hsps.append(BlastHsp(hit['qseq'], blast_match_line(hit['qseq'], hit['sseq']), int(hit['sstart']), int(hit['send'])))
+        for (i, full_peptide) in enumerate(unique_peptides):
+            processed_peptides[full_peptide] = [BlastRecord(list(alignments[i].values()))]
+        return processed_peptides
+
+
     def _generate_reference_match_dict(self, blast_records, peptide):
 
         reference_match_dict = defaultdict(list)
@@ -287,7 +353,15 @@ class CalculateReferenceProteomeSimilarity:
         return reference_match_dict
 
 
-    def _write_outputs(self, processed_peptides, mt_records_dict, wt_records_dict):
+    def _generate_index_match_dict(self, index, peptide):
+        reference_match_dict = defaultdict(list)
+        for match in index.matches(peptide):
+            match['Query Sequence'] = peptide
+            reference_match_dict[peptide].append(match)
+        return reference_match_dict
+
+
+    def _write_outputs(self, processed_peptides, mt_records_dict, wt_records_dict, index=None):
 
         with open(self.input_file) as input_fh, open(self.output_file, 'w') as output_fh, open(self.metric_file, 'w') as metric_fh:
             reader = csv.DictReader(input_fh, delimiter="\t")
@@ -299,8 +373,11 @@ class CalculateReferenceProteomeSimilarity:
             for line in reader:
                 peptide, full_peptide = self._get_peptide(line, mt_records_dict, wt_records_dict)
 
-                blast_records = processed_peptides[full_peptide]
-                reference_match_dict = self._generate_reference_match_dict(blast_records, peptide)
+                if index is not None:
+                    reference_match_dict = self._generate_index_match_dict(index, peptide)
+                else:
+                    blast_records = processed_peptides[full_peptide]
+                    reference_match_dict = self._generate_reference_match_dict(blast_records, peptide)
 
                 if peptide in reference_match_dict:
                     line['Reference Match'] = True
@@ -329,6 +406,15 @@ class CalculateReferenceProteomeSimilarity:
 
     def execute(self):
 
+        if self.reference_index is not None:
+            index = ReferenceProteomeIndex(self.reference_index)
+            if index.match_length != self.match_length:
+                raise Exception("Reference proteome index {} was built for a match length of {} but a match length of {} was requested.".format(self.reference_index, index.match_length, self.match_length))
+            if index.species is not None and index.species != self.species:
+                raise Exception("Reference proteome index {} was built for species {} but species {} was requested.".format(self.reference_index, index.species, self.species))
+            self._write_outputs({}, self.get_mt_peptides(), self.get_wt_peptides(), index)
+            return
+
         if self.species not in self.species_to_organism:
             print("Species {} not supported for Reference Proteome Similarity search. Skipping.".format(self.species))
             shutil.copy(self.input_file, self.output_file)
@@ -337,6 +423,11 @@ class CalculateReferenceProteomeSimilarity:
         mt_records_dict = self.get_mt_peptides()
         wt_records_dict = self.get_wt_peptides()
 
+        if self.blastp_path is not None:
+            processed_peptides = self._call_local_blast(self._get_unique_peptides(mt_records_dict, wt_records_dict))
+            self._write_outputs(processed_peptides, mt_records_dict, wt_records_dict)
+            return
+
         unique_peptides = pymp.shared.list(self._get_unique_peptides(mt_records_dict, wt_records_dict))
         processed_peptides = pymp.shared.dict()
 
@@ -403,4 +494,10 @@ class CalculateReferenceProteomeSimilarity:
             default=1,
             help="Number of threads to use for parallelizing BLAST calls.",
         )
+        parser.add_argument(
+            '--reference-index',
+            default=None,
+            help="Reference proteome index directory built with `pvactools build_reference_proteome_index`. "
+                 + "If provided, matches are looked up in this index instead of running BLAST.",
+        )
         return parser
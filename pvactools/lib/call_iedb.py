@@ -5,8 +5,9 @@ import re
 from subprocess import run, PIPE
 
 from pvactools.lib.prediction_class import *
+from pvactools.lib.prediction_cache import PredictionCache, predict_with_cache
 
-def main(args_input = sys.argv[1:]):
+def define_parser():
     parser = argparse.ArgumentParser('pvacseq call_iedb', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument('input_file',
                         help="Input FASTA file")
@@ -28,27 +29,73 @@ def main(args_input = sys.argv[1:]):
         "-e", "--iedb-executable-path",
         help="The executable path of the local IEDB install"
     )
+    parser.add_argument(
+        "--prediction-cache",
+        help="Path to a prediction cache database. Previously predicted epitopes will be read from the cache "
+             + "and only uncached epitopes will be sent to the prediction algorithm."
+    )
+    parser.add_argument(
+        "--prediction-cache-size", type=int,
+        help="Maximum number of epitopes to keep in the prediction cache. Least recently used entries are evicted first."
+    )
+    parser.add_argument(
+        "--batch-allele", nargs=2, action='append', default=[],
+        metavar=('ALLELE', 'OUTPUT_FILE'),
+        help="Additional allele to predict on the same input file and the output file for its predictions. "
+             + "Can be specified multiple times. For IEDB MHC class I methods using the IEDB RESTful web interface "
+             + "all alleles are submitted in a single request. Otherwise the alleles are predicted one after the other."
+    )
+    return parser
+
+def main(args_input = sys.argv[1:]):
+    parser = define_parser()
     args = parser.parse_args(args_input)
 
     prediction_class = getattr(sys.modules[__name__], args.method)
     prediction_class_object = prediction_class()
 
-    try:
-        (response_text, output_mode) = prediction_class_object.predict(args.input_file, args.allele, args.epitope_length, args.iedb_executable_path, args.iedb_retries)
-    except Exception as err:
-        if str(err) == 'len(peptide_list) != len(scores)':
-            (response_text, output_mode) = prediction_class_object.predict(args.input_file, args.allele, args.epitope_length, args.iedb_executable_path, args.iedb_retries)
-        else:
-            raise err
+    allele_output_files = [(args.allele, args.output_file)] + [tuple(batch_allele) for batch_allele in args.batch_allele]
+    if (len(allele_output_files) > 1
+        and getattr(prediction_class_object, 'supports_allele_batching', False)
+        and args.iedb_executable_path is None
+        and args.prediction_cache is None):
+        alleles = [allele for (allele, output_file) in allele_output_files]
+        responses = prediction_class_object.predict_alleles(args.input_file, alleles, args.epitope_length, args.iedb_retries)
+        for (allele, output_file) in allele_output_files:
+            write_output(responses[allele], 'w', output_file)
+        return
+
+    for (allele, output_file) in allele_output_files:
+        (response_text, output_mode) = predict_allele(prediction_class_object, allele, output_file, args)
+        write_output(response_text, output_mode, output_file)
+
+def predict_allele(prediction_class_object, allele, output_file, args):
+    def predict(input_file):
+        try:
+            return prediction_class_object.predict(input_file, allele, args.epitope_length, args.iedb_executable_path, args.iedb_retries)
+        except Exception as err:
+            if str(err) == 'len(peptide_list) != len(scores)':
+                return prediction_class_object.predict(input_file, allele, args.epitope_length, args.iedb_executable_path, args.iedb_retries)
+            else:
+                raise err
+
+    if args.prediction_cache is not None and args.epitope_length is not None:
+        with PredictionCache(args.prediction_cache, args.prediction_cache_size) as cache:
+            response = predict_with_cache(cache, predict, prediction_class_object, args.input_file, allele, args.epitope_length, args.iedb_executable_path)
+            print("{} - File {}".format(cache.statistics(), output_file))
+            return response
+    else:
+        return predict(args.input_file)
 
-    tmp_output_file = args.output_file + '.tmp'
+def write_output(response_text, output_mode, output_file):
+    tmp_output_file = output_file + '.tmp'
     if output_mode == 'pandas':
         response_text.to_csv(tmp_output_file, index=False, sep="\t")
     else:
         tmp_output_filehandle = open(tmp_output_file, output_mode)
         tmp_output_filehandle.write(response_text)
         tmp_output_filehandle.close()
-    os.replace(tmp_output_file, args.output_file)
+    os.replace(tmp_output_file, output_file)
 
 if __name__ == "__main__":
     main()
@@ -2,6 +2,7 @@ import argparse
 import sys
 import csv
 import pvactools.lib.sort
+import pvactools.lib.run_utils
 
 def main(args_input = sys.argv[1:]):
     parser = argparse.ArgumentParser('pvacseq combine_parsed_outputs', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
@@ -28,6 +29,11 @@ def main(args_input = sys.argv[1:]):
         default='pVACseq',
         help="Pipeline that created files to be combined."
     )
+    parser.add_argument(
+        '--parquet',
+        action='store_true',
+        help="Also write the combined output in Parquet format to a .parquet file next to the output .tsv file. Requires pyarrow."
+    )
     args = parser.parse_args(args_input)
 
     fieldnames = []
@@ -49,6 +55,11 @@ def main(args_input = sys.argv[1:]):
             for row in reader:
                 tsv_writer.writerow(row)
     args.output_file.close()
+    if args.parquet:
+        pvactools.lib.run_utils.write_parquet_report(
+            pvactools.lib.run_utils.read_report(args.output_file.name),
+            pvactools.lib.run_utils.parquet_report_path(args.output_file.name)
+        )
 
 if __name__ == "__main__":
     main()
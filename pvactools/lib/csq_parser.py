@@ -1,24 +1,82 @@
 import re
+from functools import lru_cache
+
+class CsqEntry:
+    #A single CSQ annotation that is only split into its fields once one of them
+    #is accessed. Fields are looked up by their precomputed position in the CSQ
+    #format, missing trailing fields behave like missing dictionary keys.
+    __slots__ = ('entry', 'positions', 'values')
+
+    def __init__(self, entry, positions):
+        self.entry = entry
+        self.positions = positions
+        self.values = None
+
+    def fields(self):
+        if self.values is None:
+            self.values = self.entry.split('|')
+        return self.values
+
+    def __contains__(self, key):
+        position = self.positions.get(key)
+        return position is not None and position < len(self.fields())
+
+    def __getitem__(self, key):
+        position = self.positions.get(key)
+        if position is None or position >= len(self.fields()):
+            raise KeyError(key)
+        return self.values[position]
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def keys(self):
+        return [key for (key, position) in self.positions.items() if position < len(self.fields())]
+
+    def __eq__(self, other):
+        if isinstance(other, CsqEntry):
+            other = dict(other.items())
+        return dict(self.items()) == other
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def __repr__(self):
+        return repr(dict(self.items()))
 
 class CsqParser:
-    def __init__(self, csq_header_description):
+    def __init__(self, csq_header_description, cache_size=4096):
         format_pattern = re.compile('Format: (.*)')
         match = format_pattern.search(csq_header_description)
         if match is None:
             raise Exception("Formatting error in the CSQ header description:\n{}\nNo match for regex `Format: (.*)`".format(csq_header_description))
         self.csq_format = match.group(1).split('|')
+        #Later duplicates of a field take precedence, same as when zipping the values into a dictionary
+        self.positions = {field: position for (position, field) in enumerate(self.csq_format)}
+        self.allele_position = self.positions.get('Allele')
+        #The CSQ entries of a record are decoded once and reused for every alt
+        #allele, and for records that get revisited, e.g. proximal variants
+        self.decode_csq_entries = lru_cache(maxsize=cache_size)(self.decode_csq_entries)
 
-    def parse_csq_entries_for_allele(self, csq_entries, csq_allele):
-        transcripts = []
+    @classmethod
+    @lru_cache(maxsize=None)
+    def for_header(cls, csq_header_description):
+        #Readers of VCFs with the same CSQ header share one parser and its cache
+        return cls(csq_header_description)
+
+    def decode_csq_entries(self, csq_entries):
+        decoded_entries = []
         for entry in csq_entries:
-            values = entry.split('|')
-            transcript = {}
-            for key, value in zip(self.csq_format, values):
-                transcript[key] = value
-            if transcript['Allele'] == csq_allele:
-                transcripts.append(transcript)
-
-        return transcripts
+            if self.allele_position is None:
+                allele = None
+            else:
+                values = entry.split('|', self.allele_position + 1)
+                allele = values[self.allele_position] if len(values) > self.allele_position else None
+            decoded_entries.append((allele, CsqEntry(entry, self.positions)))
+        return decoded_entries
+
+    def parse_csq_entries_for_allele(self, csq_entries, csq_allele):
+        return [transcript for (allele, transcript) in self.decode_csq_entries(tuple(csq_entries)) if allele == csq_allele]
 
     def resolve_alleles(self, entry):
         alleles = {}
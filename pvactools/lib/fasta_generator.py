@@ -3,11 +3,11 @@ import json
 import re
 import sys
 from collections import OrderedDict, defaultdict
-import yaml
 from abc import ABCMeta
 from Bio import SeqIO
 import itertools
 from pvactools.lib.proximal_variant import ProximalVariant
+from pvactools.lib.key_file import KeyFileWriter
 
 csv.field_size_limit(sys.maxsize)
 
@@ -31,7 +31,9 @@ class FastaGenerator(metaclass=ABCMeta):
         self.output_key_file            = kwargs['output_key_file']
         self.downstream_sequence_length = kwargs.pop('downstream_sequence_length', None)
         self.proximal_variants_file     = kwargs.pop('proximal_variants_file', None)
-        self.proximal_variants          = self.parse_proximal_variants_file()
+        self.proximal_variants          = kwargs.pop('proximal_variants', None)
+        if self.proximal_variants is None:
+            self.proximal_variants = self.parse_proximal_variants_file()
 
     def position_out_of_bounds(self, position, sequence):
         return position > len(sequence)-1
@@ -149,74 +151,89 @@ class FastaGenerator(metaclass=ABCMeta):
                 wildtype_subsequence_with_proximal_variants = wildtype_subsequence_with_proximal_variants[:proximal_variant_start_position] + proximal_variant_mutant_amino_acid + wildtype_subsequence_with_proximal_variants[proximal_variant_end_position:]
         return wildtype_subsequence_with_proximal_variants
 
-    def execute(self):
-        reader                  = open(self.input_file, 'r')
-        tsvin                   = csv.DictReader(reader, delimiter='\t')
-        fasta_sequences         = OrderedDict()
-        for line in tsvin:
-            variant_type = line['variant_type']
-            full_wildtype_sequence = line['wildtype_amino_acid_sequence']
-            if variant_type == 'FS':
-                position = int(line['protein_position'].split('-', 1)[0]) - 1
-            elif variant_type == 'missense' or variant_type == 'inframe_ins':
-                if '/' not in line['amino_acid_change']:
-                    continue
-                wildtype_amino_acid, mutant_amino_acid = line['amino_acid_change'].split('/')
-                if '*' in wildtype_amino_acid:
-                    wildtype_amino_acid = wildtype_amino_acid.split('*')[0]
-                elif 'X' in wildtype_amino_acid:
-                    wildtype_amino_acid = wildtype_amino_acid.split('X')[0]
-                if '*' in mutant_amino_acid:
-                    mutant_amino_acid = mutant_amino_acid.split('*')[0]
-                    stop_codon_added = True
-                elif 'X' in mutant_amino_acid:
-                    mutant_amino_acid = mutant_amino_acid.split('X')[0]
-                    stop_codon_added = True
-                else:
-                    stop_codon_added = False
-                if wildtype_amino_acid == '-':
-                    position = int(line['protein_position'].split('-', 1)[0])
-                    wildtype_amino_acid_length = 0
-                else:
-                    if '-' in line['protein_position']:
-                        position = int(line['protein_position'].split('-', 1)[0]) - 1
-                        wildtype_amino_acid_length = len(wildtype_amino_acid)
-                    else:
-                        position = int(line['protein_position']) - 1
-                        wildtype_amino_acid_length = len(wildtype_amino_acid)
-            elif variant_type == 'inframe_del':
-                variant_type = 'inframe_del'
-                wildtype_amino_acid, mutant_amino_acid = line['amino_acid_change'].split('/')
-                if '*' in wildtype_amino_acid:
-                    wildtype_amino_acid = wildtype_amino_acid.split('*')[0]
-                elif 'X' in wildtype_amino_acid:
-                    wildtype_amino_acid = wildtype_amino_acid.split('X')[0]
-                if '*' in mutant_amino_acid:
-                    mutant_amino_acid = mutant_amino_acid.split('*')[0]
-                    stop_codon_added = True
-                elif 'X' in mutant_amino_acid:
-                    mutant_amino_acid = mutant_amino_acid.split('X')[0]
-                    stop_codon_added = True
+    def parse_variant(self, line):
+        #Parses the parts of a TSV entry that don't depend on the epitope length
+        variant_type = line['variant_type']
+        full_wildtype_sequence = line['wildtype_amino_acid_sequence']
+        variant = {'line': line, 'variant_type': variant_type}
+        if variant_type == 'FS':
+            position = int(line['protein_position'].split('-', 1)[0]) - 1
+        elif variant_type == 'missense' or variant_type == 'inframe_ins':
+            if '/' not in line['amino_acid_change']:
+                return None
+            wildtype_amino_acid, mutant_amino_acid = line['amino_acid_change'].split('/')
+            if '*' in wildtype_amino_acid:
+                wildtype_amino_acid = wildtype_amino_acid.split('*')[0]
+            elif 'X' in wildtype_amino_acid:
+                wildtype_amino_acid = wildtype_amino_acid.split('X')[0]
+            if '*' in mutant_amino_acid:
+                mutant_amino_acid = mutant_amino_acid.split('*')[0]
+                stop_codon_added = True
+            elif 'X' in mutant_amino_acid:
+                mutant_amino_acid = mutant_amino_acid.split('X')[0]
+                stop_codon_added = True
+            else:
+                stop_codon_added = False
+            if wildtype_amino_acid == '-':
+                position = int(line['protein_position'].split('-', 1)[0])
+                wildtype_amino_acid_length = 0
+            else:
+                if '-' in line['protein_position']:
+                    position = int(line['protein_position'].split('-', 1)[0]) - 1
+                    wildtype_amino_acid_length = len(wildtype_amino_acid)
                 else:
-                    stop_codon_added = False
-                position = int(line['protein_position'].split('-', 1)[0]) - 1
-                wildtype_amino_acid_length = len(wildtype_amino_acid)
-                if mutant_amino_acid == '-':
-                    mutant_amino_acid = ''
+                    position = int(line['protein_position']) - 1
+                    wildtype_amino_acid_length = len(wildtype_amino_acid)
+        elif variant_type == 'inframe_del':
+            wildtype_amino_acid, mutant_amino_acid = line['amino_acid_change'].split('/')
+            if '*' in wildtype_amino_acid:
+                wildtype_amino_acid = wildtype_amino_acid.split('*')[0]
+            elif 'X' in wildtype_amino_acid:
+                wildtype_amino_acid = wildtype_amino_acid.split('X')[0]
+            if '*' in mutant_amino_acid:
+                mutant_amino_acid = mutant_amino_acid.split('*')[0]
+                stop_codon_added = True
+            elif 'X' in mutant_amino_acid:
+                mutant_amino_acid = mutant_amino_acid.split('X')[0]
+                stop_codon_added = True
             else:
-                continue
+                stop_codon_added = False
+            position = int(line['protein_position'].split('-', 1)[0]) - 1
+            wildtype_amino_acid_length = len(wildtype_amino_acid)
+            if mutant_amino_acid == '-':
+                mutant_amino_acid = ''
+        else:
+            return None
 
-            if self.position_out_of_bounds(position, full_wildtype_sequence):
-                continue
+        if self.position_out_of_bounds(position, full_wildtype_sequence):
+            return None
+        variant['position'] = position
 
+        if variant_type != 'FS':
             if variant_type == 'missense' and line['index'] in self.proximal_variants and line['protein_position'] in self.proximal_variants[line['index']]:
                 codon_changes = [ item['codon_change'] for item in self.proximal_variants[line['index']][line['protein_position']] ]
                 codon_changes.append(line['codon_change'])
                 mutant_amino_acid_with_proximal_variants = ProximalVariant.combine_conflicting_variants(codon_changes)
-            elif variant_type != 'FS':
+            else:
                 mutant_amino_acid_with_proximal_variants = mutant_amino_acid
-
-            if variant_type == 'FS':
+            variant['wildtype_amino_acid'] = wildtype_amino_acid
+            variant['wildtype_amino_acid_length'] = wildtype_amino_acid_length
+            variant['mutant_amino_acid_with_proximal_variants'] = mutant_amino_acid_with_proximal_variants
+            variant['stop_codon_added'] = stop_codon_added
+        return variant
+
+    def parse_variants(self):
+        with open(self.input_file, 'r') as reader:
+            tsvin = csv.DictReader(reader, delimiter='\t')
+            return [variant for variant in map(self.parse_variant, tsvin) if variant is not None]
+
+    def fasta_sequences(self, variants):
+        fasta_sequences = OrderedDict()
+        for variant in variants:
+            line = variant['line']
+            position = variant['position']
+            full_wildtype_sequence = line['wildtype_amino_acid_sequence']
+            if variant['variant_type'] == 'FS':
                 full_mutant_sequence = line['frameshift_amino_acid_sequence']
                 wildtype_subsequence, mutant_subsequence, left_flanking_subsequence = self.get_frameshift_subsequences(position, full_wildtype_sequence, full_mutant_sequence)
                 mutation_start_position = len(left_flanking_subsequence)
@@ -226,6 +243,9 @@ class FastaGenerator(metaclass=ABCMeta):
                 #we would need to recalculate the downstream protein sequence taking all downstream variants into account.
                 mutant_subsequence = re.sub('^%s' % left_flanking_subsequence, left_flanking_subsequence_with_proximal_variants, mutant_subsequence)
             else:
+                wildtype_amino_acid = variant['wildtype_amino_acid']
+                wildtype_amino_acid_length = variant['wildtype_amino_acid_length']
+                mutant_amino_acid_with_proximal_variants = variant['mutant_amino_acid_with_proximal_variants']
                 mutation_start_position, wildtype_subsequence = self.get_wildtype_subsequence(position, full_wildtype_sequence, wildtype_amino_acid_length, line)
                 mutation_end_position = mutation_start_position + wildtype_amino_acid_length
                 if wildtype_amino_acid != '-' and wildtype_amino_acid != wildtype_subsequence[mutation_start_position:mutation_end_position]:
@@ -236,7 +256,7 @@ class FastaGenerator(metaclass=ABCMeta):
                         sys.exit("ERROR: There was a mismatch between the actual wildtype amino acid sequence ({}) and the expected amino acid sequence ({}). Did you use the same reference build version for VEP that you used for creating the VCF?\n{}".format(wildtype_subsequence[mutation_start_position:mutation_end_position], wildtype_amino_acid, line))
                 wildtype_subsequence_with_proximal_variants = self.add_proximal_variants(line['index'], wildtype_subsequence, mutation_start_position, position, False)
                 wildtype_subsequence = self.add_proximal_variants(line['index'], wildtype_subsequence, mutation_start_position, position, True)
-                if stop_codon_added:
+                if variant['stop_codon_added']:
                     mutant_subsequence = wildtype_subsequence_with_proximal_variants[:mutation_start_position] + mutant_amino_acid_with_proximal_variants
                 else:
                     mutant_subsequence = wildtype_subsequence_with_proximal_variants[:mutation_start_position] + mutant_amino_acid_with_proximal_variants + wildtype_subsequence_with_proximal_variants[mutation_end_position:]
@@ -262,20 +282,38 @@ class FastaGenerator(metaclass=ABCMeta):
             for designation, subsequence in zip(['WT', 'MT'], [wildtype_subsequence, mutant_subsequence]):
                 key = '%s.%s' % (designation, variant_id)
                 fasta_sequences.setdefault(subsequence, []).append(key)
+        return fasta_sequences
 
+    def write_fasta_and_key_file(self, fasta_sequences):
         writer = open(self.output_file, 'w')
-        key_writer = open(self.output_key_file, 'w')
+        key_writer = KeyFileWriter(self.output_key_file)
         count  = 1
         for (subsequence, keys) in fasta_sequences.items():
             writer.writelines('>%s\n' % count)
             writer.writelines('%s\n' % subsequence)
-            yaml.dump({count: keys}, key_writer, default_flow_style=False)
+            key_writer.write(count, keys)
             count += 1
 
-        reader.close()
         writer.close()
         key_writer.close()
 
+    def execute(self):
+        self.write_fasta_and_key_file(self.fasta_sequences(self.parse_variants()))
+
+    @classmethod
+    def execute_for_lengths(cls, params, length_params):
+        #The TSV and proximal variants are parsed once and the subsequences for
+        #every epitope length, which only differ in their flank length, are
+        #derived from the same parsed variants
+        variants = None
+        proximal_variants = None
+        for length in length_params:
+            generator = cls(**params, **length, proximal_variants=proximal_variants)
+            proximal_variants = generator.proximal_variants
+            if variants is None:
+                variants = generator.parse_variants()
+            generator.write_fasta_and_key_file(generator.fasta_sequences(variants))
+
 class FusionFastaGenerator(FastaGenerator):
     def execute(self):
         reader                  = open(self.input_file, 'r')
@@ -317,12 +355,12 @@ class FusionFastaGenerator(FastaGenerator):
             fasta_sequences.setdefault(subsequence, []).append(line['index'])
 
         writer                  = open(self.output_file, 'w')
-        key_writer              = open(self.output_key_file, 'w')
+        key_writer              = KeyFileWriter(self.output_key_file)
         count                   = 1
         for (subsequence, keys) in fasta_sequences.items():
             writer.writelines('>%s\n' % count)
             writer.writelines('%s\n' % subsequence)
-            yaml.dump({count: keys}, key_writer, default_flow_style=False)
+            key_writer.write(count, keys)
             count += 1
 
         reader.close()
@@ -382,12 +420,12 @@ class VectorFastaGenerator():
             output_file = "{}.{}.tsv".format(self.output_file_prefix, length)
             output_key_file = "{}.key".format(output_file)
             writer = open(output_file, 'w')
-            key_writer = open(output_key_file, 'w')
+            key_writer = KeyFileWriter(output_key_file)
             count  = 1
             for (subsequence, keys) in sorted(fasta_sequences.items()):
                 writer.writelines('>%s\n' % count)
                 writer.writelines('%s\n' % subsequence)
-                yaml.dump({count: keys}, key_writer, default_flow_style=False)
+                key_writer.write(count, keys)
                 count += 1
 
             writer.close()
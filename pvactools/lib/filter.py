@@ -1,32 +1,58 @@
 import pandas as pd
-import csv
+import numpy as np
+import operator
 import sys
 
+import pvactools.lib.run_utils
+
 pd.options.mode.chained_assignment = None
 
+class FilterCriterion:
+    operators = {
+        '<': operator.lt,
+        '<=': operator.le,
+        '==': operator.eq,
+        '!=': operator.ne,
+        '>=': operator.ge,
+        '>': operator.gt,
+    }
+
+    def __init__(self, column, operator, threshold, exclude_nas):
+        if operator not in self.operators:
+            raise Exception("Unsupported filter operator {} for column {}".format(operator, column))
+        self.column = column
+        self.operator = self.operators[operator]
+        self.threshold = float(threshold)
+        self.exclude_nas = exclude_nas
+
+    def failing_rows(self, df):
+        (values, nas) = numeric_column(df[self.column])
+        #Comparisons against NaN are False so NA rows need to be set explicitly
+        to_filter = ~self.operator(values, self.threshold)
+        to_filter[nas] = self.exclude_nas
+        return to_filter
+
+def numeric_column(column):
+    values = column.astype(str)
+    nas = (values == 'NA').to_numpy()
+    values = values.replace('inf', str(sys.maxsize)).mask(nas, np.nan)
+    try:
+        return (pd.to_numeric(values).to_numpy(dtype=float), nas)
+    except ValueError as e:
+        raise Exception("Unable to filter on non-numeric values in column {}: {}".format(column.name, e))
+
 class Filter:
-    def __init__(self, input_file, output_file, filter_criteria, int_filter_columns=[]):
+    def __init__(self, input_file, output_file, filter_criteria, chunk_size=None):
         self.input_file = input_file
         self.output_file = output_file
-        self.filter_criteria = filter_criteria
-        self.int_filter_columns = int_filter_columns
+        self.filter_criteria = [FilterCriterion(**criteria) for criteria in filter_criteria]
+        self.chunk_size = chunk_size
 
     def execute(self):
-        with open(self.input_file, 'r') as read_fh, open(self.output_file, 'w') as write_fh:
-            reader = csv.DictReader(read_fh, delimiter="\t")
-            writer = csv.DictWriter(write_fh, delimiter='\t', fieldnames = reader.fieldnames, lineterminator="\n")
-            writer.writeheader()
-            for line in reader:
-                to_filter = False
-                for criteria in self.filter_criteria:
-                    value = line[criteria['column']]
-                    if value == 'inf':
-                        value = sys.maxsize
-                    if value == 'NA':
-                        if criteria['exclude_nas']:
-                            to_filter = True
-                    else:
-                        if not eval("{} {} {}".format(value, criteria['operator'], criteria['threshold'])):
-                            to_filter = True
-                if not to_filter:
-                    writer.writerow(line)
+        pvactools.lib.run_utils.filter_report(self.input_file, self.output_file, self.filter_df, self.chunk_size)
+
+    def filter_df(self, df):
+        to_filter = np.zeros(len(df), dtype=bool)
+        for criteria in self.filter_criteria:
+            to_filter |= criteria.failing_rows(df)
+        return df[~to_filter]
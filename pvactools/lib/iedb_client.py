@@ -0,0 +1,93 @@
+import os
+import time
+import random
+import threading
+import datetime
+import email.utils
+from contextlib import contextmanager
+import requests
+from requests.adapters import HTTPAdapter
+
+#Status codes that the IEDB RESTful web interface returns when it is overloaded
+RETRY_STATUS_CODES = [403, 429, 500, 502, 503, 504]
+BACKOFF_BASE_SECONDS = 10
+BACKOFF_MAX_SECONDS = 300
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+_request_limit = None
+_random = random.SystemRandom()
+
+def session():
+    #Sessions can't be shared with forked worker processes so every process
+    #gets its own connection pool
+    global _session, _session_pid
+    with _session_lock:
+        if _session is None or _session_pid != os.getpid():
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=2, pool_maxsize=16)
+            _session.mount('http://', adapter)
+            _session.mount('https://', adapter)
+            _session_pid = os.getpid()
+    return _session
+
+def set_request_limit(limit):
+    #The limit can either be a number of concurrent requests for the current
+    #process or a multiprocessing.Semaphore shared between worker processes
+    global _request_limit
+    if limit is None:
+        _request_limit = None
+    elif isinstance(limit, int):
+        _request_limit = threading.BoundedSemaphore(limit)
+    else:
+        _request_limit = limit
+
+@contextmanager
+def request_slot():
+    if _request_limit is None:
+        yield
+    else:
+        _request_limit.acquire()
+        try:
+            yield
+        finally:
+            _request_limit.release()
+
+def retry_after_seconds(response):
+    headers = getattr(response, 'headers', None)
+    if not headers or 'Retry-After' not in headers:
+        return None
+    value = headers['Retry-After'].strip()
+    if value.isdigit():
+        return int(value)
+    try:
+        retry_date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0, (retry_date - datetime.datetime.now(retry_date.tzinfo)).total_seconds())
+
+def retry_delay(retries, response=None):
+    retry_after = retry_after_seconds(response) if response is not None else None
+    if retry_after is not None:
+        return retry_after
+    delay = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** (retries - 1))
+    return delay / 2 + _random.uniform(0, delay / 2)
+
+def post(url, data, iedb_retries):
+    retries = 0
+    while True:
+        response = None
+        try:
+            with request_slot():
+                response = session().post(url, data=data)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            if retries >= iedb_retries:
+                raise
+        else:
+            if response.status_code not in RETRY_STATUS_CODES or retries >= iedb_retries:
+                return response
+        retries += 1
+        delay = retry_delay(retries, response)
+        print("IEDB: Retry %s of %s in %.0f seconds" % (retries, iedb_retries, delay))
+        time.sleep(delay)
@@ -1,7 +1,10 @@
 import vcfpy
+import pysam
 import csv
 import sys
 import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 from abc import ABCMeta
 from collections import OrderedDict
 from pvactools.lib.csq_parser import CsqParser
@@ -59,6 +62,8 @@ class VcfConverter(InputFileConverter):
         self.proximal_variants_vcf = kwargs.pop('proximal_variants_vcf', None)
         self.proximal_variants_tsv = kwargs.pop('proximal_variants_tsv', None)
         self.flanking_bases = kwargs.pop('flanking_bases', None)
+        self.contigs = kwargs.pop('contigs', None)
+        self.n_threads = kwargs.pop('n_threads', 1)
         if self.proximal_variants_vcf and not (self.proximal_variants_tsv and self.flanking_bases):
             sys.exit("A proximal variants TSV output path and number of flanking bases need to be specified if a proximal variants input VCF is provided.")
         if self.proximal_variants_vcf and not pvactools.lib.run_utils.is_gz_file(self.input_file):
@@ -74,7 +79,7 @@ class VcfConverter(InputFileConverter):
             self.proximal_variants_writer = csv.DictWriter(self.proximal_variants_tsv_fh, delimiter='\t', fieldnames=['chromosome_name', 'start', 'stop', 'reference', 'variant', 'amino_acid_change', 'codon_change', 'protein_position', 'type', 'main_somatic_variant'])
             self.proximal_variants_writer.writeheader()
             self.proximal_variant_parser = ProximalVariant(self.proximal_variants_vcf, self.pass_only, self.flanking_bases)
-            self.somatic_vcf_reader = vcfpy.Reader.from_path(self.input_file)
+            self.somatic_tabix_file = pysam.TabixFile(self.input_file)
         self.vcf_reader = vcfpy.Reader.from_path(self.input_file)
         sample_names = self.vcf_reader.header.samples.names
         if len(sample_names) > 1:
@@ -90,7 +95,8 @@ class VcfConverter(InputFileConverter):
             if self.normal_sample_name is not None:
                 sys.exit("normal_sample_name {} provided but the input file is a single-sample (tumor only) VCF".format(self.normal_sample_name))
             self.sample_name = sample_names[0]
-        if 'GT' not in self.vcf_reader.header.format_ids():
+        self.format_ids = set(self.vcf_reader.header.format_ids())
+        if 'GT' not in self.format_ids:
             sys.exit("VCF doesn't contain any sample genotype information. Add a dummy sample using the vcf-genotype-annotator tool available as part of the vatools package.")
         self.writer = open(self.output_file, 'w')
         self.tsv_writer = csv.DictWriter(self.writer, delimiter='\t', fieldnames=self.output_headers(), restval='NA')
@@ -116,7 +122,7 @@ class VcfConverter(InputFileConverter):
         if csq_header is None:
             sys.exit('Failed to extract format string from info description for tag (CSQ)')
         else:
-            return CsqParser(csq_header.description)
+            return CsqParser.for_header(csq_header.description)
 
     def resolve_consequence(self, consequence_string, ref, alt):
         if '&' in consequence_string:
@@ -219,7 +225,7 @@ class VcfConverter(InputFileConverter):
     def write_proximal_variant_entries(self, entry, alt, transcript_name, index):
         proximal_variants = self.proximal_variant_parser.extract(entry, alt, transcript_name)
         for (proximal_variant, csq_entry, proximal_alt) in proximal_variants:
-            if len(list(self.somatic_vcf_reader.fetch(proximal_variant.CHROM, proximal_variant.POS - 1 , proximal_variant.POS))) > 0:
+            if next(self.somatic_tabix_file.fetch(proximal_variant.CHROM, proximal_variant.POS - 1 , proximal_variant.POS), None) is not None:
                 proximal_variant_type = 'somatic'
             else:
                 proximal_variant_type = 'germline'
@@ -255,19 +261,91 @@ class VcfConverter(InputFileConverter):
         self.vcf_reader.close()
         if self.proximal_variants_vcf:
             self.proximal_variants_tsv_fh.close()
-            self.proximal_variant_parser.proximal_variants_vcf.close()
-            self.somatic_vcf_reader.close
+            self.proximal_variant_parser.close()
+            self.somatic_tabix_file.close()
 
     def decode_hex(self, string):
         hex_string = string.group(0).replace('%', '')
         return binascii.unhexlify(hex_string).decode('utf-8')
 
+    def shard_contigs(self):
+        #Sharding by contig requires a tabix index to fetch the entries of each contig
+        if self.n_threads <= 1 or self.contigs is not None:
+            return None
+        if not pvactools.lib.run_utils.is_gz_file(self.input_file) or not os.path.exists(self.input_file + '.tbi'):
+            return None
+        with pysam.TabixFile(self.input_file) as tabix_file:
+            contigs = list(tabix_file.contigs)
+        if len(contigs) < 2:
+            return None
+        #Consecutive contigs are grouped into one shard per thread to keep the file order
+        shard_count = min(self.n_threads, len(contigs))
+        return [contigs[i * len(contigs) // shard_count:(i + 1) * len(contigs) // shard_count] for i in range(shard_count)]
+
+    def contig_entries(self):
+        with pysam.TabixFile(self.input_file) as tabix_file:
+            for contig in self.contigs:
+                for line in tabix_file.fetch(contig):
+                    yield self.vcf_reader.parser.parse_line(line)
+
     def execute(self):
-        indexes = []
+        shards = self.shard_contigs()
+        if shards is None:
+            self.convert_entries()
+        else:
+            self.convert_shards(shards)
+        self.close_filehandles()
+
+    def convert_shards(self, shards):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            shard_params = []
+            for (i, contigs) in enumerate(shards):
+                params = {
+                    'input_file'        : self.input_file,
+                    'output_file'       : os.path.join(tmp_dir, "{}.tsv".format(i)),
+                    'sample_name'       : self.sample_name,
+                    'normal_sample_name': self.normal_sample_name,
+                    'pass_only'         : self.pass_only,
+                    'contigs'           : contigs,
+                }
+                if self.proximal_variants_vcf:
+                    params['proximal_variants_vcf'] = self.proximal_variants_vcf
+                    params['proximal_variants_tsv'] = os.path.join(tmp_dir, "{}.proximal_variants.tsv".format(i))
+                    params['flanking_bases'] = self.flanking_bases
+                shard_params.append(params)
+            with ProcessPoolExecutor(max_workers=self.n_threads) as executor:
+                index_counts = list(executor.map(convert_vcf_shard, shard_params))
+
+            #The tabix contigs are in file order so appending the shards in that order and
+            #offsetting their index counters reproduces the output of a sequential conversion
+            offset = 0
+            for (params, index_count) in zip(shard_params, index_counts):
+                self.append_shard(params['output_file'], self.writer, 'index', offset)
+                if self.proximal_variants_vcf:
+                    self.append_shard(params['proximal_variants_tsv'], self.proximal_variants_tsv_fh, 'main_somatic_variant', offset)
+                offset += index_count
+        self.index_count = offset
+
+    def append_shard(self, shard_file, output_fh, index_column, offset):
+        writer = csv.writer(output_fh, delimiter='\t')
+        with open(shard_file, 'r') as shard_fh:
+            reader = csv.reader(shard_fh, delimiter='\t')
+            index_position = next(reader).index(index_column)
+            for row in reader:
+                (count, index) = row[index_position].split('.', 1)
+                row[index_position] = "{}.{}".format(int(count) + offset, index)
+                writer.writerow(row)
+
+    def convert_entries(self):
+        indexes = set()
         count = 1
+        if self.contigs is None:
+            entries = iter(self.vcf_reader)
+        else:
+            entries = self.contig_entries()
         while True:
             try:
-                entry = next(self.vcf_reader)
+                entry = next(entries)
             except StopIteration:
                 break
             except ValueError as e:
@@ -344,7 +422,7 @@ class VcfConverter(InputFileConverter):
                     if index in indexes:
                         sys.exit("Warning: TSV index already exists: {}".format(index))
                     else:
-                        indexes.append(index)
+                        indexes.add(index)
                         count += 1
 
                     if self.proximal_variants_vcf:
@@ -408,7 +486,7 @@ class VcfConverter(InputFileConverter):
                         output_row['codon_change'] = 'NA'
 
                     for (tag, key, comparison_fields) in zip(['TX', 'GX'], ['transcript_expression', 'gene_expression'], [[transcript_name], [ensembl_gene_id, gene_name]]):
-                        if tag in self.vcf_reader.header.format_ids():
+                        if tag in self.format_ids:
                             if tag in genotype.data:
                                 expressions = genotype.data[tag]
                                 if isinstance(expressions, list):
@@ -427,7 +505,12 @@ class VcfConverter(InputFileConverter):
 
                     self.tsv_writer.writerow(output_row)
 
-        self.close_filehandles()
+        self.index_count = count - 1
+
+def convert_vcf_shard(params):
+    converter = VcfConverter(**params)
+    converter.execute()
+    return converter.index_count
 
 class FusionInputConverter(InputFileConverter):
     def determine_fusion_sequence(self, full_sequence, variant_type):
@@ -0,0 +1,75 @@
+import argparse
+import sys
+import yaml
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+#Key files map the numeric header of each FASTA sequence to the identifiers of
+#the variants or peptides that sequence was generated from. The compact format
+#is a tab-separated table with one line per sequence:
+#
+#    #pvactools-key-file
+#    1<TAB>WT.1.GENE.TRANSCRIPT<TAB>...
+#    2<TAB>MT.1.GENE.TRANSCRIPT<TAB>...
+#
+#Key files written in the original YAML format can still be read and a key
+#file can be exported to YAML for debugging with
+#`python -m pvactools.lib.key_file <key_file> <output_file>`.
+
+HEADER = '#pvactools-key-file'
+
+class KeyFileWriter:
+    def __init__(self, path):
+        self.path = path
+        self.writer = open(path, 'w')
+        self.empty = True
+
+    def write(self, label, identifiers):
+        #Key files without any sequences stay empty, same as the YAML ones
+        if self.empty:
+            self.writer.write("{}\n".format(HEADER))
+            self.empty = False
+        self.writer.write("{}\t{}\n".format(label, "\t".join(identifiers)))
+
+    def close(self):
+        self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def write_key_file(keys, path, yaml_format=False):
+    if yaml_format:
+        with open(path, 'w') as writer:
+            for (label, identifiers) in keys.items():
+                yaml.dump({label: identifiers}, writer, default_flow_style=False)
+        return
+    with KeyFileWriter(path) as writer:
+        for (label, identifiers) in keys.items():
+            writer.write(label, identifiers)
+
+def read_key_file(path):
+    with open(path, 'r') as reader:
+        first_line = reader.readline()
+        if first_line.rstrip('\n') != HEADER:
+            reader.seek(0)
+            return yaml.load(reader, Loader=SafeLoader) or {}
+        keys = {}
+        for line in reader:
+            (label, *identifiers) = line.rstrip('\n').split('\t')
+            keys[int(label)] = identifiers
+        return keys
+
+def main(args_input = sys.argv[1:]):
+    parser = argparse.ArgumentParser('pvactools key_file', description="Export a FASTA key file to YAML.")
+    parser.add_argument('input_file', help="Key file to export.")
+    parser.add_argument('output_file', help="YAML output file.")
+    args = parser.parse_args(args_input)
+    write_key_file(read_key_file(args.input_file), args.output_file, yaml_format=True)
+
+if __name__ == "__main__":
+    main()
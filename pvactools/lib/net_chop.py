@@ -13,19 +13,108 @@ import logging
 import random
 from requests.adapters import HTTPAdapter
 from requests.packages.urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor
+from subprocess import run
 
 import pvactools.lib.run_utils
+from pvactools.lib.prediction_cache import PredictionCache
 
 methods = ['cterm', '20s']
 
+class NetChopWebBackend:
+    def __init__(self):
+        self.http = self.setup_adapter()
+
+    def max_workers(self, n_threads):
+        return pvactools.lib.run_utils.DTU_SERVER_MAX_IN_FLIGHT
+
+    def predict(self, staging_file, chosen_method, threshold):
+        rejected_searcher = re.compile(r'status: rejected')
+        with pvactools.lib.run_utils.dtu_server_slots:
+            response = self.query_netchop_server(staging_file, chosen_method, threshold)
+            while rejected_searcher.search(response.content.decode()):
+                logging.warning("Too many jobs submitted to NetChop server. Waiting to retry.")
+                sleep(random.randint(5, 10))
+                staging_file.seek(0)
+                response = self.query_netchop_server(staging_file, chosen_method, threshold)
+        return response.content.decode()
+
+    def close(self):
+        self.http.close()
+
+    def setup_adapter(self):
+        retry_strategy = Retry(
+            total=3,
+            status_forcelist=[408, 429, 500, 502, 503, 504],
+            allowed_methods=["POST", "GET"]
+        )
+        adapter = HTTPAdapter(max_retries=retry_strategy, pool_maxsize=pvactools.lib.run_utils.DTU_SERVER_MAX_IN_FLIGHT)
+        http = requests.Session()
+        http.mount("https://", adapter)
+        http.mount("http://", adapter)
+        return http
+
+    def query_netchop_server(self, staging_file, chosen_method, threshold):
+        jobid_searcher = re.compile(r'<!-- jobid: [0-9a-fA-F]*? status: (queued|active)')
+        try:
+            response = self.post_query(staging_file, chosen_method, threshold)
+        except Timeout:
+            raise Exception("Timeout while posting request to NetChop server. The server may be unresponsive. Please try again later.")
+        if response.status_code != 200:
+            raise Exception("Error posting request to NetChop server.\n{}".format(response.content.decode()))
+        while jobid_searcher.search(response.content.decode()):
+            sleep(10)
+            try:
+                response = self.http.get(response.url, timeout=(10,60))
+            except Timeout:
+                raise Exception("Timeout while posting request to NetChop server. The server may be unresponsive. Please try again later.")
+            if response.status_code != 200:
+                raise Exception("Error posting request to NetChop server.\n{}".format(response.content.decode()))
+        return response
+
+    def post_query(self, staging_file, chosen_method, threshold):
+        response = self.http.post(
+            "https://services.healthtech.dtu.dk/cgi-bin/webface2.cgi",
+            files={'SEQSUB':(staging_file.name, staging_file, 'text/plain')},
+            data = {
+                'configfile':'/var/www/html/services/NetChop-3.1/webface.cf',
+                'SEQPASTE':'',
+                'method':chosen_method,
+                'thresh':'%0f'%threshold
+            },
+            timeout=(10,60)
+        )
+        return response
+
+class NetChopLocalBackend:
+    def __init__(self, net_chop_path):
+        self.net_chop_path = net_chop_path
+
+    def max_workers(self, n_threads):
+        return n_threads
+
+    def predict(self, staging_file, chosen_method, threshold):
+        arguments = [self.net_chop_path, '-v', chosen_method, '-t', '%0f'%threshold, staging_file.name]
+        with tempfile.TemporaryFile(mode='w+') as result_fh:
+            run(arguments, stdout=result_fh, check=True)
+            result_fh.seek(0)
+            return result_fh.read()
+
+    def close(self):
+        pass
+
 class NetChop:
-    def __init__(self, input_file, input_fasta, output_file, method='cterm', threshold=0.5, file_type='pVACseq'):
+    def __init__(self, input_file, input_fasta, output_file, method='cterm', threshold=0.5, file_type='pVACseq', n_threads=1, net_chop_path=None, prediction_cache=None, prediction_cache_size=None):
         self.input_file = input_file
         self.input_fasta = input_fasta
         self.output_file = output_file
         self.method = method
         self.threshold = float(threshold)
         self.file_type = file_type
+        self.n_threads = n_threads
+        self.net_chop_path = net_chop_path
+        self.prediction_cache = prediction_cache
+        self.prediction_cache_size = prediction_cache_size
 
     def get_mt_peptides(self):
         records = list(SeqIO.parse(self.input_fasta, "fasta"))
@@ -49,12 +138,6 @@ class NetChop:
 
     def execute(self):
         chosen_method = str(methods.index(self.method))
-        result_delimiter = re.compile(r'-{20,}')
-
-        fail_searcher = re.compile(r'(Failed run|Problematic input:|Unrecognized parameter:)')
-        rejected_searcher = re.compile(r'status: rejected')
-        success_searcher = re.compile(r'NetChop 3.0 predictions')
-
         mt_records_dict = self.get_mt_peptides()
         with open(self.input_file) as input_fh, open(self.output_file, 'w') as output_fh:
             reader = csv.DictReader(input_fh, delimiter='\t')
@@ -66,138 +149,141 @@ class NetChop:
                 lineterminator='\n'
             )
             writer.writeheader()
-            x = 0
-            i=1
-            http = self.setup_adapter()
-            for chunk in pvactools.lib.run_utils.split_file(reader, 100):
-                staging_file = tempfile.NamedTemporaryFile(mode='w+')
-                current_buffer = {}
-                seqs_start_diff = {}
-                for line in chunk:
-                    sequence_id = ('%010x'%x)[-10:]
-                    staging_file.write('>'+sequence_id+'\n')
-                    if self.file_type == 'pVACbind' or self.file_type == 'pVACfuse':
-                        index = line['Mutation']
-                        epitope = line['Epitope Seq']
-                    else:
-                        index = line['Index']
-                        epitope = line['MT Epitope Seq']
-                    if index not in mt_records_dict:
-                        raise Exception("FASTA entry for index {} not found. Please check that the FASTA file matches the input TSV.".format(index))
-                    full_peptide = mt_records_dict[index]
-                    peptide, start_diff = self.extract_flanked_epitope(full_peptide, epitope, index)
-                    staging_file.write(peptide+'\n')
-                    current_buffer[sequence_id] = {k:line[k] for k in line}
-                    seqs_start_diff[sequence_id] = (start_diff, len(epitope))
-                    x+=1
-                staging_file.seek(0)
-                response = self.query_netchop_server(http, staging_file, chosen_method, self.threshold)
-
-                if fail_searcher.search(response.content.decode()):
-                    raise Exception("NetChop encountered an error during processing.\n{}".format(response.content.decode()))
-
-                while rejected_searcher.search(response.content.decode()):
-                    logging.warning("Too many jobs submitted to NetChop server. Waiting to retry.")
-                    sleep(random.randint(5, 10))
-                    staging_file.seek(0)
-                    response = self.query_netchop_server(http, staging_file, chosen_method, self.threshold)
-
-                if success_searcher.search(response.content.decode()):
-                    results = [item.strip() for item in result_delimiter.split(response.content.decode())]
-                    for i in range(2, len(results), 4): #examine only the parts we want, skipping all else
-                        score = -1
-                        pos = 0
-                        sequence_name = False
-                        start_diff = False
-                        ep_len = False
-                        cleavage_scores = {}
-                        for line in results[i].split('\n'):
-                            data = [word for word in line.strip().split(' ') if len(word)]
-                            if not sequence_name:
-                                sequence_name = data[4]
-                                start_diff = seqs_start_diff[sequence_name][0]
-                                ep_len = seqs_start_diff[sequence_name][1]
-                            currentPosition = data[0]
-                            isCleavage = data[2]
-                            if isCleavage != 'S':
-                                continue
-                            currentScore = float(data[3])
-                            cleavage_scores[currentPosition] = currentScore
-                        if len(cleavage_scores) == 0:
-                            best_cleavage_position = 'NA'
-                            best_cleavage_score = 'NA'
-                            cleavage_sites = 'NA'
-                        else:
-                            #filter out cleavage sites outside epitope and adjust positions in accordance
-                            epitope_cleavage_scores = [
-                                (x[0] - start_diff, x[1])
-                                for x in map(lambda x: (int(x[0]), x[1]), cleavage_scores.items())
-                                if x[0] >= start_diff and x[0] <= start_diff + ep_len
-                            ]
-                            if len(epitope_cleavage_scores) == 0:
-                                best_cleavage_position = 'NA'
-                                best_cleavage_score = 'NA'
-                                cleavage_sites = 'NA'
-                            else:
-                                max_cleavage_score = max(epitope_cleavage_scores, key=lambda x: x[1])
-                                best_cleavage_position = max_cleavage_score[0]
-                                best_cleavage_score = max_cleavage_score[1]
-                                sorted_cleavage_scores = collections.OrderedDict(sorted(epitope_cleavage_scores))
-                                cleavage_sites = ','.join(['%s:%s' % (key, value) for (key, value) in sorted_cleavage_scores.items()])
-                        line = current_buffer[sequence_name]
-                        line.update({
-                            'Best Cleavage Position': best_cleavage_position,
-                            'Best Cleavage Score'   : best_cleavage_score,
-                            'Cleavage Sites'        : cleavage_sites,
-                        })
-                        writer.writerow(line)
+            rows = []
+            for line in reader:
+                if self.file_type == 'pVACbind' or self.file_type == 'pVACfuse':
+                    index = line['Mutation']
+                    epitope = line['Epitope Seq']
                 else:
-                    raise Exception("Unexpected return value from NetChop server. Unable to parse response.\n{}".format(response.content.decode()))
-            http.close()
+                    index = line['Index']
+                    epitope = line['MT Epitope Seq']
+                if index not in mt_records_dict:
+                    raise Exception("FASTA entry for index {} not found. Please check that the FASTA file matches the input TSV.".format(index))
+                full_peptide = mt_records_dict[index]
+                peptide, start_diff = self.extract_flanked_epitope(full_peptide, epitope, index)
+                rows.append((line, peptide, start_diff, len(epitope)))
 
-    def setup_adapter(self):
-        retry_strategy = Retry(
-            total=3,
-            status_forcelist=[408, 429, 500, 502, 503, 504],
-            allowed_methods=["POST", "GET"]
-        )
-        adapter = HTTPAdapter(max_retries=retry_strategy)
-        http = requests.Session()
-        http.mount("https://", adapter)
-        http.mount("http://", adapter)
-        return http
+            #the cleavage sites only depend on the flanked peptide so every peptide is predicted once
+            peptides = list(collections.OrderedDict.fromkeys(peptide for (line, peptide, start_diff, ep_len) in rows))
+            if self.prediction_cache is not None:
+                with PredictionCache(self.prediction_cache, self.prediction_cache_size) as cache:
+                    cleavage_scores = self.lookup_cleavage_scores(cache, peptides)
+                    new_cleavage_scores = self.predict_cleavage_scores(chosen_method, [peptide for peptide in peptides if peptide not in cleavage_scores])
+                    self.store_cleavage_scores(cache, new_cleavage_scores)
+                    print(cache.statistics())
+                cleavage_scores.update(new_cleavage_scores)
+            else:
+                cleavage_scores = self.predict_cleavage_scores(chosen_method, peptides)
 
-    def query_netchop_server(self, http, staging_file, chosen_method, threshold):
-        jobid_searcher = re.compile(r'<!-- jobid: [0-9a-fA-F]*? status: (queued|active)')
-        try:
-            response = self.post_query(http, staging_file, chosen_method, threshold)
-        except Timeout:
-            raise Exception("Timeout while posting request to NetChop server. The server may be unresponsive. Please try again later.")
-        if response.status_code != 200:
-            raise Exception("Error posting request to NetChop server.\n{}".format(response.content.decode()))
-        while jobid_searcher.search(response.content.decode()):
-            sleep(10)
-            try:
-                response = http.get(response.url, timeout=(10,60))
-            except Timeout:
-                raise Exception("Timeout while posting request to NetChop server. The server may be unresponsive. Please try again later.")
-            if response.status_code != 200:
-                raise Exception("Error posting request to NetChop server.\n{}".format(response.content.decode()))
-        return response
+            for (line, peptide, start_diff, ep_len) in rows:
+                line.update(self.best_cleavage_sites(cleavage_scores[peptide], start_diff, ep_len))
+                writer.writerow(line)
 
-    def post_query(self, http, staging_file, chosen_method, threshold):
-        response = http.post(
-            "https://services.healthtech.dtu.dk/cgi-bin/webface2.cgi",
-            files={'SEQSUB':(staging_file.name, staging_file, 'text/plain')},
-            data = {
-                'configfile':'/var/www/html/services/NetChop-3.1/webface.cf',
-                'SEQPASTE':'',
-                'method':chosen_method,
-                'thresh':'%0f'%threshold
-            },
-            timeout=(10,60)
-        )
-        return response
+    def cache_version(self):
+        #the cleavage sites of a peptide depend on the prediction method and threshold
+        return "{}:{}".format(self.method, '%0f'%self.threshold)
+
+    def lookup_cleavage_scores(self, cache, peptides):
+        cleavage_scores = {}
+        for (length, length_peptides) in self.peptides_by_length(peptides).items():
+            cleavage_scores.update(cache.lookup('NetChop', self.cache_version(), '', length, length_peptides))
+        return cleavage_scores
+
+    def store_cleavage_scores(self, cache, cleavage_scores):
+        for (length, length_peptides) in self.peptides_by_length(cleavage_scores.keys()).items():
+            cache.store('NetChop', self.cache_version(), '', length, {peptide: cleavage_scores[peptide] for peptide in length_peptides})
+
+    def peptides_by_length(self, peptides):
+        peptides_by_length = collections.defaultdict(list)
+        for peptide in peptides:
+            peptides_by_length[len(peptide)].append(peptide)
+        return peptides_by_length
+
+    def predict_cleavage_scores(self, chosen_method, peptides):
+        sequences = [(('%010x'%x)[-10:], peptide) for (x, peptide) in enumerate(peptides)]
+        chunks = list(pvactools.lib.run_utils.split_file(sequences, 100))
+        cleavage_scores = {}
+        if len(chunks) == 0:
+            return cleavage_scores
+        backend = self.backend()
+        with ThreadPoolExecutor(max_workers=max(1, min(backend.max_workers(self.n_threads), len(chunks)))) as executor:
+            for chunk_cleavage_scores in executor.map(lambda chunk: self.process_chunk(backend, chosen_method, chunk), chunks):
+                cleavage_scores.update(chunk_cleavage_scores)
+        backend.close()
+        return cleavage_scores
+
+    def backend(self):
+        if self.net_chop_path is not None:
+            return NetChopLocalBackend(self.net_chop_path)
+        else:
+            return NetChopWebBackend()
+
+    def process_chunk(self, backend, chosen_method, sequences):
+        result_delimiter = re.compile(r'-{20,}')
+        fail_searcher = re.compile(r'(Failed run|Problematic input:|Unrecognized parameter:)')
+        #the reported NetChop version differs between the server and local installations
+        success_searcher = re.compile(r'NetChop \d+\.\d+ predictions')
+
+        with tempfile.NamedTemporaryFile(mode='w+') as staging_file:
+            for (sequence_id, peptide) in sequences:
+                staging_file.write('>'+sequence_id+'\n')
+                staging_file.write(peptide+'\n')
+            staging_file.flush()
+            staging_file.seek(0)
+            content = backend.predict(staging_file, chosen_method, self.threshold)
+
+        if fail_searcher.search(content):
+            raise Exception("NetChop encountered an error during processing.\n{}".format(content))
+
+        if not success_searcher.search(content):
+            raise Exception("Unexpected return value from NetChop server. Unable to parse response.\n{}".format(content))
+
+        peptides = dict(sequences)
+        cleavage_scores_for_peptide = {}
+        results = [item.strip() for item in result_delimiter.split(content)]
+        for i in range(2, len(results), 4): #examine only the parts we want, skipping all else
+            sequence_name = False
+            cleavage_scores = {}
+            for line in results[i].split('\n'):
+                data = [word for word in line.strip().split(' ') if len(word)]
+                if not sequence_name:
+                    sequence_name = data[4]
+                currentPosition = data[0]
+                isCleavage = data[2]
+                if isCleavage != 'S':
+                    continue
+                currentScore = float(data[3])
+                cleavage_scores[currentPosition] = currentScore
+            cleavage_scores_for_peptide[peptides[sequence_name]] = cleavage_scores
+        return cleavage_scores_for_peptide
+
+    def best_cleavage_sites(self, cleavage_scores, start_diff, ep_len):
+        if len(cleavage_scores) == 0:
+            best_cleavage_position = 'NA'
+            best_cleavage_score = 'NA'
+            cleavage_sites = 'NA'
+        else:
+            #filter out cleavage sites outside epitope and adjust positions in accordance
+            epitope_cleavage_scores = [
+                (x[0] - start_diff, x[1])
+                for x in map(lambda x: (int(x[0]), x[1]), cleavage_scores.items())
+                if x[0] >= start_diff and x[0] <= start_diff + ep_len
+            ]
+            if len(epitope_cleavage_scores) == 0:
+                best_cleavage_position = 'NA'
+                best_cleavage_score = 'NA'
+                cleavage_sites = 'NA'
+            else:
+                max_cleavage_score = max(epitope_cleavage_scores, key=lambda x: x[1])
+                best_cleavage_position = max_cleavage_score[0]
+                best_cleavage_score = max_cleavage_score[1]
+                sorted_cleavage_scores = collections.OrderedDict(sorted(epitope_cleavage_scores))
+                cleavage_sites = ','.join(['%s:%s' % (key, value) for (key, value) in sorted_cleavage_scores.items()])
+        return {
+            'Best Cleavage Position': best_cleavage_position,
+            'Best Cleavage Score'   : best_cleavage_score,
+            'Cleavage Sites'        : cleavage_sites,
+        }
 
     @classmethod
     def parser(cls, tool):
@@ -230,6 +316,29 @@ class NetChop:
             help="NetChop prediction threshold.",
             default=0.5
         )
+        parser.add_argument(
+            "-t", "--n-threads",type=int,
+            default=1,
+            help="Number of threads to use for running a local NetChop installation on the input chunks in parallel. "
+                 + "Chunks submitted to the NetChop server are limited to {} jobs in flight across all threads and concurrent pipelines.".format(pvactools.lib.run_utils.DTU_SERVER_MAX_IN_FLIGHT),
+        )
+        parser.add_argument(
+            '--net-chop-path',
+            default=None,
+            help="NetChop installation path. If provided, NetChop is run locally instead of on the NetChop server.",
+        )
+        parser.add_argument(
+            '--prediction-cache',
+            default=None,
+            help="Path to a prediction cache database that is shared between runs. "
+                 + "Cleavage sites of peptides that were already predicted with the same method and threshold "
+                 + "will be read from the cache instead of being predicted again.",
+        )
+        parser.add_argument(
+            '--prediction-cache-size', type=int,
+            default=None,
+            help="Maximum number of entries to keep in the prediction cache. Least recently used entries are evicted first.",
+        )
         return parser
 
 # if __name__ == '__main__':
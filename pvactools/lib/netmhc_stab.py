@@ -15,135 +15,45 @@ from Bio import SeqIO
 from Bio.Seq import Seq
 from Bio.SeqRecord import SeqRecord
 from Bio.Alphabet import IUPAC
+from concurrent.futures import ThreadPoolExecutor
+from subprocess import run, CalledProcessError
 
 import pvactools.lib.run_utils
 from pvactools.lib.prediction_class import MHCI
 import pvactools.lib.sort
+from pvactools.lib.prediction_cache import PredictionCache
 
-class NetMHCStab:
-    def __init__(self, input_file, output_file, file_type='pVACseq', top_score_metric='median'):
-        self.input_file = input_file
-        self.output_file = output_file
-        if file_type == 'pVACseq':
-            self.epitope_seq_column_name = 'MT Epitope Seq'
-        else:
-            self.epitope_seq_column_name = 'Epitope Seq'
-        self.file_type = file_type
-        self.top_score_metric = top_score_metric
+#the predictions of all backends are cached under this version
+NETMHCSTABPAN_VERSION = '1.0'
 
-    def execute(self):
-        mhci_alleles = MHCI.all_valid_allele_names()
-        observed_alleles = self.observed_alleles()
-        alleles = self.valid_alleles(list(set(observed_alleles).intersection(set(mhci_alleles))))
-        invalid_alleles = list(set(observed_alleles) - set(alleles))
-        lengths = self.observed_epitope_lengths()
+class NetMHCStabWebBackend:
+    def max_workers(self, n_threads):
+        return pvactools.lib.run_utils.DTU_SERVER_MAX_IN_FLIGHT
 
-        result_delimiter = re.compile(r'-{20,}')
-        fail_searcher = re.compile(r'(Failed run|Problematic input:|Configuration error)')
+    def predict(self, staging_file, peptide_length, allele):
         rejected_searcher = re.compile(r'status: rejected')
-        success_searcher = re.compile(r'Rank Threshold for Strong binding peptides')
         cannot_open_file_searcher = re.compile(r'Cannot open file')
-        allele_searcher = re.compile(r'^(.*?) : Distance to trai?ning data\s+(\d.\d+).*? nearest neighbor (.*?)\)$', re.MULTILINE)
-        with open(self.output_file, 'w') as output_fh:
-            headers = pd.read_csv(self.input_file, delimiter="\t", nrows=0).columns.tolist()
-            writer = csv.DictWriter(
-                output_fh,
-                headers+['Predicted Stability', 'Half Life', 'Stability Rank', 'NetMHCstab allele'],
-                delimiter='\t',
-                lineterminator='\n'
-            )
-            writer.writeheader()
-
-            output_lines = []
-            for allele in alleles:
-                for length in lengths:
-                    df = (pd.read_csv(self.input_file, delimiter='\t', float_precision='high', low_memory=False, na_values="NA", keep_default_na=False)
-                            [lambda x: (x['HLA Allele'] == allele) & (x[self.epitope_seq_column_name].str.len() == length) ])
-                    df = df.fillna('NA')
-                    if len(df) == 0:
-                        continue
+        with pvactools.lib.run_utils.dtu_server_slots:
+            response = self.query_netmhcstabpan_server(staging_file, peptide_length, allele)
 
-                    netmhcstabpan_allele = allele.replace('*', '')
-                    x = 0
-                    chunk_count = int(len(df)/100)
-                    if chunk_count == 0:
-                        chunk_count = 1
-                    for chunk in np.array_split(df, chunk_count):
-                        staging_file = tempfile.NamedTemporaryFile(mode='w+')
-                        current_buffer = {}
-                        records = []
-                        for index, line in chunk.iterrows():
-                            sequence_id = ('%010x'%x)[-10:]
-                            record_new = SeqRecord(Seq(line[self.epitope_seq_column_name], IUPAC.protein), id=sequence_id, description=sequence_id)
-                            records.append(record_new)
-                            current_buffer[sequence_id] = line.to_dict()
-                            x+=1
-                        SeqIO.write(records, staging_file.name, "fasta")
-                        staging_file.seek(0)
-                        response = self.query_netmhcstabpan_server(staging_file, length, netmhcstabpan_allele)
-
-                        if fail_searcher.search(response.content.decode()):
-                            raise Exception("NetMHCstabpan encountered an error during processing.\n{}".format(response.content.decode()))
-
-                        while rejected_searcher.search(response.content.decode()):
-                            logging.warning("Too many jobs submitted to NetMHCstabpan server. Waiting to retry.")
-                            sleep(random.randint(5, 10))
-                            staging_file.seek(0)
-                            response = self.query_netmhcstabpan_server(staging_file, length, netmhcstabpan_allele)
-
-                        if cannot_open_file_searcher.search(response.content.decode()):
-                            sleep(random.randint(5, 10))
-                            staging_file.seek(0)
-                            response = self.query_netmhcstabpan_server(staging_file, length, netmhcstabpan_allele)
-                            while rejected_searcher.search(response.content.decode()):
-                                sleep(random.randint(5, 10))
-                                staging_file.seek(0)
-                                response = self.query_netmhcstabpan_server(staging_file, length, netmhcstabpan_allele)
-                            if cannot_open_file_searcher.search(response.content.decode()):
-                                raise Exception("NetMHCstabpan server was unable to read the submitted fasta file:\n{}.".format(staging_file.read()))
-
-                        if success_searcher.search(response.content.decode()):
-                            allele_map = {}
-                            for item in allele_searcher.findall(response.content.decode()):
-                                allele_map[item[0]] = "{} (distance: {})".format(item[2], item[1])
-                                if item[1] != "0.000":
-                                    print("NetMHCstabpan substituted {} for {} (distance: {})".format(item[2], item[0], item[1]))
-                            results = [item.strip() for item in result_delimiter.split(response.content.decode())]
-                            if len(results) == 0:
-                                raise Exception("Unexpected return value from NetMHCstabpan server. Unable to parse response.\n{}".format(response.content.decode()))
-                            data_for_sequence_id = {}
-                            for i in range(2, len(results), 4): #examine only the parts we want, skipping all else
-                                for result_line in results[i].split('\n'):
-                                    data = [word for word in result_line.strip().split(' ') if len(word)]
-                                    data_for_sequence_id[data[3]] = data
-
-                            for sequence_id, line in current_buffer.items():
-                                data = data_for_sequence_id[sequence_id]
-                                line.update({
-                                    'Predicted Stability':data[4],
-                                    'Half Life':data[5],
-                                    'Stability Rank':data[6],
-                                    'NetMHCstab allele':allele_map[netmhcstabpan_allele]
-                                })
-                                output_lines.append(line)
-
-                        else:
-                            raise Exception("Unexpected return value from NetMHCstabpan server. Unable to parse response.\n{}".format(response.content.decode()))
-
-            for allele in invalid_alleles:
-                df = (pd.read_csv(self.input_file, delimiter='\t', float_precision='high', low_memory=False, na_values="NA", keep_default_na=False)
-                        [lambda x: (x['HLA Allele'] == allele) ])
-                df['Predicted Stability'] = 'NA'
-                df['Half Life'] = 'NA'
-                df['Stability Rank'] = 'NA'
-                df['NetMHCstab allele'] = 'NA'
-                output_lines.extend(df.to_dict('records'))
+            while rejected_searcher.search(response.content.decode()):
+                logging.warning("Too many jobs submitted to NetMHCstabpan server. Waiting to retry.")
+                sleep(random.randint(5, 10))
+                staging_file.seek(0)
+                response = self.query_netmhcstabpan_server(staging_file, peptide_length, allele)
 
-            if self.file_type == 'pVACseq':
-                sorted_lines = pvactools.lib.sort.default_sort_from_pd_dict(output_lines, self.top_score_metric)
-            else:
-                sorted_lines = pvactools.lib.sort.pvacbind_sort(output_lines, self.top_score_metric)
-            writer.writerows(sorted_lines)
+            if cannot_open_file_searcher.search(response.content.decode()):
+                sleep(random.randint(5, 10))
+                staging_file.seek(0)
+                response = self.query_netmhcstabpan_server(staging_file, peptide_length, allele)
+                while rejected_searcher.search(response.content.decode()):
+                    sleep(random.randint(5, 10))
+                    staging_file.seek(0)
+                    response = self.query_netmhcstabpan_server(staging_file, peptide_length, allele)
+                if cannot_open_file_searcher.search(response.content.decode()):
+                    staging_file.seek(0)
+                    raise Exception("NetMHCstabpan server was unable to read the submitted fasta file:\n{}.".format(staging_file.read()))
+        return response.content.decode()
 
     def query_netmhcstabpan_server(self, staging_file, peptide_length, allele):
         try:
@@ -182,25 +92,193 @@ class NetMHCStab:
                 raise Exception("Error posting request to NetMHCstabpan server.\n{}".format(response.content.decode()))
         return response
 
+class NetMHCStabLocalBackend:
+    def __init__(self, netmhc_stab_path):
+        self.netmhc_stab_path = netmhc_stab_path
+
+    def max_workers(self, n_threads):
+        return n_threads
+
+    def predict(self, staging_file, peptide_length, allele):
+        arguments = [self.netmhc_stab_path, '-f', staging_file.name, '-a', allele, '-l', str(peptide_length)]
+        with tempfile.TemporaryFile(mode='w+') as result_fh:
+            run(arguments, stdout=result_fh, check=True)
+            result_fh.seek(0)
+            return result_fh.read()
+
+class NetMHCStab:
+    def __init__(self, input_file, output_file, file_type='pVACseq', top_score_metric='median', n_threads=1, netmhc_stab_path=None, prediction_cache=None, prediction_cache_size=None):
+        self.input_file = input_file
+        self.output_file = output_file
+        if file_type == 'pVACseq':
+            self.epitope_seq_column_name = 'MT Epitope Seq'
+        else:
+            self.epitope_seq_column_name = 'Epitope Seq'
+        self.file_type = file_type
+        self.top_score_metric = top_score_metric
+        self.n_threads = n_threads
+        self.netmhc_stab_path = netmhc_stab_path
+        self.prediction_cache = prediction_cache
+        self.prediction_cache_size = prediction_cache_size
+
+    def execute(self):
+        df = pvactools.lib.run_utils.read_report_table(self.input_file, float_precision='high', low_memory=False, na_values="NA", keep_default_na=False)
+        mhci_alleles = MHCI.all_valid_allele_names()
+        observed_alleles = self.observed_alleles(df)
+        alleles = self.valid_alleles(list(set(observed_alleles).intersection(set(mhci_alleles))))
+        invalid_alleles = list(set(observed_alleles) - set(alleles))
+        lengths = self.observed_epitope_lengths(df)
+        group_indices = df.groupby([df['HLA Allele'], df[self.epitope_seq_column_name].str.len()], sort=False).indices
+
+        with open(self.output_file, 'w') as output_fh:
+            writer = csv.DictWriter(
+                output_fh,
+                df.columns.tolist()+['Predicted Stability', 'Half Life', 'Stability Rank', 'NetMHCstab allele'],
+                delimiter='\t',
+                lineterminator='\n'
+            )
+            writer.writeheader()
+
+            cache = PredictionCache(self.prediction_cache, self.prediction_cache_size) if self.prediction_cache is not None else None
+            groups = []
+            chunks = []
+            for allele in alleles:
+                for length in lengths:
+                    if (allele, length) not in group_indices:
+                        continue
+                    group_df = df.iloc[group_indices[(allele, length)]].fillna('NA')
+                    netmhcstabpan_allele = allele.replace('*', '')
+                    #the stability only depends on the allele and peptide so every epitope is predicted once
+                    epitopes = group_df[self.epitope_seq_column_name].unique()
+                    if cache is not None:
+                        cached_predictions = cache.lookup('NetMHCStab', NETMHCSTABPAN_VERSION, netmhcstabpan_allele, length, epitopes)
+                    else:
+                        cached_predictions = {}
+                    groups.append((group_df, netmhcstabpan_allele, length, cached_predictions))
+
+                    missing_epitopes = np.array([epitope for epitope in epitopes if epitope not in cached_predictions])
+                    if len(missing_epitopes) == 0:
+                        continue
+                    sequence_ids = np.array([('%010x'%x)[-10:] for x in range(len(missing_epitopes))])
+                    chunk_count = int(len(missing_epitopes)/100)
+                    if chunk_count == 0:
+                        chunk_count = 1
+                    for positions in np.array_split(np.arange(len(missing_epitopes)), chunk_count):
+                        chunks.append((len(groups) - 1, sequence_ids[positions], missing_epitopes[positions], length, netmhcstabpan_allele))
+
+            group_results = [[] for group in groups]
+            if len(chunks) > 0:
+                backend = self.backend()
+                #the chunks are submitted concurrently but collected in input order
+                with ThreadPoolExecutor(max_workers=max(1, min(backend.max_workers(self.n_threads), len(chunks)))) as executor:
+                    for (chunk, results) in zip(chunks, executor.map(lambda chunk: self.process_chunk(backend, *chunk[1:]), chunks)):
+                        group_results[chunk[0]].append(results)
+
+            output_lines = []
+            stability_columns = ['Predicted Stability', 'Half Life', 'Stability Rank', 'NetMHCstab allele']
+            for ((group_df, netmhcstabpan_allele, length, cached_predictions), results) in zip(groups, group_results):
+                if cache is not None and len(results) > 0:
+                    new_predictions = pd.concat(results)
+                    cache.store('NetMHCStab', NETMHCSTABPAN_VERSION, netmhcstabpan_allele, length, {
+                        epitope: predictions for (epitope, *predictions) in new_predictions[[self.epitope_seq_column_name] + stability_columns].values.tolist()
+                    })
+                if len(cached_predictions) > 0:
+                    results.append(pd.DataFrame(
+                        [[epitope] + predictions for (epitope, predictions) in cached_predictions.items()],
+                        columns=[self.epitope_seq_column_name] + stability_columns,
+                    ))
+                stability_df = group_df.merge(pd.concat(results), on=self.epitope_seq_column_name, how='left', sort=False, validate='many_to_one')
+                output_lines.extend(stability_df.to_dict('records'))
+            if cache is not None:
+                print(cache.statistics())
+                cache.close()
+
+            invalid_df = df[df['HLA Allele'].isin(invalid_alleles)].copy()
+            invalid_df['Predicted Stability'] = 'NA'
+            invalid_df['Half Life'] = 'NA'
+            invalid_df['Stability Rank'] = 'NA'
+            invalid_df['NetMHCstab allele'] = 'NA'
+            output_lines.extend(invalid_df.to_dict('records'))
+
+            if self.file_type == 'pVACseq':
+                sorted_lines = pvactools.lib.sort.default_sort_from_pd_dict(output_lines, self.top_score_metric)
+            else:
+                sorted_lines = pvactools.lib.sort.pvacbind_sort(output_lines, self.top_score_metric)
+            writer.writerows(sorted_lines)
+
+    def backend(self):
+        if self.netmhc_stab_path is not None:
+            return NetMHCStabLocalBackend(self.netmhc_stab_path)
+        else:
+            return NetMHCStabWebBackend()
+
+    def process_chunk(self, backend, sequence_ids, epitopes, length, netmhcstabpan_allele):
+        result_delimiter = re.compile(r'-{20,}')
+        fail_searcher = re.compile(r'(Failed run|Problematic input:|Configuration error)')
+        success_searcher = re.compile(r'Rank Threshold for Strong binding peptides')
+        allele_searcher = re.compile(r'^(?:# )?(.*?) : Distance to trai?ning data\s+(\d.\d+).*? nearest neighbor (.*?)\)$', re.MULTILINE)
+
+        records = [SeqRecord(Seq(epitope, IUPAC.protein), id=sequence_id, description=sequence_id) for (sequence_id, epitope) in zip(sequence_ids, epitopes)]
+        with tempfile.NamedTemporaryFile(mode='w+') as staging_file:
+            SeqIO.write(records, staging_file.name, "fasta")
+            staging_file.seek(0)
+            content = backend.predict(staging_file, length, netmhcstabpan_allele)
+
+        if fail_searcher.search(content):
+            raise Exception("NetMHCstabpan encountered an error during processing.\n{}".format(content))
+
+        if not success_searcher.search(content):
+            raise Exception("Unexpected return value from NetMHCstabpan server. Unable to parse response.\n{}".format(content))
+
+        allele_map = {}
+        for item in allele_searcher.findall(content):
+            allele_map[item[0]] = "{} (distance: {})".format(item[2], item[1])
+            if item[1] != "0.000":
+                print("NetMHCstabpan substituted {} for {} (distance: {})".format(item[2], item[0], item[1]))
+        results = [item.strip() for item in result_delimiter.split(content)]
+        if len(results) == 0:
+            raise Exception("Unexpected return value from NetMHCstabpan server. Unable to parse response.\n{}".format(content))
+        data_for_sequence_id = {}
+        for i in range(2, len(results), 4): #examine only the parts we want, skipping all else
+            for result_line in results[i].split('\n'):
+                data = [word for word in result_line.strip().split(' ') if len(word)]
+                data_for_sequence_id[data[3]] = data
+
+        missing_sequence_ids = [sequence_id for sequence_id in sequence_ids if sequence_id not in data_for_sequence_id]
+        if len(missing_sequence_ids) > 0:
+            raise Exception("Unexpected return value from NetMHCstabpan server. No predictions for sequences {}.\n{}".format(", ".join(missing_sequence_ids), content))
+        return pd.DataFrame({
+            self.epitope_seq_column_name: epitopes,
+            'Predicted Stability': [data_for_sequence_id[sequence_id][4] for sequence_id in sequence_ids],
+            'Half Life': [data_for_sequence_id[sequence_id][5] for sequence_id in sequence_ids],
+            'Stability Rank': [data_for_sequence_id[sequence_id][6] for sequence_id in sequence_ids],
+            'NetMHCstab allele': allele_map[netmhcstabpan_allele],
+        })
+
     def valid_alleles(self, alleles):
         invalid_searcher = re.compile(r'cannot be found in hla_pseudo list')
+        backend = self.backend()
         valid_alleles = []
         for allele in alleles:
             staging_file = tempfile.NamedTemporaryFile(mode='w+')
             records = [SeqRecord(Seq("ASTPGHTIIYEAVCLHNDRTTIP", IUPAC.protein), id="0", description="0")]
             SeqIO.write(records, staging_file.name, "fasta")
             staging_file.seek(0)
-            response = self.query_netmhcstabpan_server(staging_file, 9, allele.replace("*", ""))
+            try:
+                content = backend.predict(staging_file, 9, allele.replace("*", ""))
+            except CalledProcessError:
+                #a local NetMHCstabpan installation exits with an error for unsupported alleles
+                continue
 
-            if not invalid_searcher.search(response.content.decode()):
+            if not invalid_searcher.search(content):
                 valid_alleles.append(allele)
         return valid_alleles
 
-    def observed_alleles(self):
-        return np.sort(pd.read_csv(self.input_file, delimiter="\t", usecols=["HLA Allele"])['HLA Allele'].unique())[::-1]
+    def observed_alleles(self, df):
+        return np.sort(df['HLA Allele'].unique())[::-1]
 
-    def observed_epitope_lengths(self):
-        epitopes = pd.read_csv(self.input_file, delimiter="\t", usecols=[self.epitope_seq_column_name])[self.epitope_seq_column_name].unique()
+    def observed_epitope_lengths(self, df):
+        epitopes = df[self.epitope_seq_column_name].unique()
         return list(set([len(e) for e in epitopes]))
 
     @classmethod
@@ -226,4 +304,27 @@ class NetMHCStab:
                  + "lowest: Use the best MT Score and Corresponding Fold Change (i.e. the lowest MT ic50 binding score and corresponding fold change of all chosen prediction methods). "
                  + "median: Use the median MT Score and Median Fold Change (i.e. the  median MT ic50 binding score and fold change of all chosen prediction methods)."
         )
+        parser.add_argument(
+            "-t", "--n-threads",type=int,
+            default=1,
+            help="Number of threads to use for running a local NetMHCstabpan installation on the input chunks in parallel. "
+                 + "Chunks submitted to the NetMHCstabpan server are limited to {} jobs in flight across all threads and concurrent pipelines.".format(pvactools.lib.run_utils.DTU_SERVER_MAX_IN_FLIGHT),
+        )
+        parser.add_argument(
+            '--netmhc-stab-path',
+            default=None,
+            help="NetMHCstabpan installation path. If provided, NetMHCstabpan is run locally instead of on the NetMHCstabpan server.",
+        )
+        parser.add_argument(
+            '--prediction-cache',
+            default=None,
+            help="Path to a prediction cache database that is shared between runs. "
+                 + "Stability predictions for epitopes that were already predicted for the same allele "
+                 + "will be read from the cache instead of being predicted again.",
+        )
+        parser.add_argument(
+            '--prediction-cache-size', type=int,
+            default=None,
+            help="Maximum number of entries to keep in the prediction cache. Least recently used entries are evicted first.",
+        )
         return parser
@@ -4,14 +4,20 @@ import csv
 import re
 import operator
 import os
-from math import ceil, inf
+from math import ceil, inf, isnan
 from statistics import median
-import yaml
+import numpy as np
+import pandas as pd
 
 from pvactools.lib.prediction_class import PredictionClass
+from pvactools.lib.key_file import read_key_file
 
 csv.field_size_limit(sys.maxsize)
 
+PERCENTILE_COLUMNS = ['percentile', 'percentile_rank', 'rank']
+SCORE_COLUMNS = ['ic50'] + PERCENTILE_COLUMNS
+PREDICTION_FILE_COLUMNS = ['allele', 'seq_num', 'start', 'end', 'peptide', 'core_peptide'] + SCORE_COLUMNS
+
 class OutputParser(metaclass=ABCMeta):
     def __init__(self, **kwargs):
         self.input_iedb_files        = kwargs['input_iedb_files']
@@ -65,19 +71,80 @@ class OutputParser(metaclass=ABCMeta):
                 return i+1
         return 0
 
-    def get_percentile(self, line):
-        if 'percentile' in line:
-            percentile = line['percentile']
-        elif 'percentile_rank' in line:
-            percentile = line['percentile_rank']
-        elif 'rank' in line:
-            percentile = line['rank']
-        else:
-            return 'NA'
-        if percentile == 'None' or percentile is None or percentile == "":
-            return 'NA'
-        else:
-            return float(percentile)
+    def prediction_method(self, input_iedb_file):
+        # we remove "sample_name." prefix from filename and then first part before a dot is the method name 
+        return (os.path.basename(input_iedb_file)[len(self.sample_name)+1:]).split('.', 1)[0]
+
+    def read_iedb_file(self, input_iedb_file):
+        #Only the columns we need are read and scores are parsed into typed arrays
+        try:
+            df = pd.read_csv(
+                input_iedb_file,
+                sep='\t',
+                usecols=lambda column: column in PREDICTION_FILE_COLUMNS,
+                dtype={column: float if column in SCORE_COLUMNS else str for column in PREDICTION_FILE_COLUMNS},
+                keep_default_na=False,
+                na_values={column: ['', 'None', 'NA', 'nan'] for column in SCORE_COLUMNS},
+                float_precision='round_trip',
+            )
+        except pd.errors.EmptyDataError:
+            df = pd.DataFrame(columns=['allele', 'seq_num', 'start', 'end', 'peptide', 'ic50'])
+        df = df[~df['allele'].str.contains("Warning: Potential DNA sequence(s)", regex=False)]
+        position = df['start'].astype(int)
+        if 'core_peptide' in df.columns:
+            #Start and end refer to the position of the core peptide
+            #Infer the (start) position of the peptide from the positions of the core peptide
+            core_peptide_offset = [peptide.find(core_peptide) for (peptide, core_peptide) in zip(df['peptide'], df['core_peptide'])]
+            position = position.where(df['end'].astype(int) - position != 8, position - core_peptide_offset)
+        percentile_columns = [column for column in PERCENTILE_COLUMNS if column in df.columns]
+        return pd.DataFrame({
+            'seq_num'   : df['seq_num'].astype(int).values,
+            'position'  : position.values,
+            'allele'    : df['allele'].values,
+            'peptide'   : df['peptide'].values,
+            'score'     : df['ic50'].astype(float).values,
+            'percentile': df[percentile_columns[0]].astype(float).values if percentile_columns else np.nan,
+            'method'    : self.prediction_method(input_iedb_file),
+        })
+
+    def read_iedb_files(self, identifiers_from_label):
+        #One row per prediction and identifier of the predicted sequence, in file order
+        predictions = pd.concat([self.read_iedb_file(input_iedb_file) for input_iedb_file in self.input_iedb_files], ignore_index=True)
+        predictions['identifier'] = predictions['seq_num'].map(identifiers_from_label)
+        return predictions.explode('identifier').dropna(subset=['identifier']).reset_index(drop=True)
+
+    def combine_prediction_methods(self, predictions, keep):
+        #Join the predictions of all methods into one row per (tsv_index, position),
+        #keeping the first (or last) predicted epitope and allele of each position
+        keys = ['tsv_index', 'position']
+        table = predictions.drop_duplicates(keys, keep=keep)[keys + ['allele', 'peptide']]
+        values = predictions.drop_duplicates(keys + ['method'], keep='last').set_index(keys + ['method'])[['score', 'percentile']].unstack('method')
+        values.columns = ["{} {}".format(metric, method) for (metric, method) in values.columns]
+        return table.join(values, on=keys).reset_index(drop=True)
+
+    def method_columns(self, table):
+        methods = sorted(set(column.split(' ', 1)[1] for column in table.columns if column.startswith('score ')))
+        return [(method, table["score {}".format(method)].values, table["percentile {}".format(method)].values) for method in methods]
+
+    def method_values(self, method_columns, row):
+        scores = {}
+        percentiles = {}
+        for (method, score_column, percentile_column) in method_columns:
+            score = score_column[row]
+            if isnan(score):
+                continue
+            scores[method] = float(score)
+            percentile = percentile_column[row]
+            percentiles[method] = 'NA' if isnan(percentile) else float(percentile)
+        return (scores, percentiles)
+
+    def set_wt_match(self, result, wt_result):
+        result['wt_epitope_seq'] = wt_result['wt_epitope_seq']
+        result['wt_row']         = wt_result['row']
+
+    def set_no_wt_match(self, result):
+        result['wt_epitope_seq'] = 'NA'
+        result['wt_row']         = None
 
     def match_wildtype_and_mutant_entry_for_missense(self, result, mt_position, wt_results, previous_result):
         #The WT epitope at the same position is the match
@@ -88,13 +155,9 @@ class OutputParser(metaclass=ABCMeta):
         result['wt_epitope_position'] = match_position
         total_matches  = self.determine_total_matches(mt_epitope_seq, wt_epitope_seq)
         if total_matches >= self.min_match_count(int(result['peptide_length'])):
-            result['wt_epitope_seq'] = wt_epitope_seq
-            result['wt_scores']      = wt_result['wt_scores']
-            result['wt_percentiles'] = wt_result['wt_percentiles']
+            self.set_wt_match(result, wt_result)
         else:
-            result['wt_epitope_seq'] = 'NA'
-            result['wt_scores']      = dict.fromkeys(result['mt_scores'].keys(), 'NA')
-            result['wt_percentiles'] = dict.fromkeys(result['mt_percentiles'].keys(), 'NA')
+            self.set_no_wt_match(result)
 
         if mt_epitope_seq == wt_epitope_seq:
             result['mutation_position'] = 'NA'
@@ -115,9 +178,7 @@ class OutputParser(metaclass=ABCMeta):
         match_position = mt_position
         #Since the MT sequence is longer than the WT sequence, not all MT epitopes have a match
         if match_position not in wt_results:
-            result['wt_epitope_seq'] = 'NA'
-            result['wt_scores']      = dict.fromkeys(result['mt_scores'].keys(), 'NA')
-            result['wt_percentiles'] = dict.fromkeys(result['mt_percentiles'].keys(), 'NA')
+            self.set_no_wt_match(result)
             result['wt_epitope_position'] = 'NA'
             if previous_result['mutation_position'] == 'NA':
                 result['mutation_position'] = 'NA'
@@ -132,9 +193,7 @@ class OutputParser(metaclass=ABCMeta):
         wt_epitope_seq = wt_result['wt_epitope_seq']
         if mt_epitope_seq == wt_epitope_seq:
             #The MT epitope does not overlap the frameshift mutation
-            result['wt_epitope_seq']    = wt_result['wt_epitope_seq']
-            result['wt_scores']         = wt_result['wt_scores']
-            result['wt_percentiles']    = wt_result['wt_percentiles']
+            self.set_wt_match(result, wt_result)
             result['mutation_position'] = 'NA'
             result['wt_epitope_position'] = 'NA'
         else:
@@ -142,16 +201,12 @@ class OutputParser(metaclass=ABCMeta):
             total_matches = self.determine_total_matches(mt_epitope_seq, wt_epitope_seq)
             if total_matches >= self.min_match_count(int(result['peptide_length'])):
                 #The minimum amino acid match count is met
-                result['wt_epitope_seq'] = wt_result['wt_epitope_seq']
-                result['wt_scores']      = wt_result['wt_scores']
-                result['wt_percentiles'] = wt_result['wt_percentiles']
+                self.set_wt_match(result, wt_result)
             else:
                 #The minimum amino acid match count is not met
                 #Even though there is a matching WT epitope there are not enough overlapping amino acids
                 #We don't include the matching WT epitope in the output
-                result['wt_epitope_seq'] = 'NA'
-                result['wt_scores']      = dict.fromkeys(result['mt_scores'].keys(), 'NA')
-                result['wt_percentiles'] = dict.fromkeys(result['mt_percentiles'].keys(), 'NA')
+                self.set_no_wt_match(result)
             mutation_position = self.find_mutation_position(wt_epitope_seq, mt_epitope_seq)
             if mutation_position == 1 and previous_result is not None and int(previous_result['mutation_position']) <= 1:
                 #The true mutation position is to the left of the current MT eptiope
@@ -159,7 +214,7 @@ class OutputParser(metaclass=ABCMeta):
             result['mutation_position'] = mutation_position
             result['wt_epitope_position'] = match_position
 
-    def match_wildtype_and_mutant_entry_for_inframe_indel(self, result, mt_position, wt_results, previous_result, iedb_results_for_wt_iedb_result_key):
+    def match_wildtype_and_mutant_entry_for_inframe_indel(self, result, mt_position, wt_results, previous_result, mt_position_count):
         #If the previous WT epitope was matched "from the right" we can just use that position to infer the mutation position and match direction
         if previous_result is not None and previous_result['match_direction'] == 'right':
             best_match_position           = previous_result['wt_epitope_position'] + 1
@@ -175,16 +230,12 @@ class OutputParser(metaclass=ABCMeta):
             total_matches        = self.determine_total_matches(result['mt_epitope_seq'], best_match_wt_result['wt_epitope_seq'])
             if total_matches and total_matches >= self.min_match_count(int(result['peptide_length'])):
                 #The minimum amino acid match count is met
-                result['wt_epitope_seq'] = best_match_wt_result['wt_epitope_seq']
-                result['wt_scores']      = best_match_wt_result['wt_scores']
-                result['wt_percentiles'] = best_match_wt_result['wt_percentiles']
+                self.set_wt_match(result, best_match_wt_result)
             else:
                 #The minimum amino acid match count is not met
                 #Even though there is a matching WT epitope there are not enough overlapping amino acids
                 #We don't include the matching WT epitope in the output
-                result['wt_epitope_seq'] = 'NA'
-                result['wt_scores']      = dict.fromkeys(result['mt_scores'].keys(), 'NA')
-                result['wt_percentiles'] = dict.fromkeys(result['mt_percentiles'].keys(), 'NA')
+                self.set_no_wt_match(result)
 
             return
 
@@ -194,9 +245,7 @@ class OutputParser(metaclass=ABCMeta):
         #For an inframe insertion the MT sequence is longer than the WT sequence
         #In this case not all MT epitopes might have a baseline match
         if baseline_best_match_position not in wt_results:
-            result['wt_epitope_seq'] = 'NA'
-            result['wt_scores']      = dict.fromkeys(result['mt_scores'].keys(), 'NA')
-            result['wt_percentiles'] = dict.fromkeys(result['mt_percentiles'].keys(), 'NA')
+            self.set_no_wt_match(result)
             #We then infer the mutation position and match direction from the previous MT epitope
             result['match_direction']= previous_result['match_direction']
             if previous_result['mutation_position'] > 0:
@@ -210,9 +259,7 @@ class OutputParser(metaclass=ABCMeta):
         baseline_best_match_wt_epitope_seq = baseline_best_match_wt_result['wt_epitope_seq']
         #The MT epitope does not overlap the indel mutation
         if baseline_best_match_wt_epitope_seq == mt_epitope_seq:
-            result['wt_epitope_seq']      = baseline_best_match_wt_result['wt_epitope_seq']
-            result['wt_scores']           = baseline_best_match_wt_result['wt_scores']
-            result['wt_percentiles']      = baseline_best_match_wt_result['wt_percentiles']
+            self.set_wt_match(result, baseline_best_match_wt_result)
             result['wt_epitope_position'] = int(baseline_best_match_position)
             result['mutation_position']   = 'NA'
             result['match_direction']     = 'left'
@@ -222,10 +269,10 @@ class OutputParser(metaclass=ABCMeta):
             best_match_count  = self.determine_consecutive_matches_from_left(mt_epitope_seq, baseline_best_match_wt_epitope_seq)
             #The alternate best match candidate "from the right" is inferred from the baseline best match position and the indel length
             if result['variant_type'] == 'inframe_ins':
-                insertion_length              = len(iedb_results_for_wt_iedb_result_key.keys()) - len(wt_results.keys())
+                insertion_length              = mt_position_count - len(wt_results)
                 alternate_best_match_position = int(baseline_best_match_position) - insertion_length
             elif result['variant_type'] == 'inframe_del':
-                deletion_length                 = len(wt_results.keys()) - len(iedb_results_for_wt_iedb_result_key.keys())
+                deletion_length                 = len(wt_results) - mt_position_count
                 alternate_best_match_position   = int(baseline_best_match_position) + deletion_length
             if alternate_best_match_position > 0:
                 alternate_best_match_wt_result      = wt_results[str(alternate_best_match_position)]
@@ -250,39 +297,47 @@ class OutputParser(metaclass=ABCMeta):
             total_matches = self.determine_total_matches(mt_epitope_seq, best_match_wt_result['wt_epitope_seq'])
             if total_matches and total_matches >= self.min_match_count(int(result['peptide_length'])):
                 #The minimum amino acid match count is met
-                result['wt_epitope_seq'] = best_match_wt_result['wt_epitope_seq']
-                result['wt_scores']      = best_match_wt_result['wt_scores']
-                result['wt_percentiles'] = best_match_wt_result['wt_percentiles']
+                self.set_wt_match(result, best_match_wt_result)
             else:
                 #The minimum amino acid match count is not met
                 #Even though there is a matching WT epitope there are not enough overlapping amino acids
                 #We don't include the matching WT epitope in the output
-                result['wt_epitope_seq'] = 'NA'
-                result['wt_scores']      = dict.fromkeys(result['mt_scores'].keys(), 'NA')
-                result['wt_percentiles'] = dict.fromkeys(result['mt_percentiles'].keys(), 'NA')
+                self.set_no_wt_match(result)
 
             result['mutation_position']   = self.find_mutation_position(baseline_best_match_wt_epitope_seq, mt_epitope_seq)
             result['match_direction']     = match_direction
             result['wt_epitope_position'] = best_match_position
 
+    def group_iedb_results_by_tsv_index(self, iedb_results):
+        #Split every key only once and group the results of each variant by their (integer) MT position
+        positions_by_tsv_index = {}
+        results_by_tsv_index = {}
+        for (key, result) in iedb_results.items():
+            (tsv_index, mt_position) = key.rsplit('|', 1)
+            positions_by_tsv_index.setdefault(tsv_index, []).append(int(mt_position))
+            results_by_tsv_index.setdefault(tsv_index, []).append(result)
+        for (tsv_index, positions) in positions_by_tsv_index.items():
+            positions = np.array(positions)
+            order = np.argsort(positions, kind='stable')
+            yield (tsv_index, positions[order], [results_by_tsv_index[tsv_index][i] for i in order])
+
     def match_wildtype_and_mutant_entries(self, iedb_results, wt_iedb_results):
-        for key in sorted(iedb_results.keys(), key = lambda x: int(x.split('|')[-1])):
-            result = iedb_results[key]
-            (wt_iedb_result_key, mt_position) = key.split('|', 1)
-            previous_mt_position = str(int(mt_position)-1)
-            previous_key = '|'.join([wt_iedb_result_key, previous_mt_position])
-            if previous_key in iedb_results:
-                previous_result = iedb_results[previous_key]
-            else:
-                previous_result = None
-            wt_results = wt_iedb_results[wt_iedb_result_key]
-            if result['variant_type'] == 'missense':
-                self.match_wildtype_and_mutant_entry_for_missense(result, mt_position, wt_results, previous_result)
-            elif result['variant_type'] == 'FS':
-                self.match_wildtype_and_mutant_entry_for_frameshift(result, mt_position, wt_results, previous_result)
-            elif result['variant_type'] == 'inframe_ins' or result['variant_type'] == 'inframe_del':
-                iedb_results_for_wt_iedb_result_key = dict([(key,value) for key, value in iedb_results.items() if key.startswith(wt_iedb_result_key)])
-                self.match_wildtype_and_mutant_entry_for_inframe_indel(result, mt_position, wt_results, previous_result, iedb_results_for_wt_iedb_result_key)
+        for (tsv_index, mt_positions, results) in self.group_iedb_results_by_tsv_index(iedb_results):
+            wt_results = wt_iedb_results[tsv_index]
+            mt_position_count = len(mt_positions)
+            for (i, (mt_position, result)) in enumerate(zip(mt_positions, results)):
+                #Positions are sorted so the previous MT epitope, if there is one, is the preceding entry
+                if i > 0 and mt_positions[i-1] == mt_position - 1:
+                    previous_result = results[i-1]
+                else:
+                    previous_result = None
+                mt_position = str(mt_position)
+                if result['variant_type'] == 'missense':
+                    self.match_wildtype_and_mutant_entry_for_missense(result, mt_position, wt_results, previous_result)
+                elif result['variant_type'] == 'FS':
+                    self.match_wildtype_and_mutant_entry_for_frameshift(result, mt_position, wt_results, previous_result)
+                elif result['variant_type'] == 'inframe_ins' or result['variant_type'] == 'inframe_del':
+                    self.match_wildtype_and_mutant_entry_for_inframe_indel(result, mt_position, wt_results, previous_result, mt_position_count)
 
         return iedb_results
 
@@ -359,11 +414,10 @@ class OutputParser(metaclass=ABCMeta):
         return flattened_iedb_results
 
     def process_input_iedb_file(self, tsv_entries):
-        iedb_results = self.parse_iedb_file(tsv_entries)
-        iedb_results_with_metrics = self.add_summary_metrics(iedb_results)
-        flattened_iedb_results = self.flatten_iedb_results(iedb_results_with_metrics)
-
-        return flattened_iedb_results
+        #Results are streamed one at a time so that they never all need to be held in memory
+        for (key, result) in self.parse_iedb_file(tsv_entries):
+            iedb_results_with_metrics = self.add_summary_metrics({key: result})
+            yield from self.flatten_iedb_results(iedb_results_with_metrics)
 
     def base_headers(self):
         headers = [
@@ -556,108 +610,87 @@ class OutputParser(metaclass=ABCMeta):
 
 class DefaultOutputParser(OutputParser):
     def parse_iedb_file(self, tsv_entries):
-        with open(self.key_file, 'r') as key_file_reader:
-            protein_identifiers_from_label = yaml.load(key_file_reader, Loader=yaml.FullLoader)
-        iedb_results = {}
-        wt_iedb_results = {}
-        for input_iedb_file in self.input_iedb_files:
-            with open(input_iedb_file, 'r') as reader:
-                iedb_tsv_reader = csv.DictReader(reader, delimiter='\t')
-                # we remove "sample_name." prefix from filename and then first part before a dot is the method name 
-                method = (os.path.basename(input_iedb_file)[len(self.sample_name)+1:]).split('.', 1)[0]
-                for line in iedb_tsv_reader:
-                    if "Warning: Potential DNA sequence(s)" in line['allele']:
-                        continue
-                    protein_label  = int(line['seq_num'])
-                    if 'core_peptide' in line and int(line['end']) - int(line['start']) == 8:
-                        #Start and end refer to the position of the core peptide
-                        #Infer the (start) position of the peptide from the positions of the core peptide
-                        position   = str(int(line['start']) - line['peptide'].find(line['core_peptide']))
-                    else:
-                        position   = line['start']
-                    percentile     = self.get_percentile(line)
-                    epitope        = line['peptide']
-                    score          = line['ic50']
-                    allele         = line['allele']
-                    peptide_length = len(epitope)
-
-                    if protein_identifiers_from_label[protein_label] is not None:
-                        protein_identifiers = protein_identifiers_from_label[protein_label]
-
-                    for protein_identifier in protein_identifiers:
-                        (protein_type, tsv_index) = protein_identifier.split('.', 1)
-                        if protein_type == 'MT':
-                            tsv_entry = tsv_entries[tsv_index]
-                            key = "%s|%s" % (tsv_index, position)
-                            if key not in iedb_results:
-                                iedb_results[key]                      = {}
-                                iedb_results[key]['mt_scores']         = {}
-                                iedb_results[key]['mt_percentiles']    = {}
-                                iedb_results[key]['mt_epitope_seq']    = epitope
-                                iedb_results[key]['gene_name']         = tsv_entry['gene_name']
-                                iedb_results[key]['amino_acid_change'] = tsv_entry['amino_acid_change']
-                                iedb_results[key]['variant_type']      = tsv_entry['variant_type']
-                                iedb_results[key]['position']          = position
-                                iedb_results[key]['tsv_index']         = tsv_index
-                                iedb_results[key]['allele']            = allele
-                                iedb_results[key]['peptide_length']    = peptide_length
-                            iedb_results[key]['mt_scores'][method] = float(score)
-                            iedb_results[key]['mt_percentiles'][method] = percentile
-                        else:
-                            if tsv_index not in wt_iedb_results:
-                                wt_iedb_results[tsv_index] = {}
-                            if position not in wt_iedb_results[tsv_index]:
-                                wt_iedb_results[tsv_index][position] = {}
-                                wt_iedb_results[tsv_index][position][protein_type.lower() + '_scores'] = {}
-                                wt_iedb_results[tsv_index][position][protein_type.lower() + '_percentiles'] = {}
-                            wt_iedb_results[tsv_index][position][protein_type.lower() + '_epitope_seq'] = epitope
-                            wt_iedb_results[tsv_index][position][protein_type.lower() + '_scores'][method] = float(score)
-                            wt_iedb_results[tsv_index][position][protein_type.lower() + '_percentiles'][method] = percentile
-
-        return self.match_wildtype_and_mutant_entries(iedb_results, wt_iedb_results)
+        protein_identifiers_from_label = read_key_file(self.key_file)
+        predictions = self.read_iedb_files(protein_identifiers_from_label)
+        predictions[['protein_type', 'tsv_index']] = predictions['identifier'].str.split('.', n=1, expand=True).values if len(predictions) else np.empty((0, 2), dtype=object)
+        mt_predictions = predictions[predictions['protein_type'] == 'MT']
+        wt_predictions = predictions[predictions['protein_type'] != 'MT']
+        del predictions
+        mt_table = self.combine_prediction_methods(mt_predictions, 'first')
+        wt_table = self.combine_prediction_methods(wt_predictions, 'last')
+        del mt_predictions, wt_predictions
+
+        #Match WT and MT epitopes one variant at a time and only keep the matched WT row of each MT epitope
+        mt_positions = mt_table['position'].values
+        mt_peptides  = mt_table['peptide'].values
+        wt_positions = wt_table['position'].values
+        wt_peptides  = wt_table['peptide'].values
+        wt_rows_by_tsv_index = wt_table.groupby('tsv_index', sort=False).indices
+        matches = [('NA', 'NA', None)] * len(mt_table)
+        for (tsv_index, mt_rows) in mt_table.groupby('tsv_index', sort=False).indices.items():
+            variant_type = tsv_entries[tsv_index]['variant_type']
+            iedb_results = {}
+            for row in mt_rows:
+                iedb_results["%s|%s" % (tsv_index, mt_positions[row])] = {
+                    'mt_epitope_seq': mt_peptides[row],
+                    'variant_type'  : variant_type,
+                    'peptide_length': len(mt_peptides[row]),
+                    'row'           : row,
+                }
+            wt_results = {}
+            for row in wt_rows_by_tsv_index.get(tsv_index, []):
+                wt_results[str(wt_positions[row])] = {
+                    'wt_epitope_seq': wt_peptides[row],
+                    'row'           : row,
+                }
+            self.match_wildtype_and_mutant_entries(iedb_results, {tsv_index: wt_results})
+            for result in iedb_results.values():
+                matches[result['row']] = (result.get('mutation_position', 'NA'), result.get('wt_epitope_seq', 'NA'), result.get('wt_row'))
+
+        mt_method_columns = self.method_columns(mt_table)
+        wt_method_columns = self.method_columns(wt_table)
+        for (row, (tsv_index, position, allele, epitope)) in enumerate(zip(mt_table['tsv_index'], mt_positions, mt_table['allele'], mt_peptides)):
+            (mutation_position, wt_epitope_seq, wt_row) = matches[row]
+            (mt_scores, mt_percentiles) = self.method_values(mt_method_columns, row)
+            if wt_row is None:
+                wt_scores      = dict.fromkeys(mt_scores.keys(), 'NA')
+                wt_percentiles = dict.fromkeys(mt_percentiles.keys(), 'NA')
+            else:
+                (wt_scores, wt_percentiles) = self.method_values(wt_method_columns, wt_row)
+            tsv_entry = tsv_entries[tsv_index]
+            yield ("%s|%s" % (tsv_index, position), {
+                'gene_name'        : tsv_entry['gene_name'],
+                'amino_acid_change': tsv_entry['amino_acid_change'],
+                'position'         : str(position),
+                'mutation_position': mutation_position,
+                'mt_scores'        : mt_scores,
+                'wt_scores'        : wt_scores,
+                'mt_percentiles'   : mt_percentiles,
+                'wt_percentiles'   : wt_percentiles,
+                'wt_epitope_seq'   : wt_epitope_seq,
+                'mt_epitope_seq'   : epitope,
+                'tsv_index'        : tsv_index,
+                'allele'           : allele,
+                'peptide_length'   : len(epitope),
+            })
 
 class UnmatchedSequencesOutputParser(OutputParser):
     def parse_iedb_file(self):
-        with open(self.key_file, 'r') as key_file_reader:
-            tsv_indices_from_label = yaml.load(key_file_reader, Loader=yaml.FullLoader)
-        iedb_results = {}
-        for input_iedb_file in self.input_iedb_files:
-            with open(input_iedb_file, 'r') as reader:
-                iedb_tsv_reader = csv.DictReader(reader, delimiter='\t')
-                # we remove "sample_name." prefix from filename and then first part before a dot is the method name 
-                method = (os.path.basename(input_iedb_file)[len(self.sample_name)+1:]).split('.', 1)[0]
-                for line in iedb_tsv_reader:
-                    if "Warning: Potential DNA sequence(s)" in line['allele']:
-                        continue
-                    protein_label  = int(line['seq_num'])
-                    if 'core_peptide' in line and int(line['end']) - int(line['start']) == 8:
-                        #Start and end refer to the position of the core peptide
-                        #Infer the (start) position of the peptide from the positions of the core peptide
-                        position   = str(int(line['start']) - line['peptide'].find(line['core_peptide']))
-                    else:
-                        position   = line['start']
-                    epitope        = line['peptide']
-                    score          = line['ic50']
-                    allele         = line['allele']
-                    peptide_length = len(epitope)
-                    percentile     = self.get_percentile(line)
-
-                    if tsv_indices_from_label[protein_label] is not None:
-                        tsv_indices = tsv_indices_from_label[protein_label]
-
-                    for index in tsv_indices:
-                        key = '|'.join([index, position])
-                        if key not in iedb_results:
-                            iedb_results[key]                      = {}
-                            iedb_results[key]['mt_scores']         = {}
-                            iedb_results[key]['mt_percentiles']    = {}
-                            iedb_results[key]['mt_epitope_seq']    = epitope
-                            iedb_results[key]['position']          = position
-                            iedb_results[key]['tsv_index']         = index
-                            iedb_results[key]['allele']            = allele
-                        iedb_results[key]['mt_scores'][method] = float(score)
-                        iedb_results[key]['mt_percentiles'][method] = percentile
-        return iedb_results
+        tsv_indices_from_label = read_key_file(self.key_file)
+        predictions = self.read_iedb_files(tsv_indices_from_label).rename(columns={'identifier': 'tsv_index'})
+        table = self.combine_prediction_methods(predictions, 'first')
+        del predictions
+        method_columns = self.method_columns(table)
+        for (row, (index, position, allele, epitope)) in enumerate(zip(table['tsv_index'], table['position'], table['allele'], table['peptide'])):
+            (mt_scores, mt_percentiles) = self.method_values(method_columns, row)
+            yield ('|'.join([index, str(position)]), {
+                'mt_scores'     : mt_scores,
+                'mt_percentiles': mt_percentiles,
+                'mt_epitope_seq': epitope,
+                'position'      : str(position),
+                'tsv_index'     : index,
+                'allele'        : allele,
+            })
 
     def add_summary_metrics(self, iedb_results):
         iedb_results_with_metrics = {}
@@ -700,10 +733,10 @@ class UnmatchedSequencesOutputParser(OutputParser):
         return flattened_iedb_results
 
     def process_input_iedb_file(self):
-        iedb_results              = self.parse_iedb_file()
-        iedb_results_with_metrics = self.add_summary_metrics(iedb_results)
-        flattened_iedb_results    = self.flatten_iedb_results(iedb_results_with_metrics)
-        return flattened_iedb_results
+        #Results are streamed one at a time so that they never all need to be held in memory
+        for (key, result) in self.parse_iedb_file():
+            iedb_results_with_metrics = self.add_summary_metrics({key: result})
+            yield from self.flatten_iedb_results(iedb_results_with_metrics)
 
     def base_headers(self):
         return[
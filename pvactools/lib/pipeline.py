@@ -8,13 +8,15 @@ import shutil
 import copy
 import yaml
 import pkg_resources
-import pymp
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 from threading import Lock
+from contextlib import contextmanager
 from Bio import SeqIO
 from Bio.Seq import Seq
 from Bio.SeqRecord import SeqRecord
 from Bio.Alphabet import IUPAC
-from collections import OrderedDict
+from collections import OrderedDict, defaultdict
 import logging
 
 from pvactools.lib.prediction_class import *
@@ -22,15 +24,130 @@ from pvactools.lib.input_file_converter import VcfConverter
 from pvactools.lib.fasta_generator import FastaGenerator, VectorFastaGenerator
 from pvactools.lib.output_parser import DefaultOutputParser, UnmatchedSequencesOutputParser
 from pvactools.lib.post_processor import PostProcessor
+from pvactools.lib.run_manifest import RunManifest
+from pvactools.lib.key_file import write_key_file
+from pvactools.lib.unique_epitopes import determine_epitopes, unique_peptides, write_peptide_fasta, read_prediction_rows, fan_out_predictions, write_predictions
 import pvactools.lib.call_iedb
+import pvactools.lib.iedb_client
+import pvactools.lib.run_utils
 import pvactools.lib.combine_parsed_outputs
 
 def status_message(msg):
     print(msg)
     sys.stdout.flush()
 
+#Relative run time of the prediction algorithms, used to start the slowest
+#prediction jobs first
+PREDICTION_METHOD_COSTS = {
+    'NetMHCpan': 4,
+    'NetMHCcons': 4,
+    'NetMHCIIpan': 4,
+    'PickPocket': 3,
+    'MHCflurry': 2,
+    'MHCnuggetsI': 2,
+    'MHCnuggetsII': 2,
+}
+
+#Maximum number of concurrent prediction jobs for memory-heavy prediction algorithms
+PREDICTION_METHOD_CONCURRENCY_LIMITS = {
+    'MHCflurry': 2,
+    'MHCnuggetsI': 2,
+    'MHCnuggetsII': 2,
+}
+
+#Limits shared by all pipelines of a run, see prediction_limits
+_prediction_limits = None
+
+def prediction_limits(iedb_max_requests):
+    #The IEDB request limit, the per-method job limits and the limit of jobs in flight on the
+    #DTU Health Tech server apply to all pipelines of a run.
+    #Pipelines that run concurrently run in their own processes, so the limits are
+    #multiprocessing semaphores that are handed to every process when it is started.
+    request_limit = None
+    if iedb_max_requests is not None:
+        request_limit = multiprocessing.Semaphore(iedb_max_requests)
+    method_slots = {method: multiprocessing.Semaphore(limit) for (method, limit) in PREDICTION_METHOD_CONCURRENCY_LIMITS.items()}
+    dtu_server_slots = multiprocessing.BoundedSemaphore(pvactools.lib.run_utils.DTU_SERVER_MAX_IN_FLIGHT)
+    return (request_limit, method_slots, dtu_server_slots)
+
+def set_prediction_limits(request_limit, method_slots, dtu_server_slots):
+    global _prediction_limits
+    _prediction_limits = (request_limit, method_slots, dtu_server_slots)
+    pvactools.lib.iedb_client.set_request_limit(request_limit)
+    pvactools.lib.run_utils.set_dtu_server_slots(dtu_server_slots)
+
+@contextmanager
+def prediction_method_slot(method):
+    if _prediction_limits is None or method not in _prediction_limits[1]:
+        yield
+    else:
+        method_slot = _prediction_limits[1][method]
+        method_slot.acquire()
+        try:
+            yield
+        finally:
+            method_slot.release()
+
+prediction_job_parser = pvactools.lib.call_iedb.define_parser()
+
+def prediction_job_fields(arguments):
+    #Prediction jobs are call_iedb argument lists. Their fields are looked up
+    #by name so that they don't depend on the order of the arguments.
+    try:
+        return prediction_job_parser.parse_args(arguments)
+    except SystemExit:
+        raise Exception("Invalid prediction job arguments: {}".format(arguments))
+
+def prediction_job_cost(arguments):
+    fields = prediction_job_fields(arguments)
+    return prediction_cost(fields.input_file, fields.method)
+
+def prediction_cost(input_file, method):
+    return os.path.getsize(input_file) * PREDICTION_METHOD_COSTS.get(method, 1)
+
+def run_prediction_job(arguments):
+    fields = prediction_job_fields(arguments)
+    a = fields.allele
+    method = fields.method
+    filename = fields.output_file
+    epl = fields.epitope_length
+    with prediction_method_slot(method):
+        status_message("Making binding predictions on Allele %s and Epitope Length %s with Method %s - File %s" % (a, epl, method, filename))
+        pvactools.lib.call_iedb.main(arguments)
+    status_message("Making binding predictions on Allele %s and Epitope Length %s with Method %s - File %s - Completed" % (a, epl, method, filename))
+
+def execute_pipelines(pipelines, concurrently=False):
+    #Pipelines of different MHC classes or epitope lengths are independent of each other
+    #until their reports are combined. Each pipeline runs in its own process because some
+    #prediction algorithms (e.g. MHCnuggets) redirect the process-wide sys.stdout.
+    #The pipelines share one set of prediction limits.
+    if not concurrently or len(pipelines) < 2:
+        for pipeline in pipelines:
+            pipeline.execute()
+        return
+    limits = prediction_limits(pipelines[0].iedb_max_requests)
+    with ProcessPoolExecutor(max_workers=len(pipelines), initializer=set_prediction_limits, initargs=limits) as executor:
+        futures = [executor.submit(pipeline.execute) for pipeline in pipelines]
+        for future in futures:
+            future.result()
+
 class Pipeline(metaclass=ABCMeta):
+    #Inputs that don't affect the outputs or that are set while the pipeline runs
+    unlogged_inputs = ['pvactools_version', 'pvacseq_version', 'allow_changed_inputs', 'run_manifest', 'proximal_variants_file']
+
     def __init__(self, **kwargs):
+        self.prediction_cache            = None
+        self.prediction_cache_size       = None
+        self.deduplicate_epitopes        = False
+        self.iedb_executable             = None
+        self.iedb_max_requests           = None
+        self.iedb_allele_batch_size      = 1
+        self.reference_index             = None
+        self.net_chop_path               = None
+        self.netmhc_stab_path            = None
+        self.allow_changed_inputs        = False
+        self.run_manifest                = None
+        self.parquet                     = False
         for (k,v) in kwargs.items():
            setattr(self, k, v)
         self.proximal_variants_file      = None
@@ -56,27 +173,45 @@ class Pipeline(metaclass=ABCMeta):
                         "Past version: %s\n" % past_inputs['pvactools_version'] +
                         "Current version: %s" % current_inputs['pvactools_version']
                     )
+                changed_inputs = False
                 for key in current_inputs.keys():
-                    if key == 'pvactools_version' or key == 'pvacseq_version':
+                    if key in self.unlogged_inputs:
                         continue
                     if key not in past_inputs.keys() and current_inputs[key] is not None:
-                        sys.exit(
+                        changed_inputs = True
+                        self.restart_inputs_changed(
                             "Restart inputs are different from past inputs: \n" +
-                            "Additional input: %s - %s\n" % (key, current_inputs[key]) +
-                            "Aborting."
+                            "Additional input: %s - %s\n" % (key, current_inputs[key])
                         )
-                    elif current_inputs[key] != past_inputs[key]:
-                        sys.exit(
+                    elif key in past_inputs.keys() and current_inputs[key] != past_inputs[key]:
+                        changed_inputs = True
+                        self.restart_inputs_changed(
                             "Restart inputs are different from past inputs: \n" +
                             "Past input: %s - %s\n" % (key, past_inputs[key]) +
-                            "Current input: %s - %s\n" % (key, current_inputs[key]) +
-                            "Aborting."
+                            "Current input: %s - %s\n" % (key, current_inputs[key])
                         )
+            if changed_inputs:
+                self.write_log(log_file)
         else:
-            with open(log_file, 'w') as log_fh:
-                inputs = self.__dict__
-                inputs['pvactools_version'] = pkg_resources.get_distribution("pvactools").version
-                yaml.dump(inputs, log_fh, default_flow_style=False)
+            self.write_log(log_file)
+
+    def write_log(self, log_file):
+        with open(log_file, 'w') as log_fh:
+            inputs = self.__dict__
+            inputs['pvactools_version'] = pkg_resources.get_distribution("pvactools").version
+            yaml.dump({k: v for (k, v) in inputs.items() if k != 'run_manifest'}, log_fh, default_flow_style=False)
+
+    def restart_inputs_changed(self, msg):
+        if self.allow_changed_inputs:
+            status_message(msg + "Outputs depending on changed inputs will be recomputed.")
+        else:
+            sys.exit(msg + "Aborting.")
+
+    def manifest(self):
+        #Created on first use so that it isn't part of the logged inputs
+        if self.run_manifest is None:
+            self.run_manifest = RunManifest(os.path.join(self.output_dir, 'run_manifest.json'))
+        return self.run_manifest
 
     def tsv_file_path(self):
         if self.input_file_type == 'pvacvector_input_fasta':
@@ -101,14 +236,16 @@ class Pipeline(metaclass=ABCMeta):
         converter = getattr(sys.modules[__name__], converter_type)
         return converter(**params)
 
-    def fasta_generator(self, params):
+    def fasta_generator_class(self):
         generator_types = {
             'vcf'                   : 'FastaGenerator',
             'pvacvector_input_fasta': 'VectorFastaGenerator',
         }
         generator_type = generator_types[self.input_file_type]
-        generator = getattr(sys.modules[__name__], generator_type)
-        return generator(**params)
+        return getattr(sys.modules[__name__], generator_type)
+
+    def fasta_generator(self, params):
+        return self.fasta_generator_class()(**params)
 
     def output_parser(self, params):
         parser_types = {
@@ -139,12 +276,8 @@ class Pipeline(metaclass=ABCMeta):
         generate_combined_fasta.main(params)
         os.unlink("{}.manufacturability.tsv".format(fasta_path))
 
-    def convert_vcf(self):
+    def convert_vcf(self, converted_vcf_pipeline=None):
         status_message("Converting .%s to TSV" % self.input_file_type)
-        if os.path.exists(self.tsv_file_path()):
-            status_message("TSV file already exists. Skipping.")
-            return
-
         convert_params = {
             'input_file' : self.input_file,
             'output_file': self.tsv_file_path(),
@@ -160,10 +293,38 @@ class Pipeline(metaclass=ABCMeta):
             self.proximal_variants_file = proximal_variants_tsv
             convert_params['flanking_bases'] = max(self.epitope_lengths) * 4
 
-        converter = self.converter(convert_params)
-        converter.execute()
+        outputs = self.converted_vcf_outputs()
+        inputs = [self.input_file, self.phased_proximal_variants_vcf]
+        if self.manifest().is_current(outputs, inputs, convert_params):
+            status_message("TSV file already exists and is up to date. Skipping.")
+            return
+
+        if converted_vcf_pipeline is not None and self.shares_converted_vcf(converted_vcf_pipeline):
+            #The other pipeline already converted the same VCF with the same parameters
+            for (output, converted_output) in zip(outputs, converted_vcf_pipeline.converted_vcf_outputs()):
+                shutil.copyfile(converted_output, output)
+        else:
+            #The number of threads only affects how the VCF is converted and not the output
+            converter = self.converter({**convert_params, 'n_threads': self.n_threads})
+            converter.execute()
+        self.manifest().record(outputs, inputs, convert_params)
         print("Completed")
 
+    def converted_vcf_outputs(self):
+        outputs = [self.tsv_file_path()]
+        if self.proximal_variants_file is not None:
+            outputs.append(self.proximal_variants_file)
+        return outputs
+
+    def shares_converted_vcf(self, pipeline):
+        #The proximal variants are collected based on the maximum epitope length
+        if self.phased_proximal_variants_vcf is not None and max(self.epitope_lengths) != max(pipeline.epitope_lengths):
+            return False
+        for attribute in ['input_file', 'sample_name', 'pass_only', 'normal_sample_name', 'phased_proximal_variants_vcf']:
+            if getattr(self, attribute) != getattr(pipeline, attribute):
+                return False
+        return all(os.path.exists(output) for output in pipeline.converted_vcf_outputs())
+
     def tsv_entry_count(self):
         with open(self.tsv_file_path()) as tsv_file:
             reader  = csv.DictReader(tsv_file, delimiter='\t')
@@ -186,7 +347,7 @@ class Pipeline(metaclass=ABCMeta):
             status_message("Splitting TSV into smaller chunks - Entries %d-%d" % (split_start, split_end))
             split_tsv_file_path = "%s_%d-%d" % (self.tsv_file_path(), split_start, split_end)
             chunks.append([split_start, split_end])
-            if os.path.exists(split_tsv_file_path):
+            if self.manifest().is_current([split_tsv_file_path], [self.tsv_file_path()]):
                 status_message("Split TSV file for Entries %d-%d already exists. Skipping." % (split_start, split_end))
                 skip = 1
             else:
@@ -202,6 +363,7 @@ class Pipeline(metaclass=ABCMeta):
                 if row_count % tsv_size == 0:
                     if skip == 0:
                         split_tsv_file.close()
+                        self.manifest().record([split_tsv_file_path], [self.tsv_file_path()])
                     split_start = row_count + 1
                     split_end   = split_start + tsv_size - 1
                     if split_end > total_row_count:
@@ -209,7 +371,7 @@ class Pipeline(metaclass=ABCMeta):
                     status_message("Splitting TSV into smaller chunks - Entries %d-%d" % (split_start, split_end))
                     split_tsv_file_path = "%s_%d-%d" % (self.tsv_file_path(), split_start, split_end)
                     chunks.append([split_start, split_end])
-                    if os.path.exists(split_tsv_file_path):
+                    if self.manifest().is_current([split_tsv_file_path], [self.tsv_file_path()]):
                         status_message("Split TSV file for Entries %d-%d already exists. Skipping." % (split_start, split_end))
                         skip = 1
                     else:
@@ -220,11 +382,24 @@ class Pipeline(metaclass=ABCMeta):
                 row_count += 1
             if skip == 0:
                 split_tsv_file.close()
+                self.manifest().record([split_tsv_file_path], [self.tsv_file_path()])
         status_message("Completed")
         return chunks
 
+    def generate_fasta_outputs(self, length_params):
+        return [length_params['output_file'], length_params['output_key_file']]
+
+    def generate_fasta_inputs(self, generate_fasta_params):
+        return [generate_fasta_params['input_file'], self.proximal_variants_file]
+
+    def record_generated_fasta(self, generate_fasta_params, length_params, fasta_chunk):
+        for params in length_params:
+            self.manifest().record(self.generate_fasta_outputs(params), self.generate_fasta_inputs(generate_fasta_params), {**generate_fasta_params, **params})
+        status_message("Generated Variant Peptide FASTA and Key Files - Entries {}".format(fasta_chunk))
+
     def generate_fasta(self, chunks):
         status_message("Generating Variant Peptide FASTA and Key Files")
+        jobs = []
         for (split_start, split_end) in chunks:
             tsv_chunk = "%d-%d" % (split_start, split_end)
             fasta_chunk = "%d-%d" % (split_start*2-1, split_end*2)
@@ -242,22 +417,191 @@ class Pipeline(metaclass=ABCMeta):
                 fasta_generator = self.fasta_generator(generate_fasta_params)
                 fasta_generator.execute()
             else:
+                generate_fasta_params['input_file'] = "%s_%s" % (self.tsv_file_path(), tsv_chunk)
+                length_params = []
                 for epitope_length in self.epitope_lengths:
                     split_fasta_file_path = "{}_{}".format(self.split_fasta_basename(epitope_length), fasta_chunk)
-                    if os.path.exists(split_fasta_file_path):
+                    params = {
+                        'epitope_length'          : epitope_length,
+                        'flanking_sequence_length': epitope_length - 1,
+                        'output_file'             : split_fasta_file_path,
+                        'output_key_file'         : split_fasta_file_path + '.key',
+                    }
+                    if self.manifest().is_current(self.generate_fasta_outputs(params), self.generate_fasta_inputs(generate_fasta_params), {**generate_fasta_params, **params}):
                         status_message("Split FASTA file for Epitope Length {} - Entries {} already exists. Skipping.".format(epitope_length, fasta_chunk))
                         continue
-                    split_fasta_key_file_path = split_fasta_file_path + '.key'
-                    generate_fasta_params['input_file'] = "%s_%s" % (self.tsv_file_path(), tsv_chunk)
-                    generate_fasta_params['epitope_length'] = epitope_length
-                    generate_fasta_params['flanking_sequence_length'] = epitope_length - 1
-                    generate_fasta_params['output_file'] = split_fasta_file_path
-                    generate_fasta_params['output_key_file'] = split_fasta_key_file_path
-                    status_message("Generating Variant Peptide FASTA and Key Files - Epitope Length {} - Entries {}".format(epitope_length, fasta_chunk))
-                    fasta_generator = self.fasta_generator(generate_fasta_params)
-                    fasta_generator.execute()
+                    length_params.append(params)
+                if len(length_params) > 0:
+                    jobs.append((dict(generate_fasta_params), length_params, fasta_chunk))
+        if len(jobs) > 1 and self.n_threads > 1:
+            #Chunks are independent so their FASTA files are generated in parallel processes
+            with ProcessPoolExecutor(max_workers=self.n_threads) as executor:
+                futures = [executor.submit(self.fasta_generator_class().execute_for_lengths, params, length_params) for (params, length_params, fasta_chunk) in jobs]
+                for ((params, length_params, fasta_chunk), future) in zip(jobs, futures):
+                    future.result()
+                    self.record_generated_fasta(params, length_params, fasta_chunk)
+        else:
+            for (params, length_params, fasta_chunk) in jobs:
+                status_message("Generating Variant Peptide FASTA and Key Files - Epitope Lengths {} - Entries {}".format(", ".join(str(length['epitope_length']) for length in length_params), fasta_chunk))
+                self.fasta_generator_class().execute_for_lengths(params, length_params)
+                self.record_generated_fasta(params, length_params, fasta_chunk)
         status_message("Completed")
 
+    def prediction_cache_arguments(self):
+        arguments = []
+        if self.prediction_cache is not None:
+            arguments.extend(['--prediction-cache', self.prediction_cache])
+            if self.prediction_cache_size is not None:
+                arguments.extend(['--prediction-cache-size', str(self.prediction_cache_size)])
+        return arguments
+
+    def unique_epitopes_fasta_path(self, epitope_length):
+        return os.path.join(self.tmp_dir, "{}.{}.unique.fa".format(self.sample_name, epitope_length))
+
+    def deduplicate_argument_sets(self, argument_sets):
+        split_fasta_files = OrderedDict()
+        for arguments in argument_sets:
+            fields = prediction_job_fields(arguments)
+            epl = fields.epitope_length
+            if epl not in split_fasta_files:
+                split_fasta_files[epl] = []
+            if fields.input_file not in split_fasta_files[epl]:
+                split_fasta_files[epl].append(fields.input_file)
+
+        unique_fasta_files = {}
+        for (epl, fasta_files) in split_fasta_files.items():
+            epitopes = []
+            for fasta_file in fasta_files:
+                epitopes.extend(determine_epitopes(fasta_file, epl))
+            peptides = unique_peptides(epitopes)
+            if len(peptides) == 0:
+                continue
+            unique_fasta_file = self.unique_epitopes_fasta_path(epl)
+            write_peptide_fasta(peptides, unique_fasta_file)
+            unique_fasta_files[epl] = unique_fasta_file
+            status_message("Epitope Length %s: Predicting %s unique epitopes instead of %s epitopes" % (epl, len(peptides), len(epitopes)))
+
+        deduplicated_argument_sets = []
+        fan_outs = OrderedDict()
+        for arguments in argument_sets:
+            fields = prediction_job_fields(arguments)
+            (split_fasta_file_path, split_iedb_out, method, a, epl) = (fields.input_file, fields.output_file, fields.method, fields.allele, fields.epitope_length)
+            if epl not in unique_fasta_files:
+                deduplicated_argument_sets.append(arguments)
+                continue
+            unique_iedb_out = os.path.join(self.tmp_dir, ".".join([self.sample_name, method, a, str(epl), "unique.tsv"]))
+            if unique_iedb_out not in fan_outs:
+                fan_outs[unique_iedb_out] = []
+                unique_arguments = list(arguments)
+                unique_arguments[unique_arguments.index(split_fasta_file_path)] = unique_fasta_files[epl]
+                unique_arguments[unique_arguments.index(split_iedb_out)] = unique_iedb_out
+                deduplicated_argument_sets.append(unique_arguments)
+            fan_outs[unique_iedb_out].append((split_fasta_file_path, split_iedb_out, epl))
+        return (deduplicated_argument_sets, fan_outs)
+
+    def fan_out_unique_predictions(self, fan_outs):
+        epitopes = {}
+        for (unique_iedb_out, split_files) in fan_outs.items():
+            (columns, results) = read_prediction_rows(unique_iedb_out)
+            for (split_fasta_file_path, split_iedb_out, epl) in split_files:
+                if split_fasta_file_path not in epitopes:
+                    epitopes[split_fasta_file_path] = determine_epitopes(split_fasta_file_path, epl)
+                write_predictions(fan_out_predictions(epitopes[split_fasta_file_path], results, epl, columns), split_iedb_out)
+
+    def run_prediction_jobs(self, argument_sets):
+        if self.deduplicate_epitopes:
+            split_argument_sets = argument_sets
+            (argument_sets, fan_outs) = self.deduplicate_argument_sets(argument_sets)
+
+        if self.iedb_executable is None and self.iedb_allele_batch_size > 1:
+            argument_sets = self.batch_alleles(argument_sets)
+
+        #Every job is parsed once and queued as a (method, cost, arguments) tuple
+        jobs = []
+        for arguments in argument_sets:
+            fields = prediction_job_fields(arguments)
+            jobs.append((fields.method, prediction_cost(fields.input_file, fields.method), arguments))
+        jobs.sort(key=lambda job: job[1], reverse=True)
+        if self.n_threads == 1:
+            for (method, cost, arguments) in jobs:
+                run_prediction_job(arguments)
+                self.record_prediction_job(arguments)
+        else:
+            self.schedule_prediction_jobs(jobs)
+
+        if self.deduplicate_epitopes:
+            self.fan_out_unique_predictions(fan_outs)
+            for arguments in split_argument_sets:
+                self.record_prediction_job(arguments)
+
+    def record_prediction_job(self, arguments):
+        #Deduplicated predictions are recorded once they have been fanned out to the split files
+        fields = prediction_job_fields(arguments)
+        if self.deduplicate_epitopes and fields.input_file in [self.unique_epitopes_fasta_path(epl) for epl in self.epitope_lengths]:
+            return
+        outputs = [fields.output_file] + [output_file for (allele, output_file) in fields.batch_allele]
+        for output in outputs:
+            self.manifest().record([output], [fields.input_file])
+
+    def batch_alleles(self, argument_sets):
+        batched_argument_sets = []
+        batches = OrderedDict()
+        for arguments in argument_sets:
+            fields = prediction_job_fields(arguments)
+            prediction = globals()[fields.method]()
+            if not getattr(prediction, 'supports_allele_batching', False) or fields.prediction_cache is not None:
+                batched_argument_sets.append(arguments)
+                continue
+            key = (fields.input_file, fields.method, fields.epitope_length)
+            if key not in batches:
+                batches[key] = []
+            batches[key].append(arguments)
+
+        for allele_argument_sets in batches.values():
+            for i in range(0, len(allele_argument_sets), self.iedb_allele_batch_size):
+                batch = allele_argument_sets[i:i+self.iedb_allele_batch_size]
+                arguments = list(batch[0])
+                for other_arguments in batch[1:]:
+                    other_fields = prediction_job_fields(other_arguments)
+                    arguments.extend(['--batch-allele', other_fields.allele, other_fields.output_file])
+                batched_argument_sets.append(arguments)
+        return batched_argument_sets
+
+    def schedule_prediction_jobs(self, jobs):
+        pending = list(jobs)
+        running = {}
+        running_per_method = defaultdict(int)
+        #Limit the number of concurrent IEDB requests and prediction jobs across all worker processes
+        #and, if they run concurrently, across all pipelines of the run
+        limits = _prediction_limits
+        if limits is None:
+            limits = prediction_limits(self.iedb_max_requests)
+        with ProcessPoolExecutor(max_workers=self.n_threads, initializer=set_prediction_limits, initargs=limits) as executor:
+            while len(pending) > 0 or len(running) > 0:
+                #Submit the most expensive jobs first while respecting the per-method limits
+                for job in list(pending):
+                    if len(running) >= self.n_threads:
+                        break
+                    (method, cost, arguments) = job
+                    if running_per_method[method] >= PREDICTION_METHOD_CONCURRENCY_LIMITS.get(method, self.n_threads):
+                        continue
+                    pending.remove(job)
+                    running[executor.submit(run_prediction_job, arguments)] = job
+                    running_per_method[method] += 1
+
+                (done, not_done) = wait(running.keys(), return_when=FIRST_COMPLETED)
+                for future in done:
+                    (method, cost, arguments) = running.pop(future)
+                    running_per_method[method] -= 1
+                    try:
+                        future.result()
+                    except BaseException as err:
+                        for other_future in running.keys():
+                            other_future.cancel()
+                        fields = prediction_job_fields(arguments)
+                        raise Exception("Prediction on Allele %s and Epitope Length %s with Method %s - File %s failed:\n%s" % (fields.allele, fields.epitope_length, fields.method, fields.output_file, err)) from err
+                    self.record_prediction_job(arguments)
+
     def split_fasta_basename(self, epitope_length):
         if epitope_length is None:
             return os.path.join(self.tmp_dir, "{}.fa.split".format(self.sample_name))
@@ -309,7 +653,7 @@ class Pipeline(metaclass=ABCMeta):
                             continue
 
                         split_iedb_out = os.path.join(self.tmp_dir, ".".join([self.sample_name, iedb_method, a, str(epl), "tsv_%s" % fasta_chunk]))
-                        if os.path.exists(split_iedb_out):
+                        if self.manifest().is_current([split_iedb_out], [split_fasta_file_path]):
                             msg = "Prediction file for Allele %s and Epitope Length %s with Method %s (Entries %s) already exists. Skipping." % (a, epl, method, fasta_chunk)
                             if msg not in warning_messages:
                                 warning_messages.append(msg)
@@ -323,21 +667,13 @@ class Pipeline(metaclass=ABCMeta):
                             '-e', self.iedb_executable,
                             '-l', str(epl),
                         ]
+                        arguments.extend(self.prediction_cache_arguments())
                         argument_sets.append(arguments)
 
         for msg in warning_messages:
             status_message(msg)
 
-        with pymp.Parallel(self.n_threads) as p:
-            for index in p.range(len(argument_sets)):
-                arguments = argument_sets[index]
-                a = arguments[3]
-                method = arguments[2]
-                filename = arguments[1]
-                epl = arguments[9]
-                p.print("Making binding predictions on Allele %s and Epitope Length %s with Method %s - File %s" % (a, epl, method, filename))
-                pvactools.lib.call_iedb.main(arguments)
-                p.print("Making binding predictions on Allele %s and Epitope Length %s with Method %s - File %s - Completed" % (a, epl, method, filename))
+        self.run_prediction_jobs(argument_sets)
 
     def parse_outputs(self, chunks):
         split_parsed_output_files = []
@@ -369,10 +705,6 @@ class Pipeline(metaclass=ABCMeta):
                             split_iedb_output_files.append(split_iedb_out)
 
                     split_parsed_file_path = os.path.join(self.tmp_dir, ".".join([self.sample_name, a, str(epl), "parsed", "tsv_%s" % fasta_chunk]))
-                    if os.path.exists(split_parsed_file_path):
-                        status_message("Parsed Output File for Allele %s and Epitope Length %s (Entries %s) already exists. Skipping" % (a, epl, fasta_chunk))
-                        split_parsed_output_files.append(split_parsed_file_path)
-                        continue
                     if self.input_file_type == 'pvacvector_input_fasta':
                         split_fasta_file_path = "{}_1-2.{}.tsv".format(self.split_fasta_basename(None), epl)
                     else:
@@ -380,7 +712,6 @@ class Pipeline(metaclass=ABCMeta):
                     split_fasta_key_file_path = split_fasta_file_path + '.key'
 
                     if len(split_iedb_output_files) > 0:
-                        status_message("Parsing prediction file for Allele %s and Epitope Length %s - Entries %s" % (a, epl, fasta_chunk))
                         split_tsv_file_path = "%s_%s" % (self.tsv_file_path(), tsv_chunk)
                         params = {
                             'input_iedb_files'       : split_iedb_output_files,
@@ -391,8 +722,15 @@ class Pipeline(metaclass=ABCMeta):
                         params['sample_name'] = self.sample_name
                         if self.additional_report_columns and 'sample_name' in self.additional_report_columns:
                             params['add_sample_name_column'] = True 
+                        inputs = split_iedb_output_files + [split_tsv_file_path, split_fasta_key_file_path]
+                        if self.manifest().is_current([split_parsed_file_path], inputs, params):
+                            status_message("Parsed Output File for Allele %s and Epitope Length %s (Entries %s) already exists. Skipping" % (a, epl, fasta_chunk))
+                            split_parsed_output_files.append(split_parsed_file_path)
+                            continue
+                        status_message("Parsing prediction file for Allele %s and Epitope Length %s - Entries %s" % (a, epl, fasta_chunk))
                         parser = self.output_parser(params)
                         parser.execute()
+                        self.manifest().record([split_parsed_file_path], inputs, params)
                         status_message("Parsing prediction file for Allele %s and Epitope Length %s - Entries %s - Completed" % (a, epl, fasta_chunk))
 
                         split_parsed_output_files.append(split_parsed_file_path)
@@ -411,6 +749,8 @@ class Pipeline(metaclass=ABCMeta):
         ]
         if self.input_file_type == 'fasta':
             params.extend(['--file-type', 'pVACbind'])
+        if self.parquet:
+            params.append('--parquet')
         pvactools.lib.combine_parsed_outputs.main(params)
         status_message("Completed")
 
@@ -532,7 +872,7 @@ class PvacbindPipeline(Pipeline):
         split_fasta_file_path = "%s_%d-%d" % (self.split_fasta_basename(length), split_start, split_end)
         split_fasta_key_file_path = "{}.key".format(split_fasta_file_path)
         chunks.append([split_start, split_end])
-        if os.path.exists(split_fasta_file_path):
+        if self.manifest().is_current([split_fasta_file_path, split_fasta_key_file_path], [self.fasta_basename(length)]):
             status_message("Split FASTA file for Entries %d-%d already exists. Skipping." % (split_start, split_end))
             skip = 1
         else:
@@ -548,9 +888,9 @@ class PvacbindPipeline(Pipeline):
                     (uniq_records, keys) = self.uniquify_records(split_fasta_records)
                     with open(split_fasta_file_path, 'w') as split_fasta_file:
                         SeqIO.write(uniq_records, split_fasta_file, "fasta")
-                    with open(split_fasta_key_file_path, 'w') as split_fasta_key_file:
-                        yaml.dump(keys, split_fasta_key_file, default_flow_style=False)
+                    write_key_file(keys, split_fasta_key_file_path)
                     split_fasta_file.close()
+                    self.manifest().record([split_fasta_file_path, split_fasta_key_file_path], [self.fasta_basename(length)])
                 split_start = row_count + 1
                 split_end   = split_start + self.fasta_size - 1
                 if split_end > fasta_entry_count:
@@ -559,7 +899,7 @@ class PvacbindPipeline(Pipeline):
                 split_fasta_file_path = "%s_%d-%d" % (self.split_fasta_basename(length), split_start, split_end)
                 split_fasta_key_file_path = "{}.key".format(split_fasta_file_path)
                 chunks.append([split_start, split_end])
-                if os.path.exists(split_fasta_file_path):
+                if self.manifest().is_current([split_fasta_file_path, split_fasta_key_file_path], [self.fasta_basename(length)]):
                     status_message("Split FASTA file for Entries %d-%d already exists. Skipping." % (split_start, split_end))
                     skip = 1
                 else:
@@ -570,8 +910,8 @@ class PvacbindPipeline(Pipeline):
             (uniq_records, keys) = self.uniquify_records(split_fasta_records)
             with open(split_fasta_file_path, 'w') as split_fasta_file:
                 SeqIO.write(uniq_records, split_fasta_file, "fasta")
-            with open(split_fasta_key_file_path, 'w') as split_fasta_key_file:
-                yaml.dump(keys, split_fasta_key_file, default_flow_style=False)
+            write_key_file(keys, split_fasta_key_file_path)
+            self.manifest().record([split_fasta_file_path, split_fasta_key_file_path], [self.fasta_basename(length)])
         status_message("Completed")
         return chunks
 
@@ -615,7 +955,7 @@ class PvacbindPipeline(Pipeline):
                         continue
 
                     split_iedb_out = os.path.join(self.tmp_dir, ".".join([self.sample_name, iedb_method, a, str(length), "tsv_%s" % fasta_chunk]))
-                    if os.path.exists(split_iedb_out):
+                    if self.manifest().is_current([split_iedb_out], [split_fasta_file_path]):
                         msg = "Prediction file for Allele %s and Epitope Length %s with Method %s (Entries %s) already exists. Skipping." % (a, length, method, fasta_chunk)
                         if msg not in warning_messages:
                             warning_messages.append(msg)
@@ -629,21 +969,13 @@ class PvacbindPipeline(Pipeline):
                         '-e', self.iedb_executable,
                         '-l', str(length),
                     ]
+                    arguments.extend(self.prediction_cache_arguments())
                     argument_sets.append(arguments)
 
         for msg in warning_messages:
             status_message(msg)
 
-        with pymp.Parallel(self.n_threads) as p:
-            for index in p.range(len(argument_sets)):
-                arguments = argument_sets[index]
-                a = arguments[3]
-                method = arguments[2]
-                filename = arguments[1]
-                epl = arguments[9]
-                p.print("Making binding predictions on Allele %s and Epitope Length %s with Method %s - File %s" % (a, epl, method, filename))
-                pvactools.lib.call_iedb.main(arguments)
-                p.print("Making binding predictions on Allele %s and Epitope Length %s with Method %s - File %s - Completed" % (a, epl, method, filename))
+        self.run_prediction_jobs(argument_sets)
 
     def parse_outputs(self, chunks, length):
         split_parsed_output_files = []
@@ -674,15 +1006,10 @@ class PvacbindPipeline(Pipeline):
                         split_iedb_output_files.append(split_iedb_out)
 
                 split_parsed_file_path = os.path.join(self.tmp_dir, ".".join([self.sample_name, a, str(length), "parsed", "tsv_%s" % fasta_chunk]))
-                if os.path.exists(split_parsed_file_path):
-                    status_message("Parsed Output File for Allele %s and Epitope Length %s (Entries %s) already exists. Skipping" % (a, length, fasta_chunk))
-                    split_parsed_output_files.append(split_parsed_file_path)
-                    continue
                 split_fasta_file_path = "%s_%s"%(self.split_fasta_basename(length), fasta_chunk)
                 split_fasta_key_file_path = split_fasta_file_path + '.key'
 
                 if len(split_iedb_output_files) > 0:
-                    status_message("Parsing prediction file for Allele %s and Epitope Length %s - Entries %s" % (a, length, fasta_chunk))
                     split_tsv_file_path = "%s_%s" % (self.tsv_file_path(), tsv_chunk)
                     params = {
                         'input_iedb_files'       : split_iedb_output_files,
@@ -693,8 +1020,15 @@ class PvacbindPipeline(Pipeline):
                     params['sample_name'] = self.sample_name
                     if self.additional_report_columns and 'sample_name' in self.additional_report_columns:
                         params['add_sample_name_column'] = True 
+                    inputs = split_iedb_output_files + [split_tsv_file_path, split_fasta_key_file_path]
+                    if self.manifest().is_current([split_parsed_file_path], inputs, params):
+                        status_message("Parsed Output File for Allele %s and Epitope Length %s (Entries %s) already exists. Skipping" % (a, length, fasta_chunk))
+                        split_parsed_output_files.append(split_parsed_file_path)
+                        continue
+                    status_message("Parsing prediction file for Allele %s and Epitope Length %s - Entries %s" % (a, length, fasta_chunk))
                     parser = self.output_parser(params)
                     parser.execute()
+                    self.manifest().record([split_parsed_file_path], inputs, params)
                     status_message("Parsing prediction file for Allele %s and Epitope Length %s - Entries %s - Completed" % (a, length, fasta_chunk))
 
                     split_parsed_output_files.append(split_parsed_file_path)
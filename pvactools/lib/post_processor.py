@@ -1,5 +1,5 @@
+import os
 import tempfile
-import shutil
 
 from pvactools.lib.aggregate_all_epitopes import PvacseqAggregateAllEpitopes, UnmatchedSequenceAggregateAllEpitopes
 from pvactools.lib.binding_filter import BindingFilter
@@ -9,58 +9,65 @@ from pvactools.lib.calculate_manufacturability import CalculateManufacturability
 from pvactools.lib.calculate_reference_proteome_similarity import CalculateReferenceProteomeSimilarity
 from pvactools.lib.net_chop import NetChop
 from pvactools.lib.netmhc_stab import NetMHCStab
+import pvactools.lib.run_utils
 
 class PostProcessor:
     def __init__(self, **kwargs):
+        self.reference_index = None
+        self.net_chop_path = None
+        self.netmhc_stab_path = None
+        self.prediction_cache = None
+        self.prediction_cache_size = None
+        self.parquet = False
         for (k,v) in kwargs.items():
            setattr(self, k, v)
-        self.aggregate_report = self.input_file.replace('.tsv', '.aggregated.tsv')
-        self.binding_filter_fh = tempfile.NamedTemporaryFile()
-        self.coverage_filter_fh = tempfile.NamedTemporaryFile()
-        self.transcript_support_level_filter_fh = tempfile.NamedTemporaryFile()
-        self.top_score_filter_fh = tempfile.NamedTemporaryFile()
-        self.net_chop_fh = tempfile.NamedTemporaryFile()
-        self.netmhc_stab_fh = tempfile.NamedTemporaryFile()
-        self.manufacturability_fh = tempfile.NamedTemporaryFile()
-        self.reference_similarity_fh = tempfile.NamedTemporaryFile()
+        if 'aggregate_report' not in kwargs:
+            self.aggregate_report = self.input_file.replace('.tsv', '.aggregated.tsv')
         self.file_type = kwargs.pop('file_type', None)
         self.fasta = kwargs.pop('fasta', None)
         self.net_chop_fasta = kwargs.pop('net_chop_fasta', None)
 
     def execute(self):
         self.aggregate_all_epitopes()
-        self.calculate_manufacturability()
-        self.execute_binding_filter()
-        self.execute_coverage_filter()
-        self.execute_transcript_support_level_filter()
-        self.execute_top_score_filter()
-        self.call_net_chop()
-        self.call_netmhc_stab()
-        self.calculate_reference_proteome_similarity()
-        shutil.copy(self.reference_similarity_fh.name, self.filtered_report_file)
-        self.close_filehandles()
+        #The report is read once and passed through the in-memory filter stages
+        df = pvactools.lib.run_utils.read_report(self.report_file())
+        df = self.calculate_manufacturability(df)
+        df = self.execute_binding_filter(df)
+        df = self.execute_coverage_filter(df)
+        df = self.execute_transcript_support_level_filter(df)
+        df = self.execute_top_score_filter(df)
+        self.execute_external_stages(df)
         print("\nDone: Pipeline finished successfully. File {} contains list of filtered putative neoantigens.\n".format(self.filtered_report_file))
 
+    def report_file(self):
+        #The Parquet copy of the input report is faster to read than the TSV
+        if self.parquet:
+            return pvactools.lib.run_utils.parquet_report_path(self.input_file)
+        return self.input_file
+
     def aggregate_all_epitopes(self):
         print("Creating aggregated report")
         if self.file_type == 'pVACseq':
-            PvacseqAggregateAllEpitopes(self.input_file, self.aggregate_report, self.tumor_purity).execute()
+            PvacseqAggregateAllEpitopes(self.report_file(), self.aggregate_report, self.tumor_purity).execute()
         else:
-            UnmatchedSequenceAggregateAllEpitopes(self.input_file, self.aggregate_report).execute()
+            UnmatchedSequenceAggregateAllEpitopes(self.report_file(), self.aggregate_report).execute()
         print("Completed")
 
-    def calculate_manufacturability(self):
+    def calculate_manufacturability(self, df):
         if self.run_manufacturability_metrics:
             print("Calculating Manufacturability Metrics")
-            CalculateManufacturability(self.input_file, self.manufacturability_fh.name, self.file_type).execute()
-            shutil.copy(self.manufacturability_fh.name, self.input_file)
+            df = CalculateManufacturability(self.input_file, self.input_file, self.file_type).append_manufacturability_metrics_df(df)
+            pvactools.lib.run_utils.write_report(df, self.input_file, lineterminator='\r\n')
+            if self.parquet:
+                pvactools.lib.run_utils.write_parquet_report(df, self.report_file())
             print("Completed")
+        return df
 
-    def execute_binding_filter(self):
+    def execute_binding_filter(self, df):
         print("Running Binding Filters")
-        BindingFilter(
-            self.input_file,
-            self.binding_filter_fh.name,
+        df = BindingFilter(
+            None,
+            None,
             self.binding_threshold,
             self.minimum_fold_change,
             self.top_score_metric,
@@ -68,10 +75,11 @@ class PostProcessor:
             self.allele_specific_binding_thresholds,
             self.percentile_threshold,
             self.file_type,
-        ).execute()
+        ).filter_df(df)
         print("Completed")
+        return df
 
-    def execute_coverage_filter(self):
+    def execute_coverage_filter(self, df):
         if self.run_coverage_filter:
             print("Running Coverage Filters")
             filter_criteria = []
@@ -83,70 +91,104 @@ class PostProcessor:
             filter_criteria.append({'column': "Tumor RNA VAF", 'operator': '>=', 'threshold': self.trna_vaf, 'exclude_nas': self.exclude_NAs})
             filter_criteria.append({'column': "Gene Expression", 'operator': '>=', 'threshold': self.expn_val, 'exclude_nas': self.exclude_NAs})
             filter_criteria.append({'column': "Transcript Expression", 'operator': '>=', 'threshold': self.expn_val, 'exclude_nas': self.exclude_NAs})
-            Filter(self.binding_filter_fh.name, self.coverage_filter_fh.name, filter_criteria).execute()
+            df = Filter(None, None, filter_criteria).filter_df(df)
             print("Completed")
-        else:
-            shutil.copy(self.binding_filter_fh.name, self.coverage_filter_fh.name)
+        return df
 
-    def execute_transcript_support_level_filter(self):
+    def execute_transcript_support_level_filter(self, df):
         if self.run_transcript_support_level_filter:
             print("Running Transcript Support Level Filter")
             filter_criteria = [{'column': 'Transcript Support Level', 'operator': '<=', 'threshold': self.maximum_transcript_support_level, 'exclude_nas': self.exclude_NAs}]
-            Filter(
-                self.coverage_filter_fh.name,
-                self.transcript_support_level_filter_fh.name,
-                filter_criteria,
-                ['Transcript Support Level'],
-            ).execute()
+            df = Filter(None, None, filter_criteria).filter_df(df)
             print("Complete")
-        else:
-            shutil.copy(self.coverage_filter_fh.name, self.transcript_support_level_filter_fh.name)
+        return df
 
-    def execute_top_score_filter(self):
+    def execute_top_score_filter(self, df):
         print("Running Top Score Filter")
-        TopScoreFilter(self.transcript_support_level_filter_fh.name, self.top_score_filter_fh.name, self.top_score_metric, self.file_type).execute()
+        df = TopScoreFilter(None, None, self.top_score_metric, self.file_type).filter_df(df)
         print("Completed")
+        return df
 
-    def call_net_chop(self):
+    def execute_external_stages(self, df):
+        #NetChop, NetMHCStab and the reference proteome similarity run external
+        #tools on files so only the enabled ones are chained on the filtered report
+        stages = []
         if self.run_net_chop:
-            print("Submitting remaining epitopes to NetChop")
-            NetChop(self.top_score_filter_fh.name, self.net_chop_fasta, self.net_chop_fh.name, self.net_chop_method, str(self.net_chop_threshold), self.file_type).execute()
-            print("Completed")
-        else:
-            shutil.copy(self.top_score_filter_fh.name, self.net_chop_fh.name)
-
-    def call_netmhc_stab(self):
+            stages.append(self.call_net_chop)
         if self.run_netmhc_stab:
-            print("Running NetMHCStabPan")
-            NetMHCStab(self.net_chop_fh.name, self.netmhc_stab_fh.name, self.file_type, self.top_score_metric).execute()
-            print("Completed")
-        else:
-            shutil.copy(self.net_chop_fh.name, self.netmhc_stab_fh.name)
-
-    def calculate_reference_proteome_similarity(self):
+            stages.append(self.call_netmhc_stab)
         if self.run_reference_proteome_similarity:
-            print("Calculating Reference Proteome Similarity")
-            CalculateReferenceProteomeSimilarity(
-                self.netmhc_stab_fh.name,
-                self.fasta,
-                self.reference_similarity_fh.name,
-                species=self.species,
-                file_type=self.file_type,
-                n_threads=self.n_threads,
-                blastp_path=self.blastp_path,
-                blastp_db=self.blastp_db,
-            ).execute()
-            shutil.move("{}.reference_matches".format(self.reference_similarity_fh.name), "{}.reference_matches".format(self.filtered_report_file))
-            print("Completed")
-        else:
-            shutil.copy(self.netmhc_stab_fh.name, self.reference_similarity_fh.name)
-
-    def close_filehandles(self):
-        self.binding_filter_fh.close()
-        self.coverage_filter_fh.close()
-        self.transcript_support_level_filter_fh.close()
-        self.top_score_filter_fh.close()
-        self.net_chop_fh.close()
-        self.netmhc_stab_fh.close()
-        self.manufacturability_fh.close()
-        self.reference_similarity_fh.close()
+            stages.append(self.calculate_reference_proteome_similarity)
+        if len(stages) == 0:
+            pvactools.lib.run_utils.write_report(df, self.filtered_report_file, lineterminator='\r\n')
+            return
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            input_file = os.path.join(tmp_dir, 'top_score_filter.tsv')
+            pvactools.lib.run_utils.write_report(df, input_file, lineterminator='\r\n')
+            for (i, stage) in enumerate(stages):
+                if i == len(stages) - 1:
+                    output_file = self.filtered_report_file
+                else:
+                    output_file = os.path.join(tmp_dir, "{}.tsv".format(stage.__name__))
+                stage(input_file, output_file)
+                input_file = output_file
+
+    def call_net_chop(self, input_file, output_file):
+        print("Submitting remaining epitopes to NetChop")
+        NetChop(input_file, self.net_chop_fasta, output_file, self.net_chop_method, str(self.net_chop_threshold), self.file_type, self.n_threads, self.net_chop_path, self.prediction_cache, self.prediction_cache_size).execute()
+        print("Completed")
+
+    def call_netmhc_stab(self, input_file, output_file):
+        print("Running NetMHCStabPan")
+        NetMHCStab(input_file, output_file, self.file_type, self.top_score_metric, self.n_threads, self.netmhc_stab_path, self.prediction_cache, self.prediction_cache_size).execute()
+        print("Completed")
+
+    def calculate_reference_proteome_similarity(self, input_file, output_file):
+        print("Calculating Reference Proteome Similarity")
+        CalculateReferenceProteomeSimilarity(
+            input_file,
+            self.fasta,
+            output_file,
+            species=self.species,
+            file_type=self.file_type,
+            n_threads=self.n_threads,
+            blastp_path=self.blastp_path,
+            blastp_db=self.blastp_db,
+            reference_index=self.reference_index,
+        ).execute()
+        print("Completed")
+
+def postprocess_existing_report(args, file_type):
+    #Regenerates the filtered and aggregated reports of an existing all_epitopes report.
+    #Stages whose columns are already in the report are not run again.
+    if args.sample_name is not None:
+        sample_name = args.sample_name
+    else:
+        sample_name = os.path.splitext(os.path.basename(args.input_file))[0].replace('.all_epitopes', '')
+    input_dir = os.path.dirname(os.path.abspath(args.input_file))
+    os.makedirs(args.output_dir, exist_ok=True)
+    headers = pvactools.lib.run_utils.read_report_headers(args.input_file)
+
+    post_processing_params = vars(args).copy()
+    post_processing_params['file_type'] = file_type
+    post_processing_params['aggregate_report'] = os.path.join(args.output_dir, "{}.all_epitopes.aggregated.tsv".format(sample_name))
+    post_processing_params['filtered_report_file'] = os.path.join(args.output_dir, "{}.filtered.tsv".format(sample_name))
+    if args.fasta is None:
+        post_processing_params['fasta'] = os.path.join(input_dir, "{}.fasta".format(sample_name))
+    if args.net_chop_fasta is None:
+        post_processing_params['net_chop_fasta'] = os.path.join(input_dir, "{}.net_chop.fa".format(sample_name))
+    post_processing_params['run_manufacturability_metrics'] = False
+    post_processing_params['run_coverage_filter'] = file_type == 'pVACseq'
+    post_processing_params['run_transcript_support_level_filter'] = file_type == 'pVACseq'
+    if file_type != 'pVACseq':
+        post_processing_params['minimum_fold_change'] = None
+        post_processing_params['tumor_purity'] = None
+    post_processing_params['run_net_chop'] = (args.net_chop_method is not None
+        and not all(column in headers for column in ['Best Cleavage Position', 'Best Cleavage Score', 'Cleavage Sites']))
+    post_processing_params['run_netmhc_stab'] = (args.netmhc_stab
+        and not all(column in headers for column in ['Predicted Stability', 'Half Life', 'Stability Rank', 'NetMHCstab allele']))
+    post_processing_params['run_reference_proteome_similarity'] = (args.run_reference_proteome_similarity
+        and 'Reference Match' not in headers)
+
+    PostProcessor(**post_processing_params).execute()
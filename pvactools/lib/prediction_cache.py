@@ -0,0 +1,173 @@
+import os
+import sys
+import json
+import time
+import sqlite3
+import tempfile
+import pkg_resources
+from collections import OrderedDict
+
+from pvactools.lib.prediction_class import IEDB, MHCflurry, MHCnuggets
+from pvactools.lib.unique_epitopes import determine_epitopes, unique_peptides, write_peptide_fasta, prediction_rows, fan_out_predictions
+
+class PredictionCache:
+    """
+    On-disk cache of binding predictions shared between runs.
+
+    Predictions are stored per (method, version, allele, epitope length,
+    peptide) in a SQLite database so that epitopes that recur between samples
+    or between restarts of the same sample only need to be predicted once.
+    Every cached peptide keeps the prediction rows exactly as they were
+    returned by the predictor. Positional columns (seq_num, start, end) are
+    rewritten when the rows are fanned back out to a FASTA file.
+
+    Parameters
+    ----------
+    path : str
+        Path to the SQLite database. It will be created if it doesn't exist.
+    max_entries : int, optional
+        Maximum number of peptides to keep in the cache. When the cache grows
+        beyond this size the least recently used entries are evicted.
+    """
+    lookup_batch_size = 500
+
+    def __init__(self, path, max_entries=None):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        cache_dir = os.path.dirname(os.path.abspath(path))
+        os.makedirs(cache_dir, exist_ok=True)
+        #Several prediction jobs share the same cache so we need to be
+        #lenient with lock timeouts
+        self.connection = sqlite3.connect(path, timeout=600, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS predictions ("
+            "method TEXT NOT NULL, "
+            "version TEXT NOT NULL, "
+            "allele TEXT NOT NULL, "
+            "length INTEGER NOT NULL, "
+            "peptide TEXT NOT NULL, "
+            "result TEXT NOT NULL, "
+            "last_used REAL NOT NULL, "
+            "PRIMARY KEY (method, version, allele, length, peptide))"
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS predictions_last_used ON predictions (last_used)"
+        )
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def lookup(self, method, version, allele, length, peptides):
+        peptides = list(peptides)
+        results = {}
+        for i in range(0, len(peptides), self.lookup_batch_size):
+            batch = peptides[i:i+self.lookup_batch_size]
+            query = (
+                "SELECT peptide, result FROM predictions "
+                "WHERE method = ? AND version = ? AND allele = ? AND length = ? "
+                "AND peptide IN ({})".format(",".join("?" * len(batch)))
+            )
+            for (peptide, result) in self.connection.execute(query, [method, version, allele, length] + batch):
+                results[peptide] = json.loads(result, object_pairs_hook=OrderedDict)
+        if len(results) > 0:
+            self.touch(method, version, allele, length, results.keys())
+        self.hits += len(results)
+        self.misses += len(peptides) - len(results)
+        return results
+
+    def touch(self, method, version, allele, length, peptides):
+        now = time.time()
+        self.connection.execute("BEGIN")
+        self.connection.executemany(
+            "UPDATE predictions SET last_used = ? "
+            "WHERE method = ? AND version = ? AND allele = ? AND length = ? AND peptide = ?",
+            [(now, method, version, allele, length, peptide) for peptide in peptides]
+        )
+        self.connection.execute("COMMIT")
+
+    def store(self, method, version, allele, length, results):
+        now = time.time()
+        self.connection.execute("BEGIN")
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO predictions "
+            "(method, version, allele, length, peptide, result, last_used) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(method, version, allele, length, peptide, json.dumps(rows), now) for (peptide, rows) in results.items()]
+        )
+        self.connection.execute("COMMIT")
+        self.evict()
+
+    def size(self):
+        return self.connection.execute("SELECT COUNT(*) FROM predictions").fetchone()[0]
+
+    def evict(self):
+        if self.max_entries is None:
+            return
+        excess = self.size() - self.max_entries
+        if excess <= 0:
+            return
+        self.connection.execute("BEGIN")
+        self.connection.execute(
+            "DELETE FROM predictions WHERE last_used <= "
+            "(SELECT last_used FROM predictions ORDER BY last_used LIMIT 1 OFFSET ?)",
+            (excess - 1,)
+        )
+        self.connection.execute("COMMIT")
+
+    def statistics(self):
+        total = self.hits + self.misses
+        hit_rate = 100.0 * self.hits / total if total > 0 else 0.0
+        return "Prediction cache: {} hits, {} misses ({:.1f}% hit rate)".format(self.hits, self.misses, hit_rate)
+
+def predictor_version(prediction_class_object, iedb_executable_path=None):
+    if isinstance(prediction_class_object, IEDB):
+        if iedb_executable_path is not None:
+            return "local:{}".format(os.path.abspath(iedb_executable_path))
+        else:
+            return "api:{}".format(prediction_class_object.url)
+    if isinstance(prediction_class_object, MHCflurry):
+        package = 'mhcflurry'
+    elif isinstance(prediction_class_object, MHCnuggets):
+        package = 'mhcnuggets'
+    else:
+        package = 'pvactools'
+    try:
+        return "{}:{}".format(package, pkg_resources.get_distribution(package).version)
+    except pkg_resources.DistributionNotFound:
+        return "{}:unknown".format(package)
+
+def predict_with_cache(cache, predict, prediction_class_object, input_file, allele, epitope_length, iedb_executable_path=None):
+    epitopes = determine_epitopes(input_file, epitope_length)
+    if len(epitopes) == 0:
+        return predict(input_file)
+
+    method = prediction_class_object.__class__.__name__
+    version = predictor_version(prediction_class_object, iedb_executable_path)
+    peptides = unique_peptides(epitopes)
+    results = cache.lookup(method, version, allele, epitope_length, peptides)
+
+    columns = None
+    missing_peptides = [peptide for peptide in peptides if peptide not in results]
+    if len(missing_peptides) > 0:
+        tmp_fasta_file = tempfile.NamedTemporaryFile('w', suffix='.fa', delete=False)
+        tmp_fasta_file.close()
+        write_peptide_fasta(missing_peptides, tmp_fasta_file.name)
+        try:
+            (response_text, output_mode) = predict(tmp_fasta_file.name)
+        finally:
+            os.unlink(tmp_fasta_file.name)
+        (columns, new_results) = prediction_rows(response_text, output_mode)
+        cache.store(method, version, allele, epitope_length, new_results)
+        results.update(new_results)
+
+    return (fan_out_predictions(epitopes, results, epitope_length, columns), 'pandas')
@@ -11,8 +11,9 @@ from subprocess import run, DEVNULL, STDOUT
 import tempfile
 from collections import defaultdict
 from Bio import SeqIO
-import random
-import uuid
+
+from pvactools.lib import iedb_client
+from pvactools.lib.unique_epitopes import epitope_positions, merge_predictions_with_positions
 
 class IEDB(metaclass=ABCMeta):
     @classmethod
@@ -70,21 +71,44 @@ class IEDB(metaclass=ABCMeta):
                     'user_tool':     'pVac-seq',
                 }
 
-            response = requests.post(self.url, data=data)
-            retries = 0
-            while (response.status_code == 500 or response.status_code == 403) and retries < iedb_retries:
-                random.seed(uuid.uuid4().int)
-                time.sleep(random.randint(30,90) * retries)
-                retries += 1
-                print("IEDB: Retry %s of %s" % (retries, iedb_retries))
-                response = requests.post(self.url, data=data)
-
+            response = iedb_client.post(self.url, data, iedb_retries)
             if response.status_code != 200:
                 sys.exit("Error posting request to IEDB.\n%s" % response.text)
             response_text = response.text
             output_mode = 'w'
             return (response_text, 'w')
 
+    @property
+    def supports_allele_batching(self):
+        return False
+
+    def predict_alleles(self, input_file, alleles, epitope_length, iedb_retries):
+        #The IEDB API accepts comma-separated lists of alleles and lengths
+        #and reports the allele of each prediction in the first column
+        with open(input_file, 'r') as input_fh:
+            data = {
+                'sequence_text': input_fh.read(),
+                'method':        self.iedb_prediction_method,
+                'allele':        ",".join(alleles),
+                'length':        ",".join([str(epitope_length)] * len(alleles)),
+                'user_tool':     'pVac-seq',
+            }
+
+        response = iedb_client.post(self.url, data, iedb_retries)
+        if response.status_code != 200:
+            sys.exit("Error posting request to IEDB.\n%s" % response.text)
+        lines = response.text.splitlines()
+        if len(lines) == 0:
+            return {allele: "" for allele in alleles}
+        header = lines[0]
+        allele_lines = {allele: [header] for allele in alleles}
+        for line in lines[1:]:
+            allele = line.split("\t", 1)[0]
+            if allele not in allele_lines:
+                sys.exit("Unexpected allele {} in IEDB response".format(allele))
+            allele_lines[allele].append(line)
+        return {allele: "\n".join(lines) + "\n" for (allele, lines) in allele_lines.items()}
+
 class MHCnuggets(metaclass=ABCMeta):
     def check_length_valid_for_allele(self, length, allele):
         return True
@@ -97,23 +121,13 @@ class MHCnuggets(metaclass=ABCMeta):
             return list(filter(None, fh.read().split('\n')))
 
     def predict(self, input_file, allele, epitope_length, iedb_executable_path, iedb_retries, class_type):
-        tmp_output_file = tempfile.NamedTemporaryFile('r', delete=False)
-        script = os.path.join(os.path.dirname(os.path.realpath(__file__)), "call_mhcnuggets.py")
-        arguments = ["python", script, input_file, allele, str(epitope_length), class_type, tmp_output_file.name]
-        stderr_fh = tempfile.NamedTemporaryFile('w', delete=False)
+        #MHCnuggets is imported once per process and reused for every prediction job
+        #that process handles instead of paying the TensorFlow start-up cost for each job
         try:
-            response = run(arguments, check=True, stdout=DEVNULL, stderr=stderr_fh)
-        except:
-            stderr_fh.close()
-            with open(stderr_fh.name, 'r') as fh:
-                err = fh.read()
-            os.unlink(stderr_fh.name)
-            raise Exception("An error occurred while calling MHCnuggets:\n{}".format(err))
-        stderr_fh.close()
-        os.unlink(stderr_fh.name)
-        tmp_output_file.close()
-        df = pd.read_csv(tmp_output_file.name)
-        os.unlink(tmp_output_file.name)
+            import pvactools.lib.call_mhcnuggets
+            df = pvactools.lib.call_mhcnuggets.predict_epitopes(input_file, allele, epitope_length, class_type)
+        except Exception as err:
+            raise Exception("An error occurred while calling MHCnuggets:\n{}".format(err)) from err
         return (df, 'pandas')
 
 class PredictionClass(metaclass=ABCMeta):
@@ -286,6 +300,8 @@ class MHCI(PredictionClass, metaclass=ABCMeta):
         return True
 
 class MHCflurry(MHCI):
+    loaded_presentation_predictor = None
+
     def valid_allele_names(self):
         base_dir          = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
         alleles_dir       = os.path.join(base_dir, 'tools', 'pvacseq', 'iedb_alleles', 'class_i')
@@ -305,6 +321,14 @@ class MHCflurry(MHCI):
             epitopes[i+1] = sequence[i:i+length]
         return epitopes
 
+    @classmethod
+    def presentation_predictor(cls):
+        #Loading the MHCflurry models is expensive so they are only loaded once per process
+        if cls.loaded_presentation_predictor is None:
+            from mhcflurry import Class1PresentationPredictor
+            cls.loaded_presentation_predictor = Class1PresentationPredictor.load()
+        return cls.loaded_presentation_predictor
+
     def predict(self, input_file, allele, epitope_length, iedb_executable_path, iedb_retries):
         results = pd.DataFrame()
         all_epitopes = []
@@ -316,38 +340,26 @@ class MHCflurry(MHCI):
 
         all_epitopes = list(set(all_epitopes))
         if len(all_epitopes) > 0:
-            tmp_output_file = tempfile.NamedTemporaryFile('r', delete=False)
-            arguments = ["mhcflurry-predict", "--alleles", allele, "--out", tmp_output_file.name, "--peptides"]
-            arguments.extend(all_epitopes)
-            stderr_fh = tempfile.NamedTemporaryFile('w', delete=False)
             try:
-                response = run(arguments, check=True, stdout=DEVNULL, stderr=stderr_fh)
-            except:
-                stderr_fh.close()
-                with open(stderr_fh.name, 'r') as fh:
-                    err = fh.read()
-                os.unlink(stderr_fh.name)
-                raise Exception("An error occurred while calling MHCflurry:\n{}".format(err))
-            stderr_fh.close()
-            os.unlink(stderr_fh.name)
-            tmp_output_file.close()
-            df = pd.read_csv(tmp_output_file.name)
-            os.unlink(tmp_output_file.name)
-            df.rename(columns={
-                'mhcflurry_prediction': 'ic50',
-                'mhcflurry_affinity': 'ic50',
-                'mhcflurry_prediction_percentile': 'percentile',
-                'mhcflurry_affinity_percentile': 'percentile'
-            }, inplace=True)
-            for record in SeqIO.parse(input_file, "fasta"):
-                seq_num = record.id
-                peptide = str(record.seq)
-                epitopes = self.determine_neoepitopes(peptide, epitope_length)
-                for start, epitope in epitopes.items():
-                    epitope_df = df[df['peptide'] == epitope]
-                    epitope_df['seq_num'] = seq_num
-                    epitope_df['start'] = start
-                    results = pd.concat((results, epitope_df), axis=0)
+                predictions = self.presentation_predictor().predict(
+                    peptides=all_epitopes,
+                    alleles=[allele],
+                    include_affinity_percentile=True,
+                    verbose=0,
+                )
+            except Exception as err:
+                raise Exception("An error occurred while calling MHCflurry:\n{}".format(err)) from err
+            df = pd.DataFrame({
+                'allele': allele,
+                'peptide': predictions['peptide'].values,
+                'ic50': predictions['affinity'].values,
+                'percentile': predictions['affinity_percentile'].values,
+                'mhcflurry_processing_score': predictions['processing_score'].values,
+                'mhcflurry_presentation_score': predictions['presentation_score'].values,
+                'mhcflurry_presentation_percentile': predictions['presentation_percentile'].values,
+            })
+            positions = epitope_positions(input_file, epitope_length)
+            results = merge_predictions_with_positions(positions, df)[list(df.columns) + ['seq_num', 'start']]
         return (results, 'pandas')
 
 class MHCnuggetsI(MHCI, MHCnuggets):
@@ -368,6 +380,10 @@ class IEDBMHCI(MHCI, IEDB, metaclass=ABCMeta):
     def url(self):
         return 'http://tools-cluster-interface.iedb.org/tools_api/mhci/'
 
+    @property
+    def supports_allele_batching(self):
+        return True
+
     def parse_iedb_allele_file(self):
         #Ultimately we probably want this method to call out to IEDB but their command is currently broken
         #curl --data "method=ann&species=human" http://tools-api.iedb.org/tools_api/mhci/
@@ -1,4 +1,5 @@
 import vcfpy
+import pysam
 import sys
 import os
 from pvactools.lib.csq_parser import CsqParser
@@ -24,11 +25,45 @@ class ProximalVariant:
         if csq_header is None:
             sys.exit('Failed to extract format string from info description for tag (CSQ)')
         else:
-            self.csq_parser = CsqParser(csq_header.description)
+            self.csq_parser = CsqParser.for_header(csq_header.description)
 
         self.pass_only = pass_only
         self.flanking_bases = flanking_bases
 
+        self.tabix_file = pysam.TabixFile(proximal_variants_vcf)
+        self.tabix_contigs = set(self.tabix_file.contigs)
+        self.contig = None
+        self.window_start = None
+        self.window = []
+        self.entries = iter(())
+        self.next_entry = None
+
+    def close(self):
+        self.proximal_variants_vcf.close()
+        self.tabix_file.close()
+
+    def stream_contig(self, chromosome):
+        self.contig = chromosome
+        self.window = []
+        if chromosome in self.tabix_contigs:
+            self.entries = (self.proximal_variants_vcf.parser.parse_line(line) for line in self.tabix_file.fetch(chromosome))
+        else:
+            self.entries = iter(())
+        self.next_entry = next(self.entries, None)
+
+    def fetch(self, chromosome, start, end):
+        #Somatic variants are looked up in file order so instead of fetching the
+        #region around each of them, the phased entries of a contig are streamed
+        #once while keeping a window of the entries that can still overlap
+        if chromosome != self.contig or start < self.window_start:
+            self.stream_contig(chromosome)
+        self.window_start = start
+        self.window = [entry for entry in self.window if entry.begin + len(entry.REF) > start]
+        while self.next_entry is not None and self.next_entry.begin < end:
+            self.window.append(self.next_entry)
+            self.next_entry = next(self.entries, None)
+        return [entry for entry in self.window if entry.begin < end and entry.begin + len(entry.REF) > start]
+
     def extract(self, somatic_variant, alt, transcript):
         (phased_somatic_variant, potential_proximal_variants) = self.find_phased_somatic_variant_and_potential_proximal_variants(somatic_variant, alt, transcript)
 
@@ -76,11 +111,7 @@ class ProximalVariant:
     def find_phased_somatic_variant_and_potential_proximal_variants(self, somatic_variant, alt, transcript):
         potential_proximal_variants = []
         phased_somatic_variant = None
-        try:
-            entries = self.proximal_variants_vcf.fetch(somatic_variant.CHROM, somatic_variant.begin - self.flanking_bases, somatic_variant.affected_end + self.flanking_bases)
-        except ValueError as e:
-            return (phased_somatic_variant, potential_proximal_variants)
-
+        entries = self.fetch(somatic_variant.CHROM, somatic_variant.begin - self.flanking_bases, somatic_variant.affected_end + self.flanking_bases)
         for entry in entries:
             if self.pass_only:
                 filt = entry.FILTER
@@ -3,11 +3,11 @@ import csv
 import re
 import tempfile
 import math
-import yaml
 from collections import OrderedDict
 
 from pvactools.lib.input_file_converter import VcfConverter
 from pvactools.lib.fasta_generator import FastaGenerator
+from pvactools.lib.key_file import read_key_file
 
 class PvacvectorInputFastaGenerator():
     def __init__(self, pvacseq_tsv, input_vcf, output_dir, n_mer, sample_name):
@@ -53,8 +53,7 @@ class PvacvectorInputFastaGenerator():
             'output_key_file': key_file.name,
         }).execute()
 
-        with open(key_file.name, 'r') as fasta_key_file:
-            keys = yaml.load(fasta_key_file, Loader=yaml.FullLoader)
+        keys = read_key_file(key_file.name)
 
         dataframe = OrderedDict()
         with open(fasta_file.name, 'r') as fasta_file:
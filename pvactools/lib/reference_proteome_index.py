@@ -0,0 +1,113 @@
+import os
+import json
+import numpy as np
+from Bio import SeqIO
+
+#Exact k-mer index of a reference proteome FASTA. Every k-mer is packed into a
+#64 bit integer using 5 bits per amino acid and the packed k-mers are stored as
+#a sorted array together with the protein and position each one occurs at.
+#The arrays are saved as .npy files so that they can be memory-mapped and
+#searched with a binary search instead of having to be loaded or rebuilt.
+
+AMINO_ACIDS = 'ACDEFGHIKLMNPQRSTVWYBJOUXZ'
+BITS_PER_AMINO_ACID = 5
+MAX_MATCH_LENGTH = 64 // BITS_PER_AMINO_ACID
+INVALID = 255
+
+def amino_acid_codes():
+    codes = np.full(256, INVALID, dtype=np.uint8)
+    for (i, amino_acid) in enumerate(AMINO_ACIDS):
+        codes[ord(amino_acid)] = i
+        codes[ord(amino_acid.lower())] = i
+    return codes
+
+def encode_kmers(sequence, match_length):
+    #Returns the packed k-mer starting at every position of the sequence and
+    #a mask of the k-mers that only contain valid amino acids
+    residues = amino_acid_codes()[np.frombuffer(sequence.encode(), dtype=np.uint8)]
+    count = len(residues) - match_length + 1
+    if count <= 0:
+        return (np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=bool))
+    kmers = np.zeros(count, dtype=np.uint64)
+    valid = np.ones(count, dtype=bool)
+    for i in range(match_length):
+        window = residues[i:i+count]
+        kmers = (kmers << np.uint64(BITS_PER_AMINO_ACID)) | window.astype(np.uint64)
+        valid &= window != INVALID
+    return (kmers, valid)
+
+class ReferenceProteomeIndex:
+    def __init__(self, index_directory):
+        metadata_file = os.path.join(index_directory, 'metadata.json')
+        if not os.path.exists(metadata_file):
+            raise Exception("{} is not a reference proteome index directory. Build one with `pvactools build_reference_proteome_index`.".format(index_directory))
+        with open(metadata_file, 'r') as metadata_fh:
+            metadata = json.load(metadata_fh)
+        self.match_length = metadata['match_length']
+        self.species = metadata['species']
+        self.kmers = np.load(os.path.join(index_directory, 'kmers.npy'), mmap_mode='r')
+        self.proteins = np.load(os.path.join(index_directory, 'proteins.npy'), mmap_mode='r')
+        self.positions = np.load(os.path.join(index_directory, 'positions.npy'), mmap_mode='r')
+        self.protein_ids = []
+        self.protein_definitions = []
+        with open(os.path.join(index_directory, 'proteins.tsv'), 'r') as proteins_fh:
+            for line in proteins_fh:
+                (protein_id, definition) = line.rstrip('\n').split('\t')
+                self.protein_ids.append(protein_id)
+                self.protein_definitions.append(definition)
+
+    @classmethod
+    def build(cls, reference_fasta, index_directory, match_length=8, species=None):
+        if match_length > MAX_MATCH_LENGTH:
+            raise Exception("Reference proteome indexes support a maximum match length of {}.".format(MAX_MATCH_LENGTH))
+        os.makedirs(index_directory, exist_ok=True)
+        all_kmers = []
+        all_proteins = []
+        all_positions = []
+        with open(os.path.join(index_directory, 'proteins.tsv'), 'w') as proteins_fh:
+            for (i, record) in enumerate(SeqIO.parse(reference_fasta, "fasta")):
+                definition = record.description[len(record.id):].strip()
+                proteins_fh.write("{}\t{}\n".format(record.id, definition.replace('\t', ' ')))
+                (kmers, valid) = encode_kmers(str(record.seq), match_length)
+                positions = np.nonzero(valid)[0]
+                all_kmers.append(kmers[positions])
+                all_proteins.append(np.full(len(positions), i, dtype=np.uint32))
+                all_positions.append(positions.astype(np.uint32))
+        kmers = np.concatenate(all_kmers) if all_kmers else np.zeros(0, dtype=np.uint64)
+        proteins = np.concatenate(all_proteins) if all_proteins else np.zeros(0, dtype=np.uint32)
+        positions = np.concatenate(all_positions) if all_positions else np.zeros(0, dtype=np.uint32)
+        #A stable sort keeps the hits for each k-mer in reference FASTA order
+        order = np.argsort(kmers, kind='stable')
+        np.save(os.path.join(index_directory, 'kmers.npy'), kmers[order])
+        np.save(os.path.join(index_directory, 'proteins.npy'), proteins[order])
+        np.save(os.path.join(index_directory, 'positions.npy'), positions[order])
+        with open(os.path.join(index_directory, 'metadata.json'), 'w') as metadata_fh:
+            json.dump({
+                'match_length': match_length,
+                'species': species,
+                'reference_fasta': os.path.abspath(reference_fasta),
+                'kmer_count': len(kmers),
+            }, metadata_fh, indent=4)
+        return cls(index_directory)
+
+    def matches(self, peptide):
+        #Returns every match_length window of the peptide that occurs in the
+        #reference proteome together with the 1-based position of the hit
+        (kmers, valid) = encode_kmers(peptide, self.match_length)
+        starts = np.searchsorted(self.kmers, kmers, side='left')
+        stops = np.searchsorted(self.kmers, kmers, side='right')
+        matches = []
+        for i in np.nonzero(valid & (stops > starts))[0]:
+            window = peptide[i:i+self.match_length]
+            for j in range(starts[i], stops[i]):
+                protein = self.proteins[j]
+                position = int(self.positions[j])
+                matches.append({
+                    'Hit ID': self.protein_ids[protein],
+                    'Hit Definition': self.protein_definitions[protein],
+                    'Query Window': window,
+                    'Match Sequence': window,
+                    'Match Start': position + 1,
+                    'Match Stop': position + self.match_length,
+                })
+        return matches
@@ -1,5 +1,6 @@
 from abc import ABCMeta
 import argparse
+import yaml
 
 from pvactools.lib.prediction_class import PredictionClass
 import pvactools.lib.net_chop
@@ -12,6 +13,7 @@ class RunArgumentParser(metaclass=ABCMeta):
             description="Run the {} pipeline".format(tool_name.replace('vac', 'VAC')),
             formatter_class=argparse.ArgumentDefaultsHelpFormatter
         )
+        self.tool_name = tool_name
 
         parser.add_argument(
             "input_file",
@@ -61,6 +63,39 @@ class RunArgumentParser(metaclass=ABCMeta):
             "--iedb-install-directory",
             help="Directory that contains the local installation of IEDB MHC I and/or MHC II."
         )
+        self.add_binding_filter_arguments(parser)
+        parser.add_argument(
+            "-r", "--iedb-retries",type=int,
+            default=5,
+            help="Number of retries when making requests to the IEDB RESTful web interface. Must be less than or equal to 100.",
+        )
+        parser.add_argument(
+            "--iedb-max-requests", type=int,
+            help="Maximum number of concurrent requests to the IEDB RESTful web interface across all threads and concurrent pipelines. "
+                 + "By default the number of concurrent requests is only limited by the number of threads.",
+        )
+        parser.add_argument(
+            "--iedb-allele-batch-size", type=int,
+            default=1,
+            help="Number of alleles to submit in a single request to the IEDB RESTful web interface. "
+                 + "Only applies to IEDB MHC class I prediction algorithms.",
+        )
+        parser.add_argument(
+            "-k", "--keep-tmp-files",
+            action='store_true',
+            help="Keep intermediate output files. This might be useful for debugging purposes.",
+        )
+        self.add_threads_and_prediction_cache_arguments(parser)
+        parser.add_argument(
+            "--deduplicate-epitopes",
+            action='store_true',
+            help="Predict each unique epitope only once per allele, epitope length, and prediction algorithm "
+                 + "instead of once per occurrence in every FASTA chunk. "
+                 + "The predictions are then copied to every position at which the epitope occurs.",
+        )
+        self.parser = parser
+
+    def add_binding_filter_arguments(self, parser):
         parser.add_argument(
             "-b","--binding-threshold", type=int,
             default=500,
@@ -73,7 +108,7 @@ class RunArgumentParser(metaclass=ABCMeta):
         )
         parser.add_argument(
             '--allele-specific-binding-thresholds',
-            help="Use allele-specific binding thresholds. To print the allele-specific binding thresholds run `%s allele_specific_cutoffs`. " % tool_name
+            help="Use allele-specific binding thresholds. To print the allele-specific binding thresholds run `%s allele_specific_cutoffs`. " % self.tool_name
                  + "If an allele does not have a special threshold value, the `--binding-threshold` value will be used.",
             default=False,
             action='store_true',
@@ -86,76 +121,129 @@ class RunArgumentParser(metaclass=ABCMeta):
                  + "lowest: Use the best MT Score and Corresponding Fold Change (i.e. the lowest MT ic50 binding score and corresponding fold change of all chosen prediction methods). "
                  + "median: Use the median MT Score and Median Fold Change (i.e. the  median MT ic50 binding score and fold change of all chosen prediction methods)."
         )
+
+    def add_threads_and_prediction_cache_arguments(self, parser):
         parser.add_argument(
-            "-r", "--iedb-retries",type=int,
-            default=5,
-            help="Number of retries when making requests to the IEDB RESTful web interface. Must be less than or equal to 100.",
+            "-t", "--n-threads",type=int,
+            default=1,
+            help="Number of threads to use for parallelizing peptide-MHC binding prediction calls.",
         )
         parser.add_argument(
-            "-k", "--keep-tmp-files",
-            action='store_true',
-            help="Keep intermediate output files. This might be useful for debugging purposes.",
+            "--prediction-cache",
+            help="Path to a prediction cache database that is shared between runs. "
+                 + "Binding predictions for epitopes that were already predicted in a previous run with the same "
+                 + "method, allele, and epitope length will be read from the cache instead of being predicted again. "
+                 + "NetChop and NetMHCstabpan predictions are cached in the same database. "
+                 + "The database will be created if it doesn't exist.",
         )
         parser.add_argument(
-            "-t", "--n-threads",type=int,
-            default=1,
-            help="Number of threads to use for parallelizing peptide-MHC binding prediction calls.",
+            "--prediction-cache-size", type=int,
+            help="Maximum number of epitopes to keep in the prediction cache. "
+                 + "When this size is exceeded the least recently used entries are evicted. "
+                 + "By default the cache size is unlimited.",
         )
-        self.parser = parser
+
+    def add_post_processing_arguments(self, parser):
+        self.add_binding_filter_arguments(parser)
+        self.add_threads_and_prediction_cache_arguments(parser)
 
 class PredictionRunArgumentParser(RunArgumentParser):
     def __init__(self, tool_name, input_file_help):
         RunArgumentParser.__init__(self, tool_name, input_file_help)
+        self.add_post_processing_tool_arguments(self.parser)
+        self.parser.add_argument(
+            '--concurrent-pipelines',
+            action='store_true',
+            help="Run the MHC class I and class II pipelines (and for pVACfuse the pipelines for the individual epitope lengths) in parallel instead of one after the other. "
+                 + "The --n-threads are split between the pipelines. "
+                 + "The --iedb-max-requests limit and the limit of two concurrent MHCflurry and MHCnuggets prediction jobs apply to all pipelines together.",
+        )
+        self.parser.add_argument(
+            '--allow-changed-inputs',
+            action='store_true',
+            help="Allow restarting a run in an existing output directory with different inputs, e.g. additional alleles. "
+                 + "Intermediate files are only recreated if the input files or parameters they were created from changed.",
+        )
+        self.parser.add_argument(
+            '--parquet',
+            action='store_true',
+            help="Also write the all_epitopes report in Parquet format (<sample_name>.all_epitopes.parquet). "
+                 + "Its columns are typed and the alleles, genes, and transcripts are dictionary encoded, which makes it faster to load and smaller than the TSV. "
+                 + "The post-processing steps read this file instead of the TSV. Requires pyarrow.",
+        )
         self.parser.add_argument(
+            '-a', '--additional-report-columns',
+            choices=['sample_name'],
+            help="Additional columns to output in the final report. If sample_name is chosen, this will add a column with the sample name in every row of the output. This can be useful if you later want to concatenate results from multiple individuals into a single file."
+        )
+        self.parser.add_argument(
+            "-s", "--fasta-size",type=int,
+            default=200,
+            help="Number of FASTA entries per IEDB request. "
+                 + "For some resource-intensive prediction algorithms like Pickpocket and NetMHCpan it might be helpful to reduce this number. "
+                 + "Needs to be an even number.",
+        )
+        self.add_exclude_NAs_argument(self.parser)
+
+    def add_post_processing_tool_arguments(self, parser):
+        parser.add_argument(
             '--net-chop-method',
             choices=pvactools.lib.net_chop.methods,
             default=None,
             help="NetChop prediction method to use (\"cterm\" for C term 3.0, \"20s\" for 20S 3.0). C-term 3.0 is trained with publicly available MHC class I ligands and the authors believe that is performs best in predicting the boundaries of CTL epitopes. 20S is trained with in vitro degradation data.",
         )
-        self.parser.add_argument(
+        parser.add_argument(
             '--netmhc-stab',
             action='store_true',
             help="Run NetMHCStabPan after all filtering and add stability predictions to predicted epitopes."
         )
-        self.parser.add_argument(
+        parser.add_argument(
             '--net-chop-threshold', type=float,
             default=0.5,
             help="NetChop prediction threshold (increasing the threshold results in better specificity, but worse sensitivity).",
         )
-        self.parser.add_argument(
+        parser.add_argument(
+            '--net-chop-path',
+            help="NetChop installation path. If provided, NetChop is run locally instead of on the NetChop server.",
+        )
+        parser.add_argument(
+            '--netmhc-stab-path',
+            help="NetMHCstabpan installation path. If provided, NetMHCstabpan is run locally instead of on the NetMHCstabpan server.",
+        )
+        parser.add_argument(
             '--run-reference-proteome-similarity',
             action='store_true',
             help="Blast peptides against the reference proteome."
         )
-        self.parser.add_argument(
+        parser.add_argument(
             '--blastp-path',
             help="Blastp installation path.",
         )
-        self.parser.add_argument(
+        parser.add_argument(
             '--blastp-db',
             choices=['refseq_select_prot', 'refseq_protein'],
             default='refseq_select_prot',
             help="The blastp database to use.",
         )
-        self.parser.add_argument(
-            '-a', '--additional-report-columns',
-            choices=['sample_name'],
-            help="Additional columns to output in the final report. If sample_name is chosen, this will add a column with the sample name in every row of the output. This can be useful if you later want to concatenate results from multiple individuals into a single file."
-        )
-        self.parser.add_argument(
-            "-s", "--fasta-size",type=int,
-            default=200,
-            help="Number of FASTA entries per IEDB request. "
-                 + "For some resource-intensive prediction algorithms like Pickpocket and NetMHCpan it might be helpful to reduce this number. "
-                 + "Needs to be an even number.",
+        parser.add_argument(
+            '--reference-index',
+            help="Reference proteome index directory built with `pvactools build_reference_proteome_index`. "
+                 + "If provided, reference proteome similarity is calculated with this index instead of BLAST.",
         )
-        self.parser.add_argument(
+
+    def add_exclude_NAs_argument(self, parser):
+        parser.add_argument(
             '--exclude-NAs',
             help="Exclude NA values from the filtered output.",
             default=False,
             action='store_true'
         )
 
+    def add_post_processing_arguments(self, parser):
+        RunArgumentParser.add_post_processing_arguments(self, parser)
+        self.add_post_processing_tool_arguments(parser)
+        self.add_exclude_NAs_argument(parser)
+
 class PvacbindRunArgumentParser(PredictionRunArgumentParser):
     def __init__(self):
         tool_name = "pvacbind"
@@ -191,6 +279,15 @@ class PvacseqRunArgumentParser(PredictionRunWithFastaGenerationArgumentParser):
             help="A VCF with phased proximal variant information. Must be gzipped and tabix indexed."
         )
         self.parser.add_argument(
+            '--pass-only',
+            help="Only process VCF entries with a PASS status.",
+            default=False,
+            action='store_true'
+        )
+        self.add_variant_filter_arguments(self.parser)
+
+    def add_variant_filter_arguments(self, parser):
+        parser.add_argument(
             "-c", "--minimum-fold-change", type=float,
             default=0.0,
             help="Minimum fold change between mutant (MT) binding score and wild-type (WT) score (fold change = WT/MT). "
@@ -198,60 +295,58 @@ class PvacseqRunArgumentParser(PredictionRunWithFastaGenerationArgumentParser):
                  + "(requiring that binding is better to the MT than WT peptide). "
                  + "This fold change is sometimes referred to as a differential agretopicity index.",
         )
-        self.parser.add_argument(
+        parser.add_argument(
             '--normal-cov', type=int,
             help="Normal Coverage Cutoff. Only sites above this read depth cutoff will be considered.",
             default=5
         )
-        self.parser.add_argument(
+        parser.add_argument(
             '--tdna-cov', type=int,
             help="Tumor DNA Coverage Cutoff. Only sites above this read depth cutoff will be considered.",
             default=10
         )
-        self.parser.add_argument(
+        parser.add_argument(
             '--trna-cov', type=int,
             help="Tumor RNA Coverage Cutoff. Only sites above this read depth cutoff will be considered.",
             default=10
         )
-        self.parser.add_argument(
+        parser.add_argument(
             '--normal-vaf', type=float_range(0.0,1.0),
             help="Normal VAF Cutoff in decimal format. Only sites BELOW this cutoff in normal will be considered.",
             default=0.02
         )
-        self.parser.add_argument(
+        parser.add_argument(
             '--tdna-vaf', type=float_range(0.0,1.0),
             help="Tumor DNA VAF Cutoff in decimal format. Only sites above this cutoff will be considered.",
             default=0.25
         )
-        self.parser.add_argument(
+        parser.add_argument(
             '--trna-vaf', type=float_range(0.0,1.0),
             help="Tumor RNA VAF Cutoff in decimal format. Only sites above this cutoff will be considered.",
             default=0.25
         )
-        self.parser.add_argument(
+        parser.add_argument(
             '--expn-val', type=float,
             default=1.0,
             help="Gene and Transcript Expression cutoff. Only sites above this cutoff will be considered.",
         )
-        self.parser.add_argument(
+        parser.add_argument(
             "--maximum-transcript-support-level", type=int,
             help="The threshold to use for filtering epitopes on the Ensembl transcript support level (TSL). "
             +"Keep all epitopes with a transcript support level <= to this cutoff.",
             default=1,
             choices=[1,2,3,4,5]
         )
-        self.parser.add_argument(
-            '--pass-only',
-            help="Only process VCF entries with a PASS status.",
-            default=False,
-            action='store_true'
-        )
-        self.parser.add_argument(
+        parser.add_argument(
             "--tumor-purity",
             help="Value between 0 and 1 indicating the fraction of tumor cells in the tumor sample. Information is used during aggregate report creation for a simple estimation of whether variants are subclonal or clonal based on VAF. If not provided, purity is estimated directly from the VAFs.",
             type=float,
         )
 
+    def add_post_processing_arguments(self, parser):
+        PredictionRunWithFastaGenerationArgumentParser.add_post_processing_arguments(self, parser)
+        self.add_variant_filter_arguments(parser)
+
 
 class PvacfuseRunArgumentParser(PredictionRunWithFastaGenerationArgumentParser):
     def __init__(self):
@@ -282,3 +377,79 @@ class PvacvectorRunArgumentParser(RunArgumentParser):
             help="Number of amino acids to permit clipping from the start and/or end of peptides in order to test novel junction epitopes when the first pass on the full peptide fails.",
             default=3,
         )
+
+class PostProcessArgumentParser(metaclass=ABCMeta):
+    #options of the run command that only affect the post-processing of the all_epitopes report
+    post_processing_options = [
+        'binding_threshold', 'percentile_threshold', 'allele_specific_binding_thresholds', 'top_score_metric',
+        'minimum_fold_change', 'normal_cov', 'tdna_cov', 'trna_cov', 'normal_vaf', 'tdna_vaf', 'trna_vaf', 'expn_val',
+        'maximum_transcript_support_level', 'tumor_purity', 'exclude_NAs',
+        'net_chop_method', 'net_chop_threshold', 'net_chop_path', 'netmhc_stab', 'netmhc_stab_path',
+        'run_reference_proteome_similarity', 'blastp_path', 'blastp_db', 'reference_index',
+        'n_threads', 'prediction_cache', 'prediction_cache_size',
+    ]
+
+    def __init__(self, tool_name, run_argument_parser):
+        parser = argparse.ArgumentParser(
+            "%s postprocess" % tool_name,
+            description="Regenerate the filtered and aggregated reports from an existing all_epitopes report of a {} run, e.g. with different filter thresholds.".format(tool_name.replace('vac', 'VAC')),
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter
+        )
+        parser.add_argument(
+            "input_file",
+            help="An all_epitopes.tsv report file of a previous {} run.".format(tool_name),
+        )
+        parser.add_argument(
+            "output_dir",
+            help="The directory for writing the filtered and aggregated reports."
+        )
+        parser.add_argument(
+            "--run-config",
+            help="The log/inputs.yml file of the run that created the input file. "
+                 + "The parameters of that run are used unless they are set on the command line."
+        )
+        parser.add_argument(
+            "--sample-name",
+            help="The name of the sample, used as a prefix for the output files. "
+                 + "By default the sample name of the run config or the input file name is used."
+        )
+        parser.add_argument(
+            "--species",
+            default='human',
+            help="The species of the sample. Only used for the reference proteome similarity.",
+        )
+        parser.add_argument(
+            "--fasta",
+            help="The FASTA file used for the reference proteome similarity. "
+                 + "By default the <sample_name>.fasta file next to the input file is used.",
+        )
+        parser.add_argument(
+            "--net-chop-fasta",
+            help="The FASTA file used for NetChop. "
+                 + "By default the <sample_name>.net_chop.fa file next to the input file is used.",
+        )
+        run_argument_parser.add_post_processing_arguments(parser)
+        self.parser = parser
+
+    def parse_args(self, args_input):
+        args = self.parser.parse_args(args_input)
+        run_config = {}
+        if args.run_config is not None:
+            with open(args.run_config, 'r') as run_config_fh:
+                run_config = yaml.load(run_config_fh, Loader=yaml.FullLoader)
+            config_options = self.post_processing_options + ['sample_name', 'species', 'net_chop_fasta']
+            self.parser.set_defaults(**{k: v for (k, v) in run_config.items() if k in config_options})
+            args = self.parser.parse_args(args_input)
+        return (args, run_config)
+
+class PvacseqPostProcessArgumentParser(PostProcessArgumentParser):
+    def __init__(self):
+        PostProcessArgumentParser.__init__(self, 'pvacseq', PvacseqRunArgumentParser())
+
+class PvacbindPostProcessArgumentParser(PostProcessArgumentParser):
+    def __init__(self):
+        PostProcessArgumentParser.__init__(self, 'pvacbind', PvacbindRunArgumentParser())
+
+class PvacfusePostProcessArgumentParser(PostProcessArgumentParser):
+    def __init__(self):
+        PostProcessArgumentParser.__init__(self, 'pvacfuse', PvacfuseRunArgumentParser())
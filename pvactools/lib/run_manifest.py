@@ -0,0 +1,89 @@
+import os
+import json
+import hashlib
+from threading import Lock
+
+#Records the input files, parameters and content hashes every output of a run
+#was created from. A restarted run only skips an output if it still exists
+#unchanged and was created from the same inputs with the same parameters.
+#File hashes are cached by size and modification time so that unchanged
+#files don't need to be reread on every restart. Output directories of runs
+#that predate the manifest don't have one yet so their existing outputs are
+#reused as before and recorded.
+
+class RunManifest:
+    def __init__(self, manifest_file):
+        self.manifest_file = manifest_file
+        self.directory = os.path.dirname(os.path.abspath(manifest_file))
+        self.lock = Lock()
+        self.legacy = not os.path.exists(manifest_file)
+        if not self.legacy:
+            with open(manifest_file, 'r') as manifest_fh:
+                manifest = json.load(manifest_fh)
+        else:
+            manifest = {}
+        self.outputs = manifest.get('outputs', {})
+        self.hashes = manifest.get('hashes', {})
+        if self.legacy:
+            self.save()
+
+    #The lock isn't picklable. Pipelines that run in their own process get
+    #a copy of the manifest with a new lock.
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = Lock()
+
+    def key(self, path):
+        return os.path.relpath(os.path.abspath(path), self.directory)
+
+    def file_hash(self, path):
+        if path is None or not os.path.exists(path):
+            return None
+        key = self.key(path)
+        stat = os.stat(path)
+        cached = self.hashes.get(key)
+        if cached is not None and cached['size'] == stat.st_size and cached['mtime'] == stat.st_mtime_ns:
+            return cached['sha256']
+        sha256 = hashlib.sha256()
+        with open(path, 'rb') as fh:
+            for block in iter(lambda: fh.read(1 << 20), b''):
+                sha256.update(block)
+        self.hashes[key] = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'sha256': sha256.hexdigest()}
+        return sha256.hexdigest()
+
+    def entry(self, outputs, inputs, parameters):
+        return {
+            'outputs': {self.key(path): self.file_hash(path) for path in outputs},
+            'inputs': {self.key(path): self.file_hash(path) for path in inputs if path is not None},
+            #Round trip the parameters so that they compare equal to the stored ones
+            'parameters': json.loads(json.dumps(parameters or {}, sort_keys=True)),
+        }
+
+    def is_current(self, outputs, inputs, parameters=None):
+        with self.lock:
+            if not all(os.path.exists(path) for path in outputs):
+                return False
+            entry = self.entry(outputs, inputs, parameters)
+            recorded = self.outputs.get(self.key(outputs[0]))
+            if recorded is None:
+                if self.legacy:
+                    self.outputs[self.key(outputs[0])] = entry
+                    self.save()
+                return self.legacy
+            return recorded == entry
+
+    def record(self, outputs, inputs, parameters=None):
+        with self.lock:
+            self.outputs[self.key(outputs[0])] = self.entry(outputs, inputs, parameters)
+            self.save()
+
+    def save(self):
+        tmp_file = "{}.tmp".format(self.manifest_file)
+        with open(tmp_file, 'w') as manifest_fh:
+            json.dump({'outputs': self.outputs, 'hashes': self.hashes}, manifest_fh, indent=1, sort_keys=True)
+        os.replace(tmp_file, self.manifest_file)
@@ -2,11 +2,24 @@ import sys
 import os
 import csv
 import binascii
+import threading
 from itertools import islice, product
+import pandas as pd
 
 from pvactools.lib.prediction_class import *
 import argparse
 
+#NetChop and NetMHCstabpan jobs submitted to the DTU Health Tech web server
+#from all threads and pipelines share this limit of jobs in flight
+DTU_SERVER_MAX_IN_FLIGHT = 4
+dtu_server_slots = threading.BoundedSemaphore(DTU_SERVER_MAX_IN_FLIGHT)
+
+def set_dtu_server_slots(slots):
+    #Pipelines that run concurrently run in their own processes and are handed
+    #one multiprocessing semaphore for the whole run when they are started
+    global dtu_server_slots
+    dtu_server_slots = slots
+
 def split_algorithms(prediction_algorithms):
     if 'all' in prediction_algorithms:
         return (sorted(MHCI.prediction_methods()), sorted(MHCII.prediction_methods()))
@@ -67,7 +80,7 @@ def combine_class_ii_alleles(class_ii_alleles):
 
     return list(set(class_ii_alleles + valid_combinations))
 
-def combine_reports(input_files, output_file):
+def combine_reports(input_files, output_file, parquet=False):
     fieldnames = []
     for input_file in input_files:
         with open(input_file, 'r') as input_file_handle:
@@ -87,6 +100,148 @@ def combine_reports(input_files, output_file):
                 reader = csv.DictReader(input_file_handle, delimiter='\t')
                 for row in reader:
                     writer.writerow(row)
+    if parquet:
+        write_parquet_report(read_report(output_file), parquet_report_path(output_file))
+
+def read_report(input_file, chunk_size=None):
+    #All values are kept as the strings they were written as so that
+    #reports can be filtered in memory and written back out unchanged.
+    #With a chunk_size an iterator over DataFrames of that many rows is returned.
+    if is_parquet_file(input_file):
+        return read_parquet_report(input_file, chunk_size)
+    return pd.read_csv(input_file, delimiter='\t', dtype=str, keep_default_na=False, na_filter=False, chunksize=chunk_size)
+
+def read_report_headers(input_file):
+    if is_parquet_file(input_file):
+        return import_pyarrow().parquet.read_schema(input_file).names
+    return pd.read_csv(input_file, delimiter='\t', nrows=0).columns.tolist()
+
+def read_report_table(input_file, usecols=None, dtype=None, **kwargs):
+    #Reads a report with missing values as NaN and numeric columns as numbers.
+    #The keyword arguments are passed on to pandas.read_csv for TSV reports.
+    if is_parquet_file(input_file):
+        return read_parquet_report_table(input_file, usecols, dtype)
+    return pd.read_csv(input_file, delimiter='\t', usecols=usecols, dtype=dtype, **kwargs)
+
+#Parquet reports store the columns of the TSV reports with their types: columns whose
+#values other than NA are all integers or floats are stored as numbers with NA as missing
+#values and the alleles, genes, transcripts, and other columns with few distinct values
+#are dictionary encoded. All other columns are stored as the strings of the TSV report.
+DICTIONARY_ENCODED_COLUMNS = [
+    'Chromosome', 'Transcript', 'Transcript Support Level', 'Ensembl Gene ID', 'Variant Type',
+    'Gene Name', 'HLA Allele',
+]
+
+def parquet_report_path(report_file):
+    return "{}.parquet".format(os.path.splitext(report_file)[0])
+
+def is_parquet_file(filepath):
+    with open(filepath, 'rb') as test_f:
+        return test_f.read(4) == b'PAR1'
+
+def import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise Exception("Parquet reports require the pyarrow package. Please install it with `pip install pyarrow`.")
+    return pyarrow
+
+def typed_report_column(values):
+    present = values[values != 'NA']
+    if len(present) == 0:
+        return pd.Series(float('nan'), index=values.index, dtype='float64')
+    numbers = report_numbers(present)
+    #only convert columns that are written back out as exactly the same strings
+    if numbers is not None and numbers.notna().all() and (numbers.astype(str) == present).all():
+        dtype = 'Int64' if pd.api.types.is_integer_dtype(numbers) else 'float64'
+        return numbers.astype(dtype).reindex(values.index)
+    if values.name in DICTIONARY_ENCODED_COLUMNS:
+        return values.astype('category')
+    return values
+
+def report_numbers(values):
+    #astype parses the strings with int() and float(), which unlike
+    #pandas.to_numeric round every float correctly
+    for dtype in ['int64', 'float64']:
+        try:
+            return values.astype(dtype)
+        except (ValueError, TypeError, OverflowError):
+            pass
+    return None
+
+def report_strings(values):
+    #the reverse of typed_report_column
+    if pd.api.types.is_numeric_dtype(values):
+        return values.astype(object).where(values.notna(), 'NA').astype(str)
+    return values.astype(str)
+
+def write_parquet_report(df, output_file):
+    import_pyarrow()
+    typed_df = pd.DataFrame({column: typed_report_column(df[column]) for column in df.columns}, index=df.index)
+    typed_df.to_parquet(output_file, engine='pyarrow', index=False)
+
+def read_parquet_report(input_file, chunk_size=None):
+    pyarrow = import_pyarrow()
+    if chunk_size is None:
+        return parquet_report_strings(pd.read_parquet(input_file, engine='pyarrow'))
+    batches = pyarrow.parquet.ParquetFile(input_file).iter_batches(batch_size=chunk_size)
+    return (parquet_report_strings(batch.to_pandas()) for batch in batches)
+
+def parquet_report_strings(df):
+    return pd.DataFrame({column: report_strings(df[column]) for column in df.columns}, index=df.index)
+
+def read_parquet_report_table(input_file, usecols=None, dtype=None):
+    #Returns the same columns as reading the TSV report with NA values
+    #as missing values would, e.g. integer columns with NA values as floats
+    import_pyarrow()
+    df = pd.read_parquet(input_file, engine='pyarrow', columns=None if usecols is None else list(usecols))
+    if dtype is None:
+        dtype = {}
+    for column in df.columns:
+        values = df[column]
+        if column in dtype and dtype[column] in [str, 'str', 'category']:
+            values = report_strings(values)
+        elif isinstance(values.dtype, pd.CategoricalDtype):
+            values = values.astype(object)
+        elif isinstance(values.dtype, pd.Int64Dtype):
+            values = values.astype('float64' if values.hasnans else 'int64')
+        if not pd.api.types.is_numeric_dtype(values):
+            values = values.where(values != 'NA')
+            if column not in dtype:
+                #like pandas.read_csv, columns whose values are all numbers are read as floats
+                numbers = report_numbers(values.dropna())
+                if numbers is not None:
+                    values = values.astype('float64')
+        if column in dtype and dtype[column] not in [str, 'str']:
+            values = values.astype(dtype[column])
+        df[column] = values
+    return df
+
+def write_report(df, output_file, lineterminator='\n'):
+    with open(output_file, 'w', newline='') as output_fh:
+        write_report_rows(df, output_fh, lineterminator=lineterminator)
+
+def write_report_rows(df, output_fh, header=True, lineterminator='\n'):
+    writer = csv.writer(output_fh, delimiter='\t', lineterminator=lineterminator)
+    if header:
+        writer.writerow(df.columns)
+    writer.writerows(df.itertuples(index=False, name=None))
+
+def filter_report(input_file, output_file, filter_function, chunk_size=None, lineterminator='\n'):
+    if chunk_size is None:
+        write_report(filter_function(read_report(input_file)), output_file, lineterminator=lineterminator)
+        return
+    with open(output_file, 'w', newline='') as output_fh:
+        for (i, df) in enumerate(read_report(input_file, chunk_size)):
+            write_report_rows(filter_function(df), output_fh, header=(i == 0), lineterminator=lineterminator)
+
+def split_n_threads(n_threads, count):
+    #Splits the threads between pipelines running at the same time. Every pipeline gets at least one.
+    shares = [n_threads // count] * count
+    for i in range(n_threads % count):
+        shares[i] += 1
+    return [max(1, share) for share in shares]
 
 def change_permissions_recursive(path, dir_mode, file_mode):
     for root, dirs, files in os.walk(path, topdown=False):
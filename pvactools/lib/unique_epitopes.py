@@ -0,0 +1,79 @@
+import os
+import pandas as pd
+from io import StringIO
+from collections import OrderedDict
+from Bio import SeqIO
+
+#Helpers for predicting each unique epitope only once and fanning the
+#prediction rows back out to every (seq_num, start) position of a FASTA file
+
+def determine_epitopes(input_file, epitope_length):
+    epitopes = []
+    for record in SeqIO.parse(input_file, "fasta"):
+        sequence = str(record.seq)
+        for i in range(0, len(sequence)-epitope_length+1):
+            epitopes.append((record.id, i+1, sequence[i:i+epitope_length]))
+    return epitopes
+
+def epitope_positions(input_file, epitope_length):
+    return pd.DataFrame(determine_epitopes(input_file, epitope_length), columns=['seq_num', 'start', 'peptide'])
+
+def merge_predictions_with_positions(positions, predictions):
+    #One row per (seq_num, start) position in the order of the positions table.
+    #Inner merges don't preserve the left order on all pandas versions.
+    df = positions.merge(predictions, on='peptide', how='left', sort=False, indicator=True)
+    return df[df['_merge'] == 'both'].drop(columns='_merge').reset_index(drop=True)
+
+def unique_peptides(epitopes):
+    return list(OrderedDict.fromkeys(epitope for (seq_num, start, epitope) in epitopes))
+
+def write_peptide_fasta(peptides, output_file):
+    with open(output_file, 'w') as output_fh:
+        for (index, peptide) in enumerate(peptides, 1):
+            output_fh.write(">{}\n{}\n".format(index, peptide))
+
+def prediction_rows(response_text, output_mode):
+    if output_mode == 'pandas':
+        df = response_text.fillna('').astype(str)
+    else:
+        if output_mode == 'wb':
+            response_text = response_text.decode()
+        if response_text is None or response_text.strip() == '':
+            return ([], {})
+        df = pd.read_csv(StringIO(response_text), sep="\t", dtype=str, keep_default_na=False)
+    rows = {}
+    for row in df.to_dict('records'):
+        rows.setdefault(row['peptide'], []).append(row)
+    return (list(df.columns), rows)
+
+def read_prediction_rows(prediction_file):
+    with open(prediction_file, 'r') as prediction_fh:
+        return prediction_rows(prediction_fh.read(), 'w')
+
+def fan_out_predictions(epitopes, results, epitope_length, columns=None):
+    output_rows = []
+    for (seq_num, start, epitope) in epitopes:
+        for prediction_row in results.get(epitope, []):
+            row = OrderedDict(prediction_row)
+            if 'seq_num' in row:
+                row['seq_num'] = seq_num
+            if 'start' in row:
+                row['start'] = str(start)
+            if 'end' in row:
+                row['end'] = str(start + epitope_length - 1)
+            output_rows.append(row)
+
+    if columns is None:
+        columns = []
+    else:
+        columns = list(columns)
+    for row in output_rows:
+        for column in row.keys():
+            if column not in columns:
+                columns.append(column)
+    return pd.DataFrame(output_rows, columns=columns)
+
+def write_predictions(df, output_file):
+    tmp_output_file = output_file + '.tmp'
+    df.to_csv(tmp_output_file, index=False, sep="\t")
+    os.replace(tmp_output_file, output_file)
@@ -1,5 +1,6 @@
 __all__ = [
     'download_cwls',
+    'build_reference_proteome_index',
 ]
 
 from . import *
@@ -0,0 +1,35 @@
+import argparse
+import sys
+
+from pvactools.lib.reference_proteome_index import ReferenceProteomeIndex
+
+def define_parser():
+    parser = argparse.ArgumentParser(
+        "pvactools build_reference_proteome_index",
+        description="Build an exact k-mer index of a reference proteome FASTA for offline reference proteome similarity searches",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument('reference_fasta', help='Reference proteome FASTA file, e.g. the RefSeq Select proteins of the species')
+    parser.add_argument('output_directory', help='Directory to write the index to')
+    parser.add_argument(
+        '--match-length',
+        default=8,
+        type=int,
+        help="The matching epitope length the index will be used with. Needs to match the --match-length used for the reference proteome similarity calculation.",
+    )
+    parser.add_argument(
+        '--species',
+        default='human',
+        help="The species of the reference proteome. Needs to match the species used for the reference proteome similarity calculation.",
+    )
+    return parser
+
+def main(args_input = sys.argv[1:]):
+    parser = define_parser()
+    args = parser.parse_args(args_input)
+
+    index = ReferenceProteomeIndex.build(args.reference_fasta, args.output_directory, args.match_length, args.species)
+    print("Indexed {} k-mers of {} proteins in {}".format(len(index.kmers), len(index.protein_ids), args.output_directory))
+
+if __name__ == '__main__':
+    main()
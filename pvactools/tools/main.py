@@ -15,6 +15,13 @@ def define_parser():
     )
     download_cwls_parser.set_defaults(func=download_cwls)
 
+    build_reference_proteome_index_parser = subparsers.add_parser(
+        "build_reference_proteome_index",
+        help="Build a k-mer index of a reference proteome FASTA for offline reference proteome similarity searches",
+        add_help=False
+    )
+    build_reference_proteome_index_parser.set_defaults(func=build_reference_proteome_index)
+
     parser.add_argument(
         "-v", "--version",
         action="store_true",
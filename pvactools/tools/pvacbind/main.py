@@ -17,6 +17,13 @@ def main():
     )
     run_main_program_parser.set_defaults(func=run)
 
+    postprocess_parser = subparsers.add_parser(
+        "postprocess",
+        help="Regenerate the filtered and aggregated reports from an existing pVACbind all_epitopes.tsv report, e.g. with different filter thresholds.",
+        add_help=False
+    )
+    postprocess_parser.set_defaults(func=postprocess)
+
     binding_filter_parser = subparsers.add_parser(
         "binding_filter",
         help="Filter variants processed by IEDB by binding score",
@@ -0,0 +1,20 @@
+import sys
+
+from pvactools.lib.run_argument_parser import PvacbindPostProcessArgumentParser
+from pvactools.lib.post_processor import postprocess_existing_report
+
+def define_parser():
+    return PvacbindPostProcessArgumentParser().parser
+
+def main(args_input = sys.argv[1:]):
+    (args, run_config) = PvacbindPostProcessArgumentParser().parse_args(args_input)
+    #the FASTA file the pVACbind run was started on is used for NetChop and the reference proteome similarity
+    if args.fasta is None and "input_file" in run_config:
+        args.fasta = run_config["input_file"]
+    if args.net_chop_fasta is None:
+        args.net_chop_fasta = args.fasta
+
+    postprocess_existing_report(args, 'pVACbind')
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 __all__ = [
     'run',
+    'postprocess',
     'binding_filter',
     'valid_alleles',
     'allele_specific_cutoffs',
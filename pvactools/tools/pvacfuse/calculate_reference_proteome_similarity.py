@@ -18,7 +18,8 @@ def main(args_input = sys.argv[1:]):
         'pVACfuse',
         args.blastp_path,
         args.blastp_db,
-        args.n_threads
+        args.n_threads,
+        args.reference_index,
     ).execute()
 
 if __name__ == "__main__":
@@ -9,7 +9,7 @@ def main(args_input = sys.argv[1:]):
     parser = define_parser()
     args = parser.parse_args(args_input)
 
-    NetChop(args.input_file, args.input_fasta, args.output_file, args.method, args.threshold, 'pVACfuse').execute()
+    NetChop(args.input_file, args.input_fasta, args.output_file, args.method, args.threshold, 'pVACfuse', args.n_threads, args.net_chop_path, args.prediction_cache, args.prediction_cache_size).execute()
 
 if __name__ == "__main__":
     main()
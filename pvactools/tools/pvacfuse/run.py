@@ -4,7 +4,7 @@ import os
 import shutil
 
 from pvactools.lib.prediction_class import *
-from pvactools.lib.pipeline import PvacbindPipeline
+from pvactools.lib.pipeline import PvacbindPipeline, execute_pipelines
 from pvactools.lib.run_argument_parser import PvacfuseRunArgumentParser
 from pvactools.lib.post_processor import PostProcessor
 import pvactools.tools.pvacfuse.generate_protein_fasta
@@ -19,7 +19,7 @@ def create_net_class_report(files, all_epitopes_output_file, filtered_report_fil
             print("File {} doesn't exist. Aborting.".format(file_name))
             return
 
-    pvactools.lib.run_utils.combine_reports(files, all_epitopes_output_file)
+    pvactools.lib.run_utils.combine_reports(files, all_epitopes_output_file, args.parquet)
 
     post_processing_params = vars(args).copy()
     post_processing_params['input_file'] = all_epitopes_output_file
@@ -46,7 +46,7 @@ def create_combined_reports(files, all_epitopes_output_file, filtered_report_fil
             print("File {} doesn't exist. Aborting.".format(file_name))
             return
 
-    pvactools.lib.run_utils.combine_reports(files, all_epitopes_output_file)
+    pvactools.lib.run_utils.combine_reports(files, all_epitopes_output_file, args.parquet)
 
     post_processing_params = vars(args).copy()
     post_processing_params['input_file'] = all_epitopes_output_file
@@ -115,6 +115,12 @@ def main(args_input = sys.argv[1:]):
     if args.iedb_retries > 100:
         sys.exit("The number of IEDB retries must be less than or equal to 100")
 
+    if args.iedb_max_requests is not None and args.iedb_max_requests < 1:
+        sys.exit("The maximum number of IEDB requests must be at least 1")
+
+    if args.iedb_allele_batch_size < 1:
+        sys.exit("The IEDB allele batch size must be at least 1")
+
     if args.downstream_sequence_length == 'full':
         downstream_sequence_length = None
     elif args.downstream_sequence_length.isdigit():
@@ -138,9 +144,16 @@ def main(args_input = sys.argv[1:]):
         'allele_specific_binding_thresholds': args.allele_specific_binding_thresholds,
         'net_chop_method'           : args.net_chop_method,
         'net_chop_threshold'        : args.net_chop_threshold,
+        'net_chop_path'             : args.net_chop_path,
+        'netmhc_stab_path'          : args.netmhc_stab_path,
         'additional_report_columns' : args.additional_report_columns,
         'fasta_size'                : args.fasta_size,
         'iedb_retries'              : args.iedb_retries,
+        'iedb_max_requests'         : args.iedb_max_requests,
+        'iedb_allele_batch_size'    : args.iedb_allele_batch_size,
+        'prediction_cache'          : args.prediction_cache,
+        'prediction_cache_size'     : args.prediction_cache_size,
+        'deduplicate_epitopes'      : args.deduplicate_epitopes,
         'downstream_sequence_length': downstream_sequence_length,
         'keep_tmp_files'            : args.keep_tmp_files,
         'n_threads'                 : args.n_threads,
@@ -148,6 +161,9 @@ def main(args_input = sys.argv[1:]):
         'run_reference_proteome_similarity': args.run_reference_proteome_similarity,
         'blastp_path'               : args.blastp_path,
         'blastp_db'                 : args.blastp_db,
+        'reference_index'           : args.reference_index,
+        'allow_changed_inputs'      : args.allow_changed_inputs,
+        'parquet'                   : args.parquet,
         'run_post_processor'        : False,
         'exclude_NAs'               : args.exclude_NAs,
     }
@@ -180,6 +196,10 @@ def main(args_input = sys.argv[1:]):
         }
     }
 
+    #The pipelines of all classes and epitope lengths are set up first so that
+    #they can be run concurrently before the per-class reports are created
+    class_runs = []
+    length_runs = []
     for (mhc_class, params) in all_params.items():
         prediction_algorithms = params['prediction_algorithms']
         alleles = params['alleles']
@@ -193,49 +213,61 @@ def main(args_input = sys.argv[1:]):
             output_dir = os.path.join(base_output_dir, 'MHC_Class_{}'.format(mhc_class))
             os.makedirs(output_dir, exist_ok=True)
 
-            output_files = []
             run_arguments = shared_arguments.copy()
             run_arguments['alleles']               = alleles
             run_arguments['iedb_executable']       = iedb_executable
             run_arguments['prediction_algorithms'] = prediction_algorithms
             run_arguments['netmhc_stab']           = netmhc_stab
 
+            class_length_runs = []
             for epitope_length in epitope_lengths:
                 (input_file, per_epitope_output_dir) = generate_fasta(args, output_dir, epitope_length)
                 if os.path.getsize(input_file) == 0:
                     print("The intermediate FASTA file for epitope length {} is empty. Please check that the input AGfusion directory contains fusion entries with `*_protein.fa` files. Fusion entries without this file cannot be processed by pVACfuse.".format(epitope_length))
                     continue
 
-                run_arguments['input_file']              = input_file
-                run_arguments['epitope_lengths']         = [epitope_length]
-                run_arguments['output_dir']              = per_epitope_output_dir
-                pipeline = PvacbindPipeline(**run_arguments)
-                pipeline.execute()
-                intermediate_output_file = os.path.join(per_epitope_output_dir, "{}.all_epitopes.tsv".format(args.sample_name))
-                output_file = os.path.join(per_epitope_output_dir, "{}.all_epitopes.final.tsv".format(args.sample_name))
-                append_columns(intermediate_output_file, "{}.tsv".format(input_file), output_file)
-                output_files.append(output_file)
-                if epitope_length == max(epitope_lengths):
-                    # copy fasta to output dir
-                    fasta_file = os.path.join(output_dir, "{}.fasta".format(args.sample_name))
-                    shutil.copy(input_file, fasta_file)
-                    run_arguments['fasta'] = fasta_file
-                    # generate and copy net_chop fasta to output dir if specified
-                    if args.net_chop_method:
-                        epitope_flank_length = 9
-                        (net_chop_fasta, _) = generate_fasta(args, output_dir, epitope_length, epitope_flank_length, net_chop_fasta=True)
-                        run_arguments['net_chop_fasta'] = net_chop_fasta
-            if len(output_files) > 0:
-                all_epitopes_file = os.path.join(output_dir, "{}.all_epitopes.tsv".format(args.sample_name))
-                filtered_file = os.path.join(output_dir, "{}.filtered.tsv".format(args.sample_name))
-                #!!! make below call to create_net_class_report
-                #create_combined_reports(output_files, all_epitopes_file, filtered_file, True, args)
-                create_net_class_report(output_files, all_epitopes_file, filtered_file, args, run_arguments)
+                length_arguments = run_arguments.copy()
+                length_arguments['input_file']              = input_file
+                length_arguments['epitope_lengths']         = [epitope_length]
+                length_arguments['output_dir']              = per_epitope_output_dir
+                class_length_runs.append((epitope_length, input_file, per_epitope_output_dir, length_arguments))
+            length_runs.extend(class_length_runs)
+            class_runs.append((output_dir, epitope_lengths, run_arguments, class_length_runs))
         elif len(prediction_algorithms) == 0:
             print("No MHC class {} prediction algorithms chosen. Skipping MHC class I predictions.".format(mhc_class))
         elif len(alleles) == 0:
             print("No MHC class{} alleles chosen. Skipping MHC class I predictions.".format(mhc_class))
 
+    if args.concurrent_pipelines and len(length_runs) > 1:
+        n_threads = pvactools.lib.run_utils.split_n_threads(args.n_threads, len(length_runs))
+        for ((_, _, _, length_arguments), length_n_threads) in zip(length_runs, n_threads):
+            length_arguments['n_threads'] = length_n_threads
+    execute_pipelines([PvacbindPipeline(**length_arguments) for (_, _, _, length_arguments) in length_runs], args.concurrent_pipelines)
+
+    for (output_dir, epitope_lengths, run_arguments, class_length_runs) in class_runs:
+        output_files = []
+        for (epitope_length, input_file, per_epitope_output_dir, length_arguments) in class_length_runs:
+            intermediate_output_file = os.path.join(per_epitope_output_dir, "{}.all_epitopes.tsv".format(args.sample_name))
+            output_file = os.path.join(per_epitope_output_dir, "{}.all_epitopes.final.tsv".format(args.sample_name))
+            append_columns(intermediate_output_file, "{}.tsv".format(input_file), output_file)
+            output_files.append(output_file)
+            if epitope_length == max(epitope_lengths):
+                # copy fasta to output dir
+                fasta_file = os.path.join(output_dir, "{}.fasta".format(args.sample_name))
+                shutil.copy(input_file, fasta_file)
+                run_arguments['fasta'] = fasta_file
+                # generate and copy net_chop fasta to output dir if specified
+                if args.net_chop_method:
+                    epitope_flank_length = 9
+                    (net_chop_fasta, _) = generate_fasta(args, output_dir, epitope_length, epitope_flank_length, net_chop_fasta=True)
+                    run_arguments['net_chop_fasta'] = net_chop_fasta
+        if len(output_files) > 0:
+            all_epitopes_file = os.path.join(output_dir, "{}.all_epitopes.tsv".format(args.sample_name))
+            filtered_file = os.path.join(output_dir, "{}.filtered.tsv".format(args.sample_name))
+            #!!! make below call to create_net_class_report
+            #create_combined_reports(output_files, all_epitopes_file, filtered_file, True, args)
+            create_net_class_report(output_files, all_epitopes_file, filtered_file, args, run_arguments)
+
     if len(class_i_prediction_algorithms) > 0 and len(class_i_alleles) > 0 and len(class_ii_prediction_algorithms) > 0 and len(class_ii_alleles) > 0:
         print("Creating combined reports")
         output_dir = os.path.join(base_output_dir, 'combined')
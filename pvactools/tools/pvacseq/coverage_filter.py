@@ -62,6 +62,10 @@ def define_parser():
         default=False,
         action='store_true'
     )
+    parser.add_argument(
+        '--chunk-size', type=int,
+        help="Filter the input file in chunks of this many rows instead of loading it into memory at once.",
+    )
     return parser
 
 def main(args_input = sys.argv[1:]):
@@ -87,7 +91,7 @@ def main(args_input = sys.argv[1:]):
     filter_criteria.append({'column': "Gene Expression", 'operator': '>=', 'threshold': args.expn_val, 'exclude_nas': args.exclude_NAs})
     filter_criteria.append({'column': "Transcript Expression", 'operator': '>=', 'threshold': args.expn_val, 'exclude_nas': args.exclude_NAs})
 
-    Filter(args.input_file, args.output_file, filter_criteria).execute()
+    Filter(args.input_file, args.output_file, filter_criteria, chunk_size=args.chunk_size).execute()
 
 if __name__ == "__main__":
     main()
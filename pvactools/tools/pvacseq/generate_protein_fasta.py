@@ -3,7 +3,6 @@ import argparse
 import tempfile
 import os
 import shutil
-import yaml
 import csv
 from collections import OrderedDict
 from Bio import SeqIO
@@ -12,6 +11,7 @@ from Bio.SeqRecord import SeqRecord
 from Bio.Alphabet import IUPAC
 
 from pvactools.lib.fasta_generator import FastaGenerator
+from pvactools.lib.key_file import read_key_file
 from pvactools.lib.input_file_converter import VcfConverter
 from pvactools.lib.calculate_manufacturability import CalculateManufacturability
 
@@ -124,8 +124,7 @@ def parse_files(output_file, temp_dir, mutant_only, input_tsv):
     fasta_file_path = os.path.join(temp_dir, 'tmp.fasta')
     fasta_key_file_path = os.path.join(temp_dir, 'tmp.fasta.key')
 
-    with open(fasta_key_file_path, 'r') as fasta_key_file:
-        keys = yaml.load(fasta_key_file, Loader=yaml.FullLoader)
+    keys = read_key_file(fasta_key_file_path)
 
     tsv_indexes = parse_input_tsv(input_tsv)
 
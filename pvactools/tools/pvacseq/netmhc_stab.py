@@ -9,7 +9,7 @@ def main(args_input = sys.argv[1:]):
     parser = define_parser()
     args = parser.parse_args(args_input)
 
-    NetMHCStab(args.input_file, args.output_file, file_type='pVACseq', top_score_metric=args.top_score_metric).execute()
+    NetMHCStab(args.input_file, args.output_file, file_type='pVACseq', top_score_metric=args.top_score_metric, n_threads=args.n_threads, netmhc_stab_path=args.netmhc_stab_path, prediction_cache=args.prediction_cache, prediction_cache_size=args.prediction_cache_size).execute()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,15 @@
+import sys
+
+from pvactools.lib.run_argument_parser import PvacseqPostProcessArgumentParser
+from pvactools.lib.post_processor import postprocess_existing_report
+
+def define_parser():
+    return PvacseqPostProcessArgumentParser().parser
+
+def main(args_input = sys.argv[1:]):
+    (args, run_config) = PvacseqPostProcessArgumentParser().parse_args(args_input)
+
+    postprocess_existing_report(args, 'pVACseq')
+
+if __name__ == "__main__":
+    main()
@@ -5,7 +5,7 @@ import shutil
 import yaml
 
 from pvactools.lib.prediction_class import *
-from pvactools.lib.pipeline import Pipeline
+from pvactools.lib.pipeline import Pipeline, execute_pipelines
 from pvactools.lib.run_argument_parser import PvacseqRunArgumentParser
 from pvactools.lib.post_processor import PostProcessor
 import pvactools.lib.run_utils
@@ -27,7 +27,7 @@ def create_combined_reports(base_output_dir, args):
         return
 
     combined_output_file = os.path.join(output_dir, "{}.all_epitopes.tsv".format(args.sample_name))
-    pvactools.lib.run_utils.combine_reports([file1, file2], combined_output_file)
+    pvactools.lib.run_utils.combine_reports([file1, file2], combined_output_file, args.parquet)
     filtered_report_file = os.path.join(output_dir, "{}.filtered.tsv".format(args.sample_name))
 
     post_processing_params = vars(args)
@@ -53,6 +53,12 @@ def main(args_input = sys.argv[1:]):
     if args.iedb_retries > 100:
         sys.exit("The number of IEDB retries must be less than or equal to 100")
 
+    if args.iedb_max_requests is not None and args.iedb_max_requests < 1:
+        sys.exit("The maximum number of IEDB requests must be at least 1")
+
+    if args.iedb_allele_batch_size < 1:
+        sys.exit("The IEDB allele batch size must be at least 1")
+
     if args.downstream_sequence_length == 'full':
         downstream_sequence_length = None
     elif args.downstream_sequence_length.isdigit():
@@ -84,6 +90,8 @@ def main(args_input = sys.argv[1:]):
         'minimum_fold_change'       : args.minimum_fold_change,
         'net_chop_method'           : args.net_chop_method,
         'net_chop_threshold'        : args.net_chop_threshold,
+        'net_chop_path'             : args.net_chop_path,
+        'netmhc_stab_path'          : args.netmhc_stab_path,
         'normal_cov'                : args.normal_cov,
         'normal_vaf'                : args.normal_vaf,
         'tdna_cov'                  : args.tdna_cov,
@@ -94,6 +102,11 @@ def main(args_input = sys.argv[1:]):
         'additional_report_columns' : args.additional_report_columns,
         'fasta_size'                : args.fasta_size,
         'iedb_retries'              : args.iedb_retries,
+        'iedb_max_requests'         : args.iedb_max_requests,
+        'iedb_allele_batch_size'    : args.iedb_allele_batch_size,
+        'prediction_cache'          : args.prediction_cache,
+        'prediction_cache_size'     : args.prediction_cache_size,
+        'deduplicate_epitopes'      : args.deduplicate_epitopes,
         'downstream_sequence_length': downstream_sequence_length,
         'keep_tmp_files'            : args.keep_tmp_files,
         'pass_only'                 : args.pass_only,
@@ -105,11 +118,22 @@ def main(args_input = sys.argv[1:]):
         'run_reference_proteome_similarity': args.run_reference_proteome_similarity,
         'blastp_path'               : args.blastp_path,
         'blastp_db'                 : args.blastp_db,
+        'reference_index'           : args.reference_index,
+        'allow_changed_inputs'      : args.allow_changed_inputs,
+        'parquet'                   : args.parquet,
         'tumor_purity'              : args.tumor_purity,
         'exclude_NAs'               : args.exclude_NAs,
     }
 
-    if len(class_i_prediction_algorithms) > 0 and len(class_i_alleles) > 0:
+    run_class_i = len(class_i_prediction_algorithms) > 0 and len(class_i_alleles) > 0
+    run_class_ii = len(class_ii_prediction_algorithms) > 0 and len(class_ii_alleles) > 0
+    if args.concurrent_pipelines and run_class_i and run_class_ii:
+        (class_i_n_threads, class_ii_n_threads) = pvactools.lib.run_utils.split_n_threads(args.n_threads, 2)
+    else:
+        (class_i_n_threads, class_ii_n_threads) = (args.n_threads, args.n_threads)
+
+    pipelines = []
+    if run_class_i:
         if args.iedb_install_directory:
             iedb_mhc_i_executable = os.path.join(args.iedb_install_directory, 'mhc_i', 'src', 'predict_binding.py')
             if not os.path.exists(iedb_mhc_i_executable):
@@ -129,14 +153,18 @@ def main(args_input = sys.argv[1:]):
         class_i_arguments['prediction_algorithms']   = class_i_prediction_algorithms
         class_i_arguments['output_dir']              = output_dir
         class_i_arguments['netmhc_stab']             = args.netmhc_stab
+        class_i_arguments['n_threads']               = class_i_n_threads
         pipeline = Pipeline(**class_i_arguments)
-        pipeline.execute()
+        if args.concurrent_pipelines:
+            pipelines.append(pipeline)
+        else:
+            pipeline.execute()
     elif len(class_i_prediction_algorithms) == 0:
         print("No MHC class I prediction algorithms chosen. Skipping MHC class I predictions.")
     elif len(class_i_alleles) == 0:
         print("No MHC class I alleles chosen. Skipping MHC class I predictions.")
 
-    if len(class_ii_prediction_algorithms) > 0 and len(class_ii_alleles) > 0:
+    if run_class_ii:
         if args.iedb_install_directory:
             iedb_mhc_ii_executable = os.path.join(args.iedb_install_directory, 'mhc_ii', 'mhc_II_binding.py')
             if not os.path.exists(iedb_mhc_ii_executable):
@@ -156,14 +184,27 @@ def main(args_input = sys.argv[1:]):
         class_ii_arguments['epitope_lengths']         = args.class_ii_epitope_length
         class_ii_arguments['output_dir']              = output_dir
         class_ii_arguments['netmhc_stab']             = False
+        class_ii_arguments['n_threads']               = class_ii_n_threads
         pipeline = Pipeline(**class_ii_arguments)
-        pipeline.execute()
+        if args.concurrent_pipelines:
+            pipelines.append(pipeline)
+        else:
+            pipeline.execute()
     elif len(class_ii_prediction_algorithms) == 0:
         print("No MHC class II prediction algorithms chosen. Skipping MHC class II predictions.")
     elif len(class_ii_alleles) == 0:
         print("No MHC class II alleles chosen. Skipping MHC class II predictions.")
 
-    if len(class_i_prediction_algorithms) > 0 and len(class_i_alleles) > 0 and len(class_ii_prediction_algorithms) > 0 and len(class_ii_alleles) > 0:
+    if len(pipelines) > 1:
+        #Both classes use the same converted VCF so it only needs to be created once
+        for pipeline in pipelines:
+            pipeline.print_log()
+        pipelines[0].convert_vcf()
+        for pipeline in pipelines[1:]:
+            pipeline.convert_vcf(pipelines[0])
+    execute_pipelines(pipelines, args.concurrent_pipelines)
+
+    if run_class_i and run_class_ii:
         print("Creating combined reports")
         create_combined_reports(base_output_dir, args)
 
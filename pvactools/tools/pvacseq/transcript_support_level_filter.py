@@ -30,6 +30,10 @@ def define_parser():
         default=False,
         action='store_true'
     )
+    parser.add_argument(
+        '--chunk-size', type=int,
+        help="Filter the input file in chunks of this many rows instead of loading it into memory at once.",
+    )
     return parser
 
 def main(args_input = sys.argv[1:]):
@@ -41,7 +45,7 @@ def main(args_input = sys.argv[1:]):
         args.input_file,
         args.output_file,
         filter_criteria,
-        ['Transcript Support Level'],
+        chunk_size=args.chunk_size,
     ).execute()
 
 if __name__ == "__main__":
@@ -35,6 +35,11 @@ def run_pipelines(input_file, base_output_dir, args, spacer, class_i_prediction_
         'spacers'         : [spacer],
         'downstream_sequence_length': 200,
         'iedb_retries'    : args.iedb_retries,
+        'iedb_max_requests': args.iedb_max_requests,
+        'iedb_allele_batch_size': args.iedb_allele_batch_size,
+        'prediction_cache': args.prediction_cache,
+        'prediction_cache_size': args.prediction_cache_size,
+        'deduplicate_epitopes': args.deduplicate_epitopes,
         'additional_report_columns' : None,
     }
 
@@ -421,6 +426,12 @@ def main(args_input=sys.argv[1:]):
     if args.iedb_retries > 100:
         sys.exit("The number of IEDB retries must be less than or equal to 100")
 
+    if args.iedb_max_requests is not None and args.iedb_max_requests < 1:
+        sys.exit("The maximum number of IEDB requests must be at least 1")
+
+    if args.iedb_allele_batch_size < 1:
+        sys.exit("The IEDB allele batch size must be at least 1")
+
     if (os.path.splitext(args.input_file))[1] == '.fa':
         input_file = args.input_file
         generate_input_fasta = False
@@ -0,0 +1,102 @@
+import os
+import time
+import threading
+import socketserver
+from urllib.parse import parse_qs
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from tests.utils import pvactools_directory
+
+#Local stand-in for the IEDB RESTful web interface that can be used to test
+#and benchmark the IEDB client without network access. Responses are based on
+#the recorded responses used by the API status tests.
+response_files = {
+    '/tools_api/mhci/': os.path.join(pvactools_directory(), 'api_status_tests', 'iedb_class_i_response.tsv'),
+    '/tools_api/mhcii/': os.path.join(pvactools_directory(), 'api_status_tests', 'iedb_class_ii_response.tsv'),
+}
+
+#http.server.ThreadingHTTPServer is only available in Python 3.7 and later
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+class MockIEDBServer:
+    def __init__(self, latency=0, failures=0, retry_after=None):
+        self.latency = latency
+        self.failures = failures
+        self.retry_after = retry_after
+        self.request_count = 0
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self.handler_class())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:{}".format(self.server.server_address[1])
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def response(self, path, data):
+        with open(response_files[path], 'r') as response_fh:
+            lines = response_fh.read().splitlines()
+        response_lines = [lines[0]]
+        for allele in data['allele'][0].split(','):
+            for line in lines[1:]:
+                response_lines.append("\t".join([allele] + line.split("\t")[1:]))
+        return "\n".join(response_lines) + "\n"
+
+    def handler_class(self):
+        server = self
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                data = parse_qs(self.rfile.read(length).decode())
+                with server.lock:
+                    server.request_count += 1
+                    server.requests.append(data)
+                    request_number = server.request_count
+                    server.in_flight += 1
+                    server.max_in_flight = max(server.max_in_flight, server.in_flight)
+                try:
+                    time.sleep(server.latency)
+                    if request_number <= server.failures:
+                        status = 429
+                        body = "Too many requests"
+                    elif self.path not in response_files:
+                        status = 404
+                        body = "Not found"
+                    else:
+                        status = 200
+                        body = server.response(self.path, data)
+                finally:
+                    with server.lock:
+                        server.in_flight -= 1
+                body = body.encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'text/plain')
+                self.send_header('Content-Length', str(len(body)))
+                if status == 429 and server.retry_after is not None:
+                    self.send_header('Retry-After', str(server.retry_after))
+                self.end_headers()
+                self.wfile.write(body)
+        return Handler
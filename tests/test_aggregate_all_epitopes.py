@@ -4,8 +4,10 @@ import tempfile
 from filecmp import cmp
 import sys
 import py_compile
+import time
 
 from pvactools.lib.aggregate_all_epitopes import PvacseqAggregateAllEpitopes, UnmatchedSequenceAggregateAllEpitopes
+from pvactools.lib.run_utils import read_report, write_parquet_report
 from tests.utils import *
 
 class AggregateAllEptiopesTests(unittest.TestCase):
@@ -16,6 +18,81 @@ class AggregateAllEptiopesTests(unittest.TestCase):
         cls.executable    = os.path.join(pvactools_directory(), "pvactools", "lib", "aggregate_all_epitopes.py")
         cls.test_data_dir = os.path.join(pvactools_directory(), "tests", "test_data", "aggregate_all_epitopes")
 
+    def synthetic_all_epitopes_file(self, row_count):
+        headers = [
+            "Chromosome", "Start", "Stop", "Reference", "Variant", "Transcript", "Variant Type", "Mutation",
+            "Protein Position", "Gene Name", "HLA Allele", "Mutation Position", "MT Epitope Seq", "WT Epitope Seq",
+            "Tumor DNA VAF", "Tumor RNA Depth", "Tumor RNA VAF", "Gene Expression", "Transcript Expression",
+            "Median MT Score", "Median WT Score", "Median MT Percentile", "Median WT Percentile",
+            "NetMHC WT Score", "NetMHC MT Score", "NetMHC WT Percentile", "NetMHC MT Percentile",
+        ]
+        alleles = ["HLA-A*02:01", "HLA-B*07:02"]
+        peptides = ["AAAAAAAAA", "CCCCCCCCC", "DDDDDDDDD", "EEEEEEEEE", "FFFFFFFFF"]
+        input_file = tempfile.NamedTemporaryFile(mode='w', suffix='.tsv', delete=False)
+        input_file.write("\t".join(headers) + "\n")
+        #every variant gets 2 transcripts x 5 peptides x 2 alleles = 20 rows
+        for row in range(row_count):
+            variant = row // 20
+            transcript = "ENST{:011d}".format(variant * 2 + row % 2)
+            peptide = peptides[(row // 2) % 5]
+            allele = alleles[(row // 10) % 2]
+            score = 100 + (row * 37) % 2000
+            input_file.write("\t".join(str(value) for value in [
+                "1", variant * 10 + 1, variant * 10 + 2, "A", "T", transcript, "missense", "A/T",
+                "100", "GENE{}".format(variant), allele, "5", peptide, "AAAAGAAAA",
+                0.4, 60, 0.3, 20, 10,
+                score, 5000, 1.5, 50,
+                5000, score, 50, 1.5,
+            ]) + "\n")
+        input_file.close()
+        return input_file.name
+
+    def test_aggregate_all_epitopes_matches_pipeline_aggregated_reports(self):
+        #The aggregated reports of the pipeline test data were produced by the per-variant aggregation
+        for (report_directory, aggregate_class) in [
+            (os.path.join('pvacseq', 'MHC_Class_I'), PvacseqAggregateAllEpitopes),
+            (os.path.join('pvacseq', 'MHC_Class_II'), PvacseqAggregateAllEpitopes),
+            (os.path.join('pvacseq', 'phased', 'MHC_Class_I'), PvacseqAggregateAllEpitopes),
+            (os.path.join('pvacbind', 'MHC_Class_I'), UnmatchedSequenceAggregateAllEpitopes),
+            (os.path.join('pvacbind', 'MHC_Class_II'), UnmatchedSequenceAggregateAllEpitopes),
+            (os.path.join('pvacbind', 'combine_and_condense', 'combined'), UnmatchedSequenceAggregateAllEpitopes),
+            (os.path.join('pvacfuse', 'combined'), UnmatchedSequenceAggregateAllEpitopes),
+            (os.path.join('pvacfuse', 'fusions', 'MHC_Class_I'), UnmatchedSequenceAggregateAllEpitopes),
+        ]:
+            report_directory = os.path.join(pvactools_directory(), "tests", "test_data", report_directory)
+            output_dir = tempfile.TemporaryDirectory()
+            output_file = os.path.join(output_dir.name, 'Test.all_epitopes.aggregated.tsv')
+            self.assertFalse(aggregate_class(os.path.join(report_directory, 'Test.all_epitopes.tsv'), output_file).execute())
+            self.assertTrue(cmp(
+                output_file,
+                os.path.join(report_directory, 'Test.all_epitopes.aggregated.tsv'),
+                shallow=False,
+            ), report_directory)
+            output_dir.cleanup()
+
+    @unittest.skipUnless(os.environ.get('PVACTOOLS_BENCHMARK'), "Set PVACTOOLS_BENCHMARK=1 to run the benchmarks")
+    def test_aggregate_all_epitopes_scales_linearly(self):
+        #set PVACTOOLS_BENCHMARK_AGGREGATE_ROWS=5000000 for a full-size all_epitopes file
+        row_count = int(os.environ.get('PVACTOOLS_BENCHMARK_AGGREGATE_ROWS', 40000))
+        output_dir = tempfile.TemporaryDirectory()
+
+        def aggregate_time(count):
+            input_file = self.synthetic_all_epitopes_file(count)
+            output_file = os.path.join(output_dir.name, "{}.all_epitopes.aggregated.tsv".format(count))
+            start = time.perf_counter()
+            PvacseqAggregateAllEpitopes(input_file, output_file).execute()
+            elapsed = time.perf_counter() - start
+            os.remove(input_file)
+            with open(output_file) as fh:
+                self.assertEqual(len(fh.readlines()), count // 20 + 1)
+            return elapsed
+
+        small_time = aggregate_time(row_count // 10)
+        large_time = aggregate_time(row_count)
+        #Filtering the whole table for every variant would take ~100 times longer for ten times the rows
+        self.assertLess(large_time, small_time * 30)
+        output_dir.cleanup()
+
     def module_compiles(self):
         self.assertTrue(py_compile.compile(self.executable))
 
@@ -45,6 +122,22 @@ class AggregateAllEptiopesTests(unittest.TestCase):
             self.assertTrue(os.path.isfile(pvacview_file))
             os.remove(pvacview_file)
 
+    def test_aggregate_all_epitopes_pvacseq_parquet_input_produces_expected_output(self):
+        output_dir = tempfile.TemporaryDirectory()
+        input_file = os.path.join(output_dir.name, 'Test.all_epitopes.parquet')
+        write_parquet_report(read_report(os.path.join(self.test_data_dir, 'Test.all_epitopes.tsv')), input_file)
+        output_file = os.path.join(output_dir.name, 'Test.all_epitopes.aggregated.tsv')
+        self.assertFalse(PvacseqAggregateAllEpitopes(input_file, output_file).execute())
+        self.assertTrue(cmp(
+            output_file,
+            os.path.join(self.test_data_dir, "output.tsv"),
+        ))
+        self.assertTrue(cmp(
+            output_file.replace('.tsv', '.metrics.json'),
+            os.path.join(self.test_data_dir, "output.metrics.json"),
+        ))
+        output_dir.cleanup()
+
     def test_aggregate_all_epitopes_pvacfuse_runs_and_produces_expected_output(self):
         self.assertTrue(py_compile.compile(self.executable))
         output_file = tempfile.NamedTemporaryFile(suffix='.tsv')
@@ -58,3 +58,24 @@ class BindingFilterTests(unittest.TestCase):
             os.path.join(self.test_data_path, "Test.filtered.binding.percentile.tsv"),
             False
         ))
+
+    def test_binding_filter_in_chunks_produces_expected_output(self):
+        output_file = tempfile.NamedTemporaryFile()
+        self.assertFalse(AlleleSpecificBindingFilter(
+            os.path.join(
+                self.test_data_path,
+                'Test.combined.parsed.tsv'
+            ),
+            output_file.name,
+            10000,
+            0,
+            'median',
+            False,
+            1,
+            chunk_size=2,
+        ).execute())
+        self.assertTrue(cmp(
+            output_file.name,
+            os.path.join(self.test_data_path, "Test.filtered.binding.percentile.tsv"),
+            False
+        ))
@@ -8,6 +8,7 @@ import py_compile
 from Bio.Blast import NCBIWWW
 
 from pvactools.lib.calculate_reference_proteome_similarity import CalculateReferenceProteomeSimilarity
+from pvactools.lib.reference_proteome_index import ReferenceProteomeIndex
 from tests.utils import *
 
 class CalculateReferenceProteomeSimilarityTests(unittest.TestCase):
@@ -39,6 +40,65 @@ class CalculateReferenceProteomeSimilarityTests(unittest.TestCase):
             os.remove(metric_file)
             close_mock_fhs()
 
+    def test_calculate_self_similarity_with_local_blastp(self):
+        blastp_queries.clear()
+        with unittest.mock.patch('pvactools.lib.calculate_reference_proteome_similarity.run', side_effect=mock_blastp_run):
+            input_file = os.path.join(self.test_data_dir, 'input.tsv')
+            input_fasta = os.path.join(self.test_data_dir, 'input.fasta')
+            output_file = tempfile.NamedTemporaryFile()
+            metric_file = "{}.reference_matches".format(output_file.name)
+            self.assertFalse(CalculateReferenceProteomeSimilarity(input_file, input_fasta, output_file.name, blastp_path='blastp', n_threads=2).execute())
+            #All 6 unique peptides are submitted in one blastp call per thread
+            self.assertEqual(len(blastp_queries), 2)
+            self.assertTrue(cmp(
+                output_file.name,
+                os.path.join(self.test_data_dir, "output.tsv"),
+            ))
+            self.assertTrue(cmp(
+                metric_file,
+                os.path.join(self.test_data_dir, "output.tsv.reference_matches"),
+            ))
+            os.remove(metric_file)
+
+    def test_calculate_self_similarity_with_reference_index(self):
+        index_dir = tempfile.TemporaryDirectory()
+        ReferenceProteomeIndex.build(os.path.join(pvactools_directory(), "tests", "test_data", "reference_proteome_index", "reference.fasta"), index_dir.name)
+        input_file = os.path.join(self.test_data_dir, 'input.tsv')
+        input_fasta = os.path.join(self.test_data_dir, 'input.fasta')
+        output_file = tempfile.NamedTemporaryFile()
+        metric_file = "{}.reference_matches".format(output_file.name)
+        with unittest.mock.patch('Bio.Blast.NCBIWWW.qblast') as qblast:
+            self.assertFalse(CalculateReferenceProteomeSimilarity(input_file, input_fasta, output_file.name, reference_index=index_dir.name).execute())
+            qblast.assert_not_called()
+        self.assertTrue(cmp(
+            output_file.name,
+            os.path.join(self.test_data_dir, "output.tsv"),
+        ))
+        self.assertTrue(cmp(
+            metric_file,
+            os.path.join(pvactools_directory(), "tests", "test_data", "reference_proteome_index", "output.tsv.reference_matches"),
+        ))
+        os.remove(metric_file)
+        index_dir.cleanup()
+
+    def test_reference_index_match_length_mismatch(self):
+        index_dir = tempfile.TemporaryDirectory()
+        ReferenceProteomeIndex.build(os.path.join(pvactools_directory(), "tests", "test_data", "reference_proteome_index", "reference.fasta"), index_dir.name, match_length=9)
+        output_file = tempfile.NamedTemporaryFile()
+        with self.assertRaises(Exception) as context:
+            CalculateReferenceProteomeSimilarity(os.path.join(self.test_data_dir, 'input.tsv'), os.path.join(self.test_data_dir, 'input.fasta'), output_file.name, reference_index=index_dir.name).execute()
+        self.assertIn("was built for a match length of 9", str(context.exception))
+        index_dir.cleanup()
+
+    def test_reference_index_species_mismatch(self):
+        index_dir = tempfile.TemporaryDirectory()
+        ReferenceProteomeIndex.build(os.path.join(pvactools_directory(), "tests", "test_data", "reference_proteome_index", "reference.fasta"), index_dir.name, species='mouse')
+        output_file = tempfile.NamedTemporaryFile()
+        with self.assertRaises(Exception) as context:
+            CalculateReferenceProteomeSimilarity(os.path.join(self.test_data_dir, 'input.tsv'), os.path.join(self.test_data_dir, 'input.fasta'), output_file.name, species='human', reference_index=index_dir.name).execute()
+        self.assertIn("was built for species mouse but species human was requested", str(context.exception))
+        index_dir.cleanup()
+
     def test_blastp_db_incompatible_with_species(self):
         with self.assertRaises(Exception) as context:
             input_file = os.path.join(self.test_data_dir, 'input.tsv')
@@ -61,7 +61,7 @@ class CallIEDBClassITests(CallIEDBTests):
             data,
             files,
             test_data_directory()
-        ))) as mock_request:
+        ))) as mock_request, patch('requests.Session.post', mock_request):
             #netmhcpan, netmhccons, and pickpocket are slow so we won't run them in the tests
             for method in self.methods:
                 call_iedb_output_file = tempfile.NamedTemporaryFile()
@@ -131,7 +131,7 @@ class CallIEDBClassIITests(CallIEDBTests):
             data,
             files,
             test_data_directory()
-        ))) as mock_request:
+        ))) as mock_request, patch('requests.Session.post', mock_request):
             for method in self.methods:
                 call_iedb_output_file = tempfile.NamedTemporaryFile()
                 class_name = PredictionClass.prediction_class_name_for_iedb_prediction_method(method)
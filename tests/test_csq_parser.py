@@ -0,0 +1,38 @@
+import unittest
+
+from pvactools.lib.csq_parser import CsqParser
+
+class CsqParserTests(unittest.TestCase):
+    def setUp(self):
+        self.csq_parser = CsqParser("Consequence annotations from Ensembl VEP. Format: Allele|Consequence|Feature|Protein_position|TSL")
+        self.csq_entries = [
+            'T|missense_variant|ENST00000001|5/100|1',
+            'G|synonymous_variant|ENST00000002|7/100',
+            'T|stop_gained|ENST00000003|9/100|',
+        ]
+
+    def test_parse_csq_entries_for_allele(self):
+        transcripts = self.csq_parser.parse_csq_entries_for_allele(self.csq_entries, 'T')
+        self.assertEqual(transcripts, [
+            {'Allele': 'T', 'Consequence': 'missense_variant', 'Feature': 'ENST00000001', 'Protein_position': '5/100', 'TSL': '1'},
+            {'Allele': 'T', 'Consequence': 'stop_gained', 'Feature': 'ENST00000003', 'Protein_position': '9/100', 'TSL': ''},
+        ])
+        self.assertEqual(self.csq_parser.parse_csq_entries_for_allele(self.csq_entries, 'A'), [])
+
+    def test_missing_trailing_fields_are_missing_keys(self):
+        (transcript,) = self.csq_parser.parse_csq_entries_for_allele(self.csq_entries, 'G')
+        self.assertEqual(transcript['Feature'], 'ENST00000002')
+        self.assertFalse('TSL' in transcript)
+        self.assertFalse('HGVSc' in transcript)
+        with self.assertRaises(KeyError):
+            transcript['TSL']
+
+    def test_decoded_entries_are_cached(self):
+        transcripts = self.csq_parser.parse_csq_entries_for_allele(self.csq_entries, 'T')
+        cached_transcripts = self.csq_parser.parse_csq_entries_for_allele(list(self.csq_entries), 'T')
+        self.assertIs(transcripts[0], cached_transcripts[0])
+        self.assertEqual(self.csq_parser.decode_csq_entries.cache_info().hits, 1)
+
+    def test_parsers_are_shared_per_header(self):
+        description = "Consequence annotations from Ensembl VEP. Format: Allele|Feature"
+        self.assertIs(CsqParser.for_header(description), CsqParser.for_header(description))
@@ -41,6 +41,28 @@ class FastaGeneratorTests(unittest.TestCase):
         expected_key_output_file = os.path.join(self.test_data_dir, 'output_peptide_sequence_length_17.key')
         self.assertTrue(cmp(generate_fasta_key_output_file.name, expected_key_output_file))
 
+    def test_execute_for_lengths_generates_expected_files(self):
+        generate_fasta_input_file = os.path.join(self.test_data_dir, 'input.tsv')
+        output_files = {peptide_sequence_length: (tempfile.NamedTemporaryFile(), tempfile.NamedTemporaryFile()) for peptide_sequence_length in (17, 21)}
+
+        FastaGenerator.execute_for_lengths(
+            {
+                'input_file'                : generate_fasta_input_file,
+                'downstream_sequence_length': None,
+            },
+            [{
+                'epitope_length'          : self.epitope_length,
+                'flanking_sequence_length': (peptide_sequence_length - 1) // 2,
+                'output_file'             : output_file.name,
+                'output_key_file'         : key_output_file.name,
+            } for (peptide_sequence_length, (output_file, key_output_file)) in output_files.items()]
+        )
+        for (peptide_sequence_length, (output_file, key_output_file)) in output_files.items():
+            expected_output_file = os.path.join(self.test_data_dir, 'output_peptide_sequence_length_{}.fasta'.format(peptide_sequence_length))
+            self.assertTrue(cmp(output_file.name, expected_output_file))
+            expected_key_output_file = os.path.join(self.test_data_dir, 'output_peptide_sequence_length_{}.key'.format(peptide_sequence_length))
+            self.assertTrue(cmp(key_output_file.name, expected_key_output_file))
+
     def test_input_file_with_peptide_sequence_length_21_generates_expected_file(self):
         generate_fasta_input_file      = os.path.join(self.test_data_dir, 'input.tsv')
         generate_fasta_output_file     = tempfile.NamedTemporaryFile()
@@ -3,6 +3,7 @@ import os
 import tempfile
 from filecmp import cmp
 import py_compile
+import pandas as pd
 
 from pvactools.lib.filter import Filter
 from tests.utils import *
@@ -183,3 +184,31 @@ class FilterTests(unittest.TestCase):
             os.path.join(self.test_data_path, "output.inf.tsv"),
             False
         ))
+
+    def test_exclude_NA_in_chunks(self):
+        output_file = tempfile.NamedTemporaryFile()
+        self.assertFalse(Filter(
+            os.path.join(
+                self.test_data_path,
+                'Test.combined.parsed.tsv'
+            ),
+            output_file.name,
+            [{
+                'column': "Tumor RNA Depth",
+                'operator': ">",
+                'threshold': "100",
+                'exclude_nas': True
+            }],
+            chunk_size=3,
+        ).execute())
+        self.assertTrue(cmp(
+            output_file.name,
+            os.path.join(self.test_data_path, "Test.filtered.exclude_NA.tsv"),
+            False
+        ))
+
+    def test_non_numeric_values_raise(self):
+        df = pd.DataFrame({'Tumor RNA Depth': ['10', 'NA', 'inf', 'ten']})
+        with self.assertRaises(Exception) as context:
+            Filter(None, None, [{'column': "Tumor RNA Depth", 'operator': ">", 'threshold': 5, 'exclude_nas': False}]).filter_df(df)
+        self.assertIn("non-numeric values in column Tumor RNA Depth", str(context.exception))
@@ -0,0 +1,130 @@
+import unittest
+import unittest.mock
+import os
+import tempfile
+import datetime
+import email.utils
+import py_compile
+from threading import Thread
+from mock import patch
+
+import pvactools.lib.call_iedb
+from pvactools.lib import iedb_client
+from pvactools.lib.prediction_class import NetMHC, IEDBMHCI
+
+from tests.utils import *
+from tests.mock_iedb_server import MockIEDBServer
+
+def response_object(headers):
+    response = lambda :None
+    response.headers = headers
+    return response
+
+class IEDBClientTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.input_file = os.path.join(pvactools_directory(), 'tests', 'test_data', 'call_iedb', 'input.fasta')
+        cls.expected_response_file = os.path.join(pvactools_directory(), 'api_status_tests', 'iedb_class_i_response.tsv')
+
+    def tearDown(self):
+        iedb_client.set_request_limit(None)
+
+    def mock_url(self, server):
+        return patch.object(IEDBMHCI, 'url', new_callable=unittest.mock.PropertyMock, return_value=server.url + '/tools_api/mhci/')
+
+    def test_source_compiles(self):
+        self.assertTrue(py_compile.compile(os.path.join(pvactools_directory(), 'pvactools', 'lib', 'iedb_client.py')))
+
+    def test_retry_after_header_is_honoured(self):
+        self.assertEqual(iedb_client.retry_delay(1, response_object({'Retry-After': '7'})), 7)
+        retry_date = email.utils.format_datetime(datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=120))
+        self.assertTrue(100 < iedb_client.retry_delay(1, response_object({'Retry-After': retry_date})) <= 120)
+
+    def test_backoff_is_exponential_with_jitter(self):
+        for retries in range(1, 10):
+            delay = min(iedb_client.BACKOFF_MAX_SECONDS, iedb_client.BACKOFF_BASE_SECONDS * 2 ** (retries - 1))
+            for i in range(10):
+                self.assertTrue(delay / 2 <= iedb_client.retry_delay(retries, response_object({})) <= delay)
+
+    def test_predict_returns_response(self):
+        with MockIEDBServer() as server, self.mock_url(server):
+            (response_text, output_mode) = NetMHC().predict(self.input_file, 'HLA-A*02:01', 9, None, 5)
+        with open(self.expected_response_file, 'r') as expected_fh:
+            self.assertEqual(response_text, expected_fh.read())
+        self.assertEqual(output_mode, 'w')
+        self.assertEqual(server.requests[0]['allele'], ['HLA-A*02:01'])
+
+    def test_predict_retries_rate_limited_requests(self):
+        with MockIEDBServer(failures=2, retry_after=0) as server, self.mock_url(server):
+            (response_text, output_mode) = NetMHC().predict(self.input_file, 'HLA-A*02:01', 9, None, 5)
+        self.assertEqual(server.request_count, 3)
+        with open(self.expected_response_file, 'r') as expected_fh:
+            self.assertEqual(response_text, expected_fh.read())
+
+    def test_predict_fails_after_retries(self):
+        with MockIEDBServer(failures=10, retry_after=0) as server, self.mock_url(server):
+            with self.assertRaises(SystemExit) as context:
+                NetMHC().predict(self.input_file, 'HLA-A*02:01', 9, None, 2)
+        self.assertEqual(server.request_count, 3)
+        self.assertIn("Error posting request to IEDB.", str(context.exception))
+
+    def test_request_limit_caps_concurrent_requests(self):
+        iedb_client.set_request_limit(2)
+        with MockIEDBServer(latency=0.2) as server:
+            threads = [Thread(target=iedb_client.post, args=(server.url + '/tools_api/mhci/', {'allele': 'HLA-A*02:01'}, 0)) for i in range(6)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(server.request_count, 6)
+        self.assertLessEqual(server.max_in_flight, 2)
+
+    def test_predict_alleles_submits_a_single_request(self):
+        alleles = ['HLA-A*02:01', 'HLA-A*01:01']
+        with MockIEDBServer() as server, self.mock_url(server):
+            responses = NetMHC().predict_alleles(self.input_file, alleles, 9, 5)
+        self.assertEqual(server.request_count, 1)
+        self.assertEqual(server.requests[0]['allele'], ['HLA-A*02:01,HLA-A*01:01'])
+        self.assertEqual(server.requests[0]['length'], ['9,9'])
+        with open(self.expected_response_file, 'r') as expected_fh:
+            expected_response = expected_fh.read()
+        self.assertEqual(responses['HLA-A*02:01'], expected_response)
+        self.assertEqual(responses['HLA-A*01:01'], expected_response.replace('HLA-A*02:01', 'HLA-A*01:01'))
+
+    def test_call_iedb_batch_alleles(self):
+        output_dir = tempfile.TemporaryDirectory()
+        output_files = [os.path.join(output_dir.name, 'HLA-A*02:01.tsv'), os.path.join(output_dir.name, 'HLA-A*01:01.tsv')]
+        with MockIEDBServer() as server, self.mock_url(server):
+            pvactools.lib.call_iedb.main([
+                self.input_file,
+                output_files[0],
+                'NetMHC',
+                'HLA-A*02:01',
+                '-l', '9',
+                '--batch-allele', 'HLA-A*01:01', output_files[1],
+            ])
+        self.assertEqual(server.request_count, 1)
+        with open(self.expected_response_file, 'r') as expected_fh:
+            expected_response = expected_fh.read()
+        with open(output_files[0], 'r') as output_fh:
+            self.assertEqual(output_fh.read(), expected_response)
+        with open(output_files[1], 'r') as output_fh:
+            self.assertEqual(output_fh.read(), expected_response.replace('HLA-A*02:01', 'HLA-A*01:01'))
+        output_dir.cleanup()
+
+    @unittest.skipUnless(os.environ.get('PVACTOOLS_BENCHMARK'), "Set PVACTOOLS_BENCHMARK=1 to run the benchmarks")
+    def test_pooled_session_throughput(self):
+        #Offline throughput benchmark against the mock server
+        request_count = int(os.environ.get('PVACTOOLS_IEDB_BENCHMARK_REQUESTS', 200))
+        iedb_client.set_request_limit(8)
+        with MockIEDBServer() as server:
+            url = server.url + '/tools_api/mhci/'
+            threads = []
+            for i in range(8):
+                thread = Thread(target=lambda: [iedb_client.post(url, {'allele': 'HLA-A*02:01'}, 0) for j in range(request_count // 8)])
+                threads.append(thread)
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(server.request_count, request_count // 8 * 8)
+        self.assertLessEqual(server.max_in_flight, 8)
@@ -462,6 +462,24 @@ class InputFileConverterTests(unittest.TestCase):
         expected_output_file = os.path.join(self.test_data_dir, 'output_total_length.tsv')
         self.assertTrue(cmp(convert_vcf_output_file.name, expected_output_file))
 
+    def test_sharded_conversion_matches_sequential_conversion(self):
+        convert_vcf_input_file = os.path.join(self.test_data_dir, 'somatic.vcf.gz')
+        sequential_output_file = tempfile.NamedTemporaryFile()
+        sharded_output_file = tempfile.NamedTemporaryFile()
+
+        VcfConverter(**{
+            'input_file' : convert_vcf_input_file,
+            'output_file': sequential_output_file.name,
+        }).execute()
+        converter = VcfConverter(**{
+            'input_file' : convert_vcf_input_file,
+            'output_file': sharded_output_file.name,
+            'n_threads'  : 4,
+        })
+        self.assertEqual(len(converter.shard_contigs()), 4)
+        converter.execute()
+        self.assertTrue(cmp(sharded_output_file.name, sequential_output_file.name, False))
+
     def test_agfusion_input_generates_expected_tsv(self):
         convert_input_file  = os.path.join(self.test_data_dir, 'agfusion')
         convert_output_file = tempfile.NamedTemporaryFile()
@@ -0,0 +1,45 @@
+import unittest
+import os
+import tempfile
+import py_compile
+
+from pvactools.lib.key_file import *
+from tests.utils import *
+
+class KeyFileTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.test_data_dir = os.path.join(pvactools_directory(), 'tests', 'test_data', 'output_parser')
+
+    def test_source_compiles(self):
+        self.assertTrue(py_compile.compile(os.path.join(pvactools_directory(), 'pvactools', 'lib', 'key_file.py')))
+
+    def test_write_and_read_key_file(self):
+        keys = {
+            1: ['WT.1.GENE.ENST00000325455.missense.374Y/S'],
+            2: ['MT.1.GENE.ENST00000325455.missense.374Y/S', 'MT.2.GENE.ENST00000325456.missense.374Y/S'],
+        }
+        output_file = tempfile.NamedTemporaryFile()
+        write_key_file(keys, output_file.name)
+        with open(output_file.name, 'r') as fh:
+            self.assertEqual(fh.readline(), "{}\n".format(HEADER))
+        self.assertEqual(read_key_file(output_file.name), keys)
+
+    def test_read_yaml_key_file(self):
+        self.assertEqual(read_key_file(os.path.join(self.test_data_dir, 'input_mnp.key')), {
+            1: ['WT.PGR_ENST00000325455_1.missense.374-378YPNQP/YSKDA'],
+            2: ['MT.PGR_ENST00000325455_1.missense.374-378YPNQP/YSKDA'],
+        })
+
+    def test_export_to_yaml(self):
+        keys = {
+            1: ['WT.1.GENE.ENST00000325455.missense.374Y/S'],
+            2: ['MT.1.GENE.ENST00000325455.missense.374Y/S', 'MT.2.GENE.ENST00000325456.missense.374Y/S'],
+        }
+        key_file = tempfile.NamedTemporaryFile()
+        write_key_file(keys, key_file.name)
+        yaml_file = tempfile.NamedTemporaryFile()
+        main([key_file.name, yaml_file.name])
+        with open(yaml_file.name, 'r') as fh:
+            self.assertEqual(fh.read(), "1:\n- WT.1.GENE.ENST00000325455.missense.374Y/S\n2:\n- MT.1.GENE.ENST00000325455.missense.374Y/S\n- MT.2.GENE.ENST00000325456.missense.374Y/S\n")
+        self.assertEqual(read_key_file(yaml_file.name), keys)
@@ -154,3 +154,58 @@ class NetChopTest(unittest.TestCase):
                 output_file.name
             ))
             l.check_present(('root', 'WARNING', S("Too many jobs submitted to NetChop server. Waiting to retry.")))
+
+    def test_net_chop_local_runs(self):
+        net_chop_calls = []
+        def mock_net_chop_run(arguments, stdout, check):
+            net_chop_calls.append(arguments)
+            method = 'cterm' if arguments[arguments.index('-v') + 1] == '0' else '20s'
+            with open(os.path.join(self.test_data_directory, 'net_chop.{}.txt'.format(method)), 'r') as response_fh:
+                stdout.write(response_fh.read())
+
+        for method in ['cterm', '20s']:
+            net_chop_calls.clear()
+            with patch('pvactools.lib.net_chop.run', unittest.mock.Mock(side_effect=mock_net_chop_run)), \
+                 patch('requests.sessions.Session.post') as post:
+                output_file = tempfile.NamedTemporaryFile()
+                NetChop(
+                    os.path.join(self.test_data_directory, 'Test_filtered.tsv'),
+                    self.test_fasta,
+                    output_file.name,
+                    method,
+                    n_threads=2,
+                    net_chop_path='netchop',
+                ).execute()
+                self.assertTrue(cmp(
+                    os.path.join(self.test_data_directory, 'output_{}.tsv'.format(method)),
+                    output_file.name
+                ))
+                self.assertFalse(post.called)
+            self.assertEqual(len(net_chop_calls), 1)
+            self.assertEqual(net_chop_calls[0][0:5], ['netchop', '-v', str(['cterm', '20s'].index(method)), '-t', '0.500000'])
+
+    def test_net_chop_prediction_cache(self):
+        cache_dir = tempfile.TemporaryDirectory()
+        prediction_cache = os.path.join(cache_dir.name, 'predictions.sqlite')
+        with patch('requests.sessions.Session.post', unittest.mock.Mock(side_effect = lambda url, data, timeout, files=None: make_response(
+            data,
+            files,
+            self.test_data_directory,
+            'net_chop.cterm.html'
+            ))) as post:
+            for i in range(2):
+                output_file = tempfile.NamedTemporaryFile()
+                NetChop(
+                    os.path.join(self.test_data_directory, 'Test_filtered.tsv'),
+                    self.test_fasta,
+                    output_file.name,
+                    'cterm',
+                    prediction_cache=prediction_cache,
+                ).execute()
+                self.assertTrue(cmp(
+                    os.path.join(self.test_data_directory, 'output_cterm.tsv'),
+                    output_file.name
+                ))
+            #the second run only reads from the cache
+            self.assertEqual(post.call_count, 1)
+        cache_dir.cleanup()
@@ -9,6 +9,8 @@ import sys
 import tempfile
 import py_compile
 from filecmp import cmp
+from subprocess import CalledProcessError
+import pandas as pd
 
 from pvactools.lib.netmhc_stab import NetMHCStab
 from tests.utils import *
@@ -189,3 +191,89 @@ class NetChopTest(unittest.TestCase):
                 file_type='pVACseq'
             ).valid_alleles(['HLA-G*01:09', 'HLA-E*01:01', 'HLA-B*39:90'])
             self.assertEqual(valid_alleles, ['HLA-G*01:09', 'HLA-E*01:01'])
+
+    def test_netmhc_stab_local_runs(self):
+        def mock_netmhc_stab_run(arguments, stdout, check):
+            allele = arguments[arguments.index('-a') + 1]
+            with open(os.path.join(self.test_data_directory, "Netmhcstab.{}.txt".format(allele)), 'r') as response_fh:
+                stdout.write(response_fh.read())
+
+        with patch('pvactools.lib.netmhc_stab.run', unittest.mock.Mock(side_effect=mock_netmhc_stab_run)) as run, \
+             patch('pvactools.lib.netmhc_stab.requests.post') as post, \
+             unittest.mock.patch('pvactools.lib.netmhc_stab.NetMHCStab.valid_alleles', side_effect=default_alleles):
+            output_file = tempfile.NamedTemporaryFile()
+            NetMHCStab(
+                os.path.join(self.test_data_directory, 'Test_filtered.tsv'),
+                output_file.name,
+                file_type='pVACseq',
+                n_threads=2,
+                netmhc_stab_path='netMHCstabpan',
+            ).execute()
+            self.assertTrue(cmp(
+                os.path.join(self.test_data_directory, 'Test_filtered.stab.tsv'),
+                output_file.name
+            ))
+            self.assertFalse(post.called)
+            #one chunk per allele and epitope length
+            self.assertEqual(run.call_count, 2)
+
+    def test_netmhc_stab_reads_input_once(self):
+        read_csv = pd.read_csv
+        with patch('pvactools.lib.netmhc_stab.requests.post',  unittest.mock.Mock(side_effect = lambda url, data, timeout, files=None: make_success_response(
+            data,
+            files,
+            self.test_data_directory
+           ))), unittest.mock.patch('pvactools.lib.netmhc_stab.NetMHCStab.valid_alleles', side_effect=default_alleles), \
+           patch('pvactools.lib.netmhc_stab.pd.read_csv', side_effect=read_csv) as mock_read_csv:
+            output_file = tempfile.NamedTemporaryFile()
+            NetMHCStab(
+                os.path.join(self.test_data_directory, 'Test_filtered.tsv'),
+                output_file.name,
+                file_type='pVACseq'
+            ).execute()
+            self.assertTrue(cmp(
+                os.path.join(self.test_data_directory, 'Test_filtered.stab.tsv'),
+                output_file.name
+            ))
+            self.assertEqual(mock_read_csv.call_count, 1)
+
+    def test_netmhc_stab_prediction_cache(self):
+        cache_dir = tempfile.TemporaryDirectory()
+        prediction_cache = os.path.join(cache_dir.name, 'predictions.sqlite')
+        with patch('pvactools.lib.netmhc_stab.requests.post',  unittest.mock.Mock(side_effect = lambda url, data, timeout, files=None: make_success_response(
+            data,
+            files,
+            self.test_data_directory
+           ))) as post, unittest.mock.patch('pvactools.lib.netmhc_stab.NetMHCStab.valid_alleles', side_effect=default_alleles):
+            for i in range(2):
+                output_file = tempfile.NamedTemporaryFile()
+                NetMHCStab(
+                    os.path.join(self.test_data_directory, 'Test_filtered.tsv'),
+                    output_file.name,
+                    file_type='pVACseq',
+                    prediction_cache=prediction_cache,
+                ).execute()
+                self.assertTrue(cmp(
+                    os.path.join(self.test_data_directory, 'Test_filtered.stab.tsv'),
+                    output_file.name
+                ))
+            #one submission per allele in the first run, none in the second
+            self.assertEqual(post.call_count, 2)
+        cache_dir.cleanup()
+
+    def test_netmhc_stab_local_valid_alleles(self):
+        def mock_netmhc_stab_run(arguments, stdout, check):
+            allele = arguments[arguments.index('-a') + 1]
+            if allele == 'HLA-B39:90':
+                raise CalledProcessError(1, arguments)
+            with open(os.path.join(self.test_data_directory, "Netmhcstab.{}.txt".format(allele)), 'r') as response_fh:
+                stdout.write(response_fh.read())
+
+        with patch('pvactools.lib.netmhc_stab.run', unittest.mock.Mock(side_effect=mock_netmhc_stab_run)):
+            valid_alleles = NetMHCStab(
+                os.path.join(self.test_data_directory, 'Test_filtered.tsv'),
+                tempfile.NamedTemporaryFile().name,
+                file_type='pVACseq',
+                netmhc_stab_path='netMHCstabpan',
+            ).valid_alleles(['HLA-G*01:09', 'HLA-E*01:01', 'HLA-B*39:90'])
+            self.assertEqual(valid_alleles, ['HLA-G*01:09', 'HLA-E*01:01'])
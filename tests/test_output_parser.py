@@ -1,10 +1,14 @@
 import unittest
 import os
 import sys
+import copy
+import time
+import random
 import tempfile
 import py_compile
 
 from pvactools.lib.output_parser import DefaultOutputParser, UnmatchedSequencesOutputParser
+from pvactools.lib.key_file import read_key_file, write_key_file
 from tests.utils import *
 
 class OutputParserTests(unittest.TestCase):
@@ -17,6 +21,110 @@ class OutputParserTests(unittest.TestCase):
     def test_source_compiles(self):
         self.assertTrue(py_compile.compile(self.executable))
 
+    def inframe_indel_results(self, variant_count):
+        #Synthetic chunk of 9-mers for inframe deletions and insertions of three amino acids
+        amino_acids = 'ACDEFGHIKLMNPQRSTVWY'
+        iedb_results = {}
+        wt_iedb_results = {}
+        for variant in range(variant_count):
+            tsv_index = "{}.GENE.ENST{:011d}.inframe".format(variant, variant)
+            wt_sequence = ''.join(random.choice(amino_acids) for i in range(41))
+            if variant % 2:
+                variant_type = 'inframe_del'
+                mt_sequence = wt_sequence[:20] + wt_sequence[23:]
+            else:
+                variant_type = 'inframe_ins'
+                mt_sequence = wt_sequence[:20] + 'WWW' + wt_sequence[20:]
+            wt_iedb_results[tsv_index] = {
+                str(position): {'wt_epitope_seq': wt_sequence[position-1:position+8], 'row': position}
+                for position in range(1, len(wt_sequence) - 7)
+            }
+            for position in range(1, len(mt_sequence) - 7):
+                iedb_results["{}|{}".format(tsv_index, position)] = {
+                    'mt_epitope_seq': mt_sequence[position-1:position+8],
+                    'variant_type'  : variant_type,
+                    'peptide_length': 9,
+                }
+        return (iedb_results, wt_iedb_results)
+
+    def per_key_match_wildtype_and_mutant_entries(self, parser, iedb_results, wt_iedb_results):
+        #Reference copy of the original per-key matching loop
+        for key in sorted(iedb_results.keys(), key = lambda x: int(x.split('|')[-1])):
+            result = iedb_results[key]
+            (wt_iedb_result_key, mt_position) = key.split('|', 1)
+            previous_key = '|'.join([wt_iedb_result_key, str(int(mt_position)-1)])
+            previous_result = iedb_results.get(previous_key)
+            wt_results = wt_iedb_results[wt_iedb_result_key]
+            if result['variant_type'] == 'missense':
+                parser.match_wildtype_and_mutant_entry_for_missense(result, mt_position, wt_results, previous_result)
+            elif result['variant_type'] == 'FS':
+                parser.match_wildtype_and_mutant_entry_for_frameshift(result, mt_position, wt_results, previous_result)
+            elif result['variant_type'] == 'inframe_ins' or result['variant_type'] == 'inframe_del':
+                iedb_results_for_wt_iedb_result_key = [key for key in iedb_results.keys() if key.startswith(wt_iedb_result_key)]
+                parser.match_wildtype_and_mutant_entry_for_inframe_indel(result, mt_position, wt_results, previous_result, len(iedb_results_for_wt_iedb_result_key))
+        return iedb_results
+
+    def test_inframe_indel_matching_matches_per_key_matching(self):
+        test_cases = [
+            ('input_inframe_deletion_aa_deletion.ann.HLA-A*29:02.9.tsv', 'input_inframe_deletion_aa_deletion.tsv', 'input_inframe_deletion_aa_deletion.key'),
+            ('input_inframe_deletion_aa_replacement.ann.HLA-A*29:02.9.tsv', 'input_inframe_deletion_aa_replacement.tsv', 'input_inframe_deletion_aa_replacement.key'),
+            ('input_inframe_insertion_aa_insertion.ann.HLA-A*29:02.9.tsv', 'input_inframe_insertion_aa_insertion.tsv', 'input_inframe_insertion_aa_insertion.key'),
+            ('input_inframe_insertion_aa_replacement.ann.HLA-A*29:02.9.tsv', 'input_inframe_insertion_aa_replacement.tsv', 'input_inframe_insertion_aa_replacement.key'),
+            ('pat27_4.ann.HLA-A*02:01.9.tsv', 'pat27_4.tsv', 'pat27_4_18.fa.key'),
+            ('pat126.ann.HLA-A*01:01.9.tsv', 'pat126.tsv', 'pat126_17.fa.key'),
+        ]
+        for (iedb_file, tsv_file, key_file) in test_cases:
+            #Record the MT and WT epitopes that the parser matches for every variant of the fixture
+            matched_entries = []
+            class RecordingOutputParser(DefaultOutputParser):
+                def match_wildtype_and_mutant_entries(self, iedb_results, wt_iedb_results):
+                    matched_entries.append((copy.deepcopy(iedb_results), copy.deepcopy(wt_iedb_results)))
+                    return super().match_wildtype_and_mutant_entries(iedb_results, wt_iedb_results)
+
+            output_file = tempfile.NamedTemporaryFile()
+            parser = RecordingOutputParser(**{
+                'input_iedb_files': [os.path.join(self.test_data_dir, iedb_file)],
+                'input_tsv_file'  : os.path.join(self.test_data_dir, tsv_file),
+                'key_file'        : os.path.join(self.test_data_dir, key_file),
+                'output_file'     : output_file.name,
+                'sample_name'     : iedb_file.split('.ann.')[0],
+            })
+            self.assertFalse(parser.execute())
+            self.assertTrue(any(
+                result['variant_type'] in ['inframe_ins', 'inframe_del']
+                for (iedb_results, wt_iedb_results) in matched_entries
+                for result in iedb_results.values()
+            ))
+
+            for (iedb_results, wt_iedb_results) in matched_entries:
+                expected = self.per_key_match_wildtype_and_mutant_entries(parser, copy.deepcopy(iedb_results), wt_iedb_results)
+                actual = DefaultOutputParser.match_wildtype_and_mutant_entries(parser,copy.deepcopy(iedb_results), wt_iedb_results)
+                self.assertEqual(actual, expected, iedb_file)
+
+    @unittest.skipUnless(os.environ.get('PVACTOOLS_BENCHMARK'), "Set PVACTOOLS_BENCHMARK=1 to run the benchmarks")
+    def test_inframe_indel_matching_scales_linearly(self):
+        variant_count = int(os.environ.get('PVACTOOLS_BENCHMARK_INDELS', 2000))
+        parser = DefaultOutputParser(**{
+            'input_iedb_files': [],
+            'input_tsv_file'  : None,
+            'key_file'        : None,
+            'output_file'     : None,
+            'sample_name'     : 'Test',
+        })
+
+        def match_time(count):
+            (iedb_results, wt_iedb_results) = self.inframe_indel_results(count)
+            start = time.perf_counter()
+            parser.match_wildtype_and_mutant_entries(iedb_results, wt_iedb_results)
+            elapsed = time.perf_counter() - start
+            self.assertTrue(all('mutation_position' in result for result in iedb_results.values()))
+            return elapsed
+
+        small_time = match_time(variant_count // 10)
+        large_time = match_time(variant_count)
+        #Rescanning the whole chunk for every indel epitope would take ~100 times longer for ten times the variants
+        self.assertLess(large_time, small_time * 30)
+
     def test_parse_output_runs_and_produces_expected_output(self):
         parse_output_input_iedb_file = [os.path.join(self.test_data_dir, "input_peptide_sequence_length_21.ann.HLA-A*29:02.9.tsv")]
         parse_output_input_tsv_file = os.path.join(self.test_data_dir, "input_peptide_sequence_length_21.tsv")
@@ -97,6 +205,30 @@ class OutputParserTests(unittest.TestCase):
         expected_output_file  = os.path.join(self.test_data_dir, "output_pat126_17.iedb.parsed.tsv")
         self.assertTrue(compare(parse_output_output_file.name, expected_output_file))
 
+    def test_parse_output_runs_with_compact_key_file(self):
+        parse_output_input_iedb_files = [
+            os.path.join(self.test_data_dir, "input.ann.HLA-A*29:02.9.tsv"),
+            os.path.join(self.test_data_dir, "input.smm.HLA-A*29:02.9.tsv"),
+            os.path.join(self.test_data_dir, "input.smmpmbec.HLA-A*29:02.9.tsv"),
+        ]
+        parse_output_input_tsv_file = os.path.join(self.test_data_dir, "Test.tsv")
+        parse_output_key_file = tempfile.NamedTemporaryFile()
+        write_key_file(read_key_file(os.path.join(self.test_data_dir, "Test_21.key")), parse_output_key_file.name)
+        parse_output_output_file = tempfile.NamedTemporaryFile()
+
+        parse_output_params = {
+            'input_iedb_files'       : parse_output_input_iedb_files,
+            'input_tsv_file'         : parse_output_input_tsv_file,
+            'key_file'               : parse_output_key_file.name,
+            'output_file'            : parse_output_output_file.name,
+            'sample_name'            : 'input',
+        }
+        parser = DefaultOutputParser(**parse_output_params)
+
+        self.assertFalse(parser.execute())
+        expected_output_file  = os.path.join(self.test_data_dir, "output_Test_21.iedb.parsed.tsv")
+        self.assertTrue(compare(parse_output_output_file.name, expected_output_file))
+
     def test_input_frameshift_variant_feature_elongation_gets_parsed_correctly(self):
         parse_output_input_iedb_file = [os.path.join(self.test_data_dir, "input_frameshift_variant_feature_elongation.ann.HLA-A*29:02.9.tsv")]
         parse_output_input_tsv_file = os.path.join(self.test_data_dir, "input_frameshift_variant_feature_elongation.tsv")
@@ -0,0 +1,198 @@
+import unittest
+import os
+import tempfile
+import py_compile
+import time
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch, Mock
+
+from pvactools.lib.pipeline import PvacbindPipeline, prediction_job_cost, execute_pipelines
+import pvactools.lib.pipeline
+import pvactools.lib.iedb_client
+import pvactools.lib.run_utils
+from pvactools.lib.net_chop import NetChopWebBackend
+
+from tests.utils import *
+
+#Stand-in for a local IEDB install that scores every epitope by its position
+fake_iedb_executable = """import sys
+from Bio import SeqIO
+(method, allele, length, input_file) = sys.argv[1:5]
+length = int(length)
+print("allele\\tseq_num\\tstart\\tend\\tlength\\tpeptide\\tic50\\tpercentile_rank")
+for (seq_num, record) in enumerate(SeqIO.parse(input_file, "fasta"), 1):
+    sequence = str(record.seq)
+    for i in range(0, len(sequence)-length+1):
+        print("\\t".join([allele, str(seq_num), str(i+1), str(i+length), str(length), sequence[i:i+length], str(100.0*(i+1)), "1.0"]))
+"""
+
+#Stand-in for a pipeline that runs eight jobs at once, each holding one of the run's
+#limited slots, and records how many jobs of all pipelines hold a slot at the same time
+class SlotRecordingPipeline:
+    def __init__(self, slot, iedb_max_requests, in_flight, max_in_flight, lock):
+        self.slot = slot
+        self.iedb_max_requests = iedb_max_requests
+        self.in_flight = in_flight
+        self.max_in_flight = max_in_flight
+        self.lock = lock
+
+    def slot_context(self):
+        if self.slot == 'iedb':
+            return pvactools.lib.iedb_client.request_slot()
+        else:
+            return pvactools.lib.pipeline.prediction_method_slot(self.slot)
+
+    def record_job(self):
+        with self.lock:
+            self.in_flight.value += 1
+            self.max_in_flight.value = max(self.max_in_flight.value, self.in_flight.value)
+        time.sleep(0.1)
+        with self.lock:
+            self.in_flight.value -= 1
+
+    def query_netchop_server(self, staging_file, chosen_method, threshold):
+        self.record_job()
+        return Mock(content=b'done')
+
+    def job(self, i):
+        if self.slot == 'dtu':
+            backend = NetChopWebBackend()
+            with patch.object(backend, 'query_netchop_server', self.query_netchop_server), tempfile.TemporaryFile(mode='w+') as staging_file:
+                backend.predict(staging_file, 'cterm', 0.5)
+            backend.close()
+        else:
+            with self.slot_context():
+                self.record_job()
+
+    def execute(self):
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(self.job, range(8)))
+
+class PipelineSchedulingTests(unittest.TestCase):
+    def setUp(self):
+        self.output_dir = tempfile.TemporaryDirectory()
+        self.iedb_executable = os.path.join(self.output_dir.name, 'predict_binding.py')
+        with open(self.iedb_executable, 'w') as fh:
+            fh.write(fake_iedb_executable)
+        self.fasta_files = []
+        for (index, sequences) in enumerate((['ACDEFGHIKLM'], ['ACDEFGHIKLMNPQRSTVWY', 'MNPQRSTVWYA']), 1):
+            fasta_file = os.path.join(self.output_dir.name, 'Test.9.fa.split_{}'.format(index))
+            with open(fasta_file, 'w') as fh:
+                for (seq_num, sequence) in enumerate(sequences, 1):
+                    fh.write(">{}\n{}\n".format(seq_num, sequence))
+            self.fasta_files.append(fasta_file)
+
+    def tearDown(self):
+        self.output_dir.cleanup()
+
+    def pipeline(self, n_threads):
+        return PvacbindPipeline(**{
+            'input_file': self.fasta_files[0],
+            'input_file_type': 'fasta',
+            'sample_name': 'Test',
+            'alleles': ['HLA-A*02:01'],
+            'prediction_algorithms': ['NetMHC', 'SMM'],
+            'output_dir': self.output_dir.name,
+            'epitope_lengths': [9],
+            'n_threads': n_threads,
+        })
+
+    def argument_sets(self, method='NetMHC'):
+        argument_sets = []
+        for fasta_file in self.fasta_files:
+            argument_sets.append([
+                fasta_file,
+                fasta_file.replace('fa.split', 'tsv'),
+                method,
+                'HLA-A*02:01',
+                '-r', '5',
+                '-e', self.iedb_executable,
+                '-l', '9',
+            ])
+        return argument_sets
+
+    def test_source_compiles(self):
+        self.assertTrue(py_compile.compile(os.path.join(pvactools_directory(), 'pvactools', 'lib', 'pipeline.py')))
+
+    def test_prediction_job_cost_prefers_large_files_and_slow_methods(self):
+        (small_job, large_job) = self.argument_sets()
+        self.assertGreater(prediction_job_cost(large_job), prediction_job_cost(small_job))
+        slow_small_job = list(small_job)
+        slow_small_job[2] = 'NetMHCpan'
+        self.assertGreater(prediction_job_cost(slow_small_job), prediction_job_cost(small_job))
+
+    def test_parallel_prediction_jobs_generate_the_same_files(self):
+        self.pipeline(1).run_prediction_jobs(self.argument_sets())
+        sequential_outputs = []
+        for arguments in self.argument_sets():
+            with open(arguments[1], 'r') as fh:
+                sequential_outputs.append(fh.read())
+            os.unlink(arguments[1])
+
+        self.pipeline(4).run_prediction_jobs(self.argument_sets())
+        for (arguments, expected_output) in zip(self.argument_sets(), sequential_outputs):
+            with open(arguments[1], 'r') as fh:
+                self.assertEqual(fh.read(), expected_output)
+
+    def test_scheduling_parses_every_prediction_job_once(self):
+        argument_sets = self.argument_sets(method='NetMHC') + self.argument_sets(method='SMM')
+        #With a limit of one job per method the pending jobs are rescanned whenever a job finishes
+        with patch.dict('pvactools.lib.pipeline.PREDICTION_METHOD_CONCURRENCY_LIMITS', {'NetMHC': 1, 'SMM': 1}), \
+             patch('pvactools.lib.pipeline.prediction_job_fields', wraps=pvactools.lib.pipeline.prediction_job_fields) as prediction_job_fields:
+            self.pipeline(4).run_prediction_jobs(argument_sets)
+        #Once when the job is queued and once when its outputs are recorded
+        self.assertEqual(prediction_job_fields.call_count, 2 * len(argument_sets))
+
+    def max_in_flight_of_concurrent_pipelines(self, slot, iedb_max_requests=None):
+        with multiprocessing.Manager() as manager:
+            (in_flight, max_in_flight, lock) = (manager.Value('i', 0), manager.Value('i', 0), manager.Lock())
+            execute_pipelines([SlotRecordingPipeline(slot, iedb_max_requests, in_flight, max_in_flight, lock) for i in range(2)], True)
+            return max_in_flight.value
+
+    def test_concurrent_pipelines_share_the_iedb_request_limit(self):
+        self.assertEqual(self.max_in_flight_of_concurrent_pipelines('iedb', iedb_max_requests=2), 2)
+
+    def test_concurrent_pipelines_share_the_prediction_method_limits(self):
+        self.assertEqual(
+            self.max_in_flight_of_concurrent_pipelines('MHCflurry'),
+            pvactools.lib.pipeline.PREDICTION_METHOD_CONCURRENCY_LIMITS['MHCflurry']
+        )
+
+    def test_concurrent_pipelines_share_the_dtu_server_limit(self):
+        self.assertEqual(
+            self.max_in_flight_of_concurrent_pipelines('dtu'),
+            pvactools.lib.run_utils.DTU_SERVER_MAX_IN_FLIGHT
+        )
+
+    def test_failed_prediction_job_raises(self):
+        with self.assertRaises(Exception) as context:
+            self.pipeline(2).run_prediction_jobs(self.argument_sets(method='NotAPredictionAlgorithm'))
+        self.assertIn('NotAPredictionAlgorithm', str(context.exception))
+
+    def test_restart_only_runs_predictions_for_new_alleles(self):
+        pipeline = self.pipeline(1)
+        tmp_dir = os.path.join(self.output_dir.name, 'tmp')
+        with open(os.path.join(tmp_dir, 'Test.9.fa.split_1-1'), 'w') as fh:
+            fh.write(">1\nACDEFGHIKLMNPQ\n")
+        pipeline.iedb_executable = self.iedb_executable
+        pipeline.iedb_retries = 5
+        pipeline.prediction_algorithms = ['NetMHC']
+        with patch('pvactools.lib.pipeline.run_prediction_job', wraps=pvactools.lib.pipeline.run_prediction_job) as run_prediction_job:
+            pipeline.call_iedb([[1, 1]], 9)
+            self.assertEqual(run_prediction_job.call_count, 1)
+
+            restarted_pipeline = self.pipeline(1)
+            restarted_pipeline.iedb_executable = self.iedb_executable
+            restarted_pipeline.iedb_retries = 5
+            restarted_pipeline.prediction_algorithms = ['NetMHC']
+            restarted_pipeline.alleles = ['HLA-A*02:01', 'HLA-A*01:01']
+            restarted_pipeline.call_iedb([[1, 1]], 9)
+            self.assertEqual(run_prediction_job.call_count, 2)
+            self.assertEqual(run_prediction_job.call_args[0][0][3], 'HLA-A*01:01')
+
+            #Changing the input FASTA invalidates the existing predictions
+            with open(os.path.join(tmp_dir, 'Test.9.fa.split_1-1'), 'w') as fh:
+                fh.write(">1\nMNPQRSTVWYACDE\n")
+            restarted_pipeline.call_iedb([[1, 1]], 9)
+            self.assertEqual(run_prediction_job.call_count, 4)
@@ -0,0 +1,106 @@
+import unittest
+import os
+import tempfile
+import py_compile
+import pandas as pd
+from Bio import SeqIO
+
+from pvactools.lib.prediction_cache import PredictionCache, predict_with_cache
+from pvactools.lib.prediction_class import NetMHC, MHCflurry
+
+from tests.utils import *
+
+class FakePredictor:
+    def __init__(self):
+        self.predicted_peptides = []
+
+    def predict(self, input_file):
+        rows = []
+        for record in SeqIO.parse(input_file, "fasta"):
+            peptide = str(record.seq)
+            self.predicted_peptides.append(peptide)
+            rows.append("HLA-A*02:01\t{}\t1\t9\t9\t{}\t{}\t0.5".format(record.id, peptide, len(set(peptide))))
+        return ("\n".join(["allele\tseq_num\tstart\tend\tlength\tpeptide\tic50\tpercentile_rank"] + rows), 'w')
+
+class PredictionCacheTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.test_data_dir = os.path.join(pvactools_directory(), 'tests', 'test_data', 'call_iedb')
+        cls.input_file = os.path.join(cls.test_data_dir, 'input.fasta')
+        cls.allele = 'HLA-A*02:01'
+
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.cache_file = os.path.join(self.cache_dir.name, 'prediction_cache.db')
+
+    def tearDown(self):
+        self.cache_dir.cleanup()
+
+    def test_source_compiles(self):
+        self.assertTrue(py_compile.compile(os.path.join(pvactools_directory(), 'pvactools', 'lib', 'prediction_cache.py')))
+
+    def test_store_and_lookup(self):
+        rows = [{'peptide': 'LPLPPPPLL', 'ic50': '12.5'}]
+        with PredictionCache(self.cache_file) as cache:
+            cache.store('NetMHC', 'api', self.allele, 9, {'LPLPPPPLL': rows})
+            self.assertEqual(cache.lookup('NetMHC', 'api', self.allele, 9, ['LPLPPPPLL', 'PLPPPPLLP']), {'LPLPPPPLL': rows})
+            self.assertEqual(cache.lookup('NetMHC', 'local', self.allele, 9, ['LPLPPPPLL']), {})
+            self.assertEqual(cache.lookup('SMM', 'api', self.allele, 9, ['LPLPPPPLL']), {})
+            self.assertEqual(cache.hits, 1)
+            self.assertEqual(cache.misses, 3)
+            self.assertEqual(cache.statistics(), "Prediction cache: 1 hits, 3 misses (25.0% hit rate)")
+
+    def test_cache_persists_between_instances(self):
+        with PredictionCache(self.cache_file) as cache:
+            cache.store('NetMHC', 'api', self.allele, 9, {'LPLPPPPLL': [{'peptide': 'LPLPPPPLL'}]})
+        with PredictionCache(self.cache_file) as cache:
+            self.assertEqual(len(cache.lookup('NetMHC', 'api', self.allele, 9, ['LPLPPPPLL'])), 1)
+
+    def test_least_recently_used_entries_are_evicted(self):
+        with PredictionCache(self.cache_file, max_entries=2) as cache:
+            cache.store('NetMHC', 'api', self.allele, 9, {'AAAAAAAAA': []})
+            cache.store('NetMHC', 'api', self.allele, 9, {'CCCCCCCCC': []})
+            cache.lookup('NetMHC', 'api', self.allele, 9, ['AAAAAAAAA'])
+            cache.store('NetMHC', 'api', self.allele, 9, {'DDDDDDDDD': []})
+            self.assertEqual(cache.size(), 2)
+            self.assertEqual(
+                sorted(cache.lookup('NetMHC', 'api', self.allele, 9, ['AAAAAAAAA', 'CCCCCCCCC', 'DDDDDDDDD']).keys()),
+                ['AAAAAAAAA', 'DDDDDDDDD']
+            )
+
+    def test_predict_with_cache_only_predicts_misses(self):
+        predictor = FakePredictor()
+        with PredictionCache(self.cache_file) as cache:
+            (uncached_df, output_mode) = predict_with_cache(cache, predictor.predict, NetMHC(), self.input_file, self.allele, 9)
+            self.assertEqual(output_mode, 'pandas')
+            first_run_predictions = len(predictor.predicted_peptides)
+            self.assertEqual(first_run_predictions, len(set(predictor.predicted_peptides)))
+            self.assertEqual(cache.hits, 0)
+
+            (cached_df, output_mode) = predict_with_cache(cache, predictor.predict, NetMHC(), self.input_file, self.allele, 9)
+            self.assertEqual(len(predictor.predicted_peptides), first_run_predictions)
+            self.assertEqual(cache.hits, first_run_predictions)
+        pd.testing.assert_frame_equal(uncached_df, cached_df)
+
+    def test_predict_with_cache_fans_out_positions(self):
+        predictor = FakePredictor()
+        with PredictionCache(self.cache_file) as cache:
+            (df, output_mode) = predict_with_cache(cache, predictor.predict, NetMHC(), self.input_file, self.allele, 9)
+        self.assertEqual(list(df.columns), ['allele', 'seq_num', 'start', 'end', 'length', 'peptide', 'ic50', 'percentile_rank'])
+        epitope_count = 0
+        for record in SeqIO.parse(self.input_file, "fasta"):
+            sequence = str(record.seq)
+            for start in range(1, len(sequence) - 9 + 2):
+                epitope_count += 1
+                row = df[(df['seq_num'] == record.id) & (df['start'] == str(start))]
+                self.assertEqual(len(row), 1)
+                self.assertEqual(row['peptide'].iloc[0], sequence[start-1:start+8])
+                self.assertEqual(row['end'].iloc[0], str(start + 8))
+        self.assertEqual(len(df), epitope_count)
+
+    def test_cache_entries_are_specific_to_the_predictor(self):
+        predictor = FakePredictor()
+        with PredictionCache(self.cache_file) as cache:
+            predict_with_cache(cache, predictor.predict, NetMHC(), self.input_file, self.allele, 9)
+            predict_with_cache(cache, predictor.predict, MHCflurry(), self.input_file, self.allele, 9)
+            self.assertEqual(cache.hits, 0)
@@ -3,6 +3,7 @@ import os
 import unittest
 import py_compile
 import vcfpy
+import pysam
 
 from pvactools.lib.proximal_variant import ProximalVariant
 from tests.utils import *
@@ -49,3 +50,19 @@ class ProximalVariantTests(unittest.TestCase):
         self.assertEqual(self.klass.combine_conflicting_variants(["ttC/ttA", "tTc/tAc"]), '*')
         self.assertEqual(self.klass.combine_conflicting_variants(["Cca/Tca", "cCa/cTa"]), 'L')
 
+
+class ProximalVariantWindowTests(unittest.TestCase):
+    def test_streamed_window_matches_tabix_fetch(self):
+        vcf_path = os.path.join(pvactools_directory(), 'tests', 'test_data', 'input_file_converter', 'somatic.vcf.gz')
+        klass = ProximalVariant(vcf_path, False, 3000)
+        tabix_file = pysam.TabixFile(vcf_path)
+        somatic_vcf_reader = vcfpy.Reader.from_path(vcf_path)
+        for somatic_variant in somatic_vcf_reader:
+            start = max(somatic_variant.begin - klass.flanking_bases, 0)
+            end = somatic_variant.affected_end + klass.flanking_bases
+            expected = [line.split('\t')[1] for line in tabix_file.fetch(somatic_variant.CHROM, start, end)]
+            entries = klass.fetch(somatic_variant.CHROM, start, end)
+            self.assertEqual([str(entry.POS) for entry in entries], expected)
+        klass.close()
+        tabix_file.close()
+        somatic_vcf_reader.close()
@@ -62,6 +62,7 @@ class PvacbindTests(unittest.TestCase):
         usage_search = re.compile(r"usage: ")
         for command in [
             "run",
+            "postprocess",
             'binding_filter',
             'valid_alleles',
             'allele_specific_cutoffs',
@@ -129,7 +130,7 @@ class PvacbindTests(unittest.TestCase):
             data,
             files,
             test_data_directory()
-        ))) as mock_request, unittest.mock.patch('Bio.Blast.NCBIWWW.qblast', side_effect=mock_ncbiwww_qblast):
+        ))) as mock_request, patch('requests.Session.post', mock_request), unittest.mock.patch('Bio.Blast.NCBIWWW.qblast', side_effect=mock_ncbiwww_qblast):
             output_dir = tempfile.TemporaryDirectory(dir = self.test_data_directory)
 
             run.main([
@@ -56,6 +56,7 @@ class PvacfuseTests(unittest.TestCase):
         usage_search = re.compile(r"usage: ")
         for command in [
             "run",
+            "postprocess",
             "allele_specific_cutoffs",
             "binding_filter",
             "valid_alleles",
@@ -175,7 +176,7 @@ class PvacfuseTests(unittest.TestCase):
             data,
             files,
             test_data_directory()
-        ))) as mock_request, unittest.mock.patch('Bio.Blast.NCBIWWW.qblast', side_effect=mock_ncbiwww_qblast):
+        ))) as mock_request, patch('requests.Session.post', mock_request), unittest.mock.patch('Bio.Blast.NCBIWWW.qblast', side_effect=mock_ncbiwww_qblast):
             output_dir = tempfile.TemporaryDirectory(dir = self.test_data_directory)
 
             run.main([
@@ -220,7 +221,7 @@ class PvacfuseTests(unittest.TestCase):
             data,
             files,
             test_data_directory()
-        ))) as mock_request, unittest.mock.patch('Bio.Blast.NCBIWWW.qblast', side_effect=mock_ncbiwww_qblast):
+        ))) as mock_request, patch('requests.Session.post', mock_request), unittest.mock.patch('Bio.Blast.NCBIWWW.qblast', side_effect=mock_ncbiwww_qblast):
             output_dir = tempfile.TemporaryDirectory(dir = self.test_data_directory)
             run.main([
                 os.path.join(self.test_data_directory, "agfusion"),
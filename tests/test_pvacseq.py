@@ -72,6 +72,7 @@ class PvacseqTests(unittest.TestCase):
             "generate_protein_fasta",
             "install_vep_plugin",
             "run",
+            "postprocess",
             "net_chop",
             "netmhc_stab",
             "calculate_reference_proteome_similarity",
@@ -210,6 +211,57 @@ class PvacseqTests(unittest.TestCase):
         ))
         self.assertTrue(compiled_run_path)
 
+    def test_postprocess_compiles(self):
+        compiled_run_path = py_compile.compile(os.path.join(
+            self.pvactools_directory,
+            'pvactools',
+            "tools",
+            "pvacseq",
+            "postprocess.py"
+        ))
+        self.assertTrue(compiled_run_path)
+
+    def test_postprocess_runs(self):
+        input_file = os.path.join(self.test_data_directory, 'MHC_Class_I', 'Test.all_epitopes.tsv')
+        output_dir = tempfile.TemporaryDirectory()
+        run_config_file = os.path.join(output_dir.name, 'inputs.yml')
+        with open(run_config_file, 'w') as run_config_fh:
+            yaml.dump({
+                'sample_name': 'Test',
+                'net_chop_method': 'cterm',
+                'net_chop_fasta': os.path.join(self.test_data_directory, 'MHC_Class_I', 'Test.fasta'),
+                'netmhc_stab': True,
+                'run_reference_proteome_similarity': True,
+            }, run_config_fh)
+        postprocess.main([
+            input_file,
+            output_dir.name,
+            '--run-config', run_config_file,
+        ])
+        for file_name in ['Test.filtered.tsv', 'Test.all_epitopes.aggregated.tsv']:
+            output_file   = os.path.join(output_dir.name, file_name)
+            expected_file = os.path.join(self.test_data_directory, 'MHC_Class_I', file_name)
+            self.assertTrue(cmp(output_file, expected_file, False), "files don't match %s - %s" %(output_file, expected_file))
+        output_dir.cleanup()
+
+    def test_postprocess_runs_without_run_config(self):
+        #the sample name and the FASTA file are looked up from the input file
+        input_file = os.path.join(self.test_data_directory, 'MHC_Class_I', 'Test.all_epitopes.tsv')
+        output_dir = tempfile.TemporaryDirectory()
+        postprocess.main([
+            input_file,
+            output_dir.name,
+            '--net-chop-method', 'cterm',
+            '--net-chop-fasta', os.path.join(self.test_data_directory, 'MHC_Class_I', 'Test.fasta'),
+            '--netmhc-stab',
+            '--run-reference-proteome-similarity',
+        ])
+        for file_name in ['Test.filtered.tsv', 'Test.all_epitopes.aggregated.tsv']:
+            output_file   = os.path.join(output_dir.name, file_name)
+            expected_file = os.path.join(self.test_data_directory, 'MHC_Class_I', file_name)
+            self.assertTrue(cmp(output_file, expected_file, False), "files don't match %s - %s" %(output_file, expected_file))
+        output_dir.cleanup()
+
     def test_top_score_filter_runs(self):
         input_file = os.path.join(self.test_data_directory, 'MHC_Class_I', 'Test.all_epitopes.tsv')
         output_file = tempfile.NamedTemporaryFile()
@@ -248,7 +300,7 @@ class PvacseqTests(unittest.TestCase):
             data,
             files,
             test_data_directory()
-        ))) as mock_request, unittest.mock.patch('Bio.Blast.NCBIWWW.qblast', side_effect=mock_ncbiwww_qblast):
+        ))) as mock_request, patch('requests.Session.post', mock_request), unittest.mock.patch('Bio.Blast.NCBIWWW.qblast', side_effect=mock_ncbiwww_qblast):
             output_dir = tempfile.TemporaryDirectory(dir = self.test_data_directory)
 
             run.main([
@@ -410,6 +462,55 @@ class PvacseqTests(unittest.TestCase):
         files,
         test_data_directory()
     )))
+    @patch('requests.Session.post', unittest.mock.Mock(side_effect = lambda url, data, files=None: make_response(
+        data,
+        files,
+        test_data_directory()
+    )))
+    def test_pvacseq_pipeline_concurrent_pipelines(self):
+        sequential_output_dir = tempfile.TemporaryDirectory()
+        concurrent_output_dir = tempfile.TemporaryDirectory()
+        for (output_dir, additional_params) in ((sequential_output_dir, []), (concurrent_output_dir, ['--concurrent-pipelines', '-t', '2'])):
+            run.main([
+                os.path.join(self.test_data_directory, "input.vcf"),
+                'Test',
+                'HLA-E*01:01,DRB1*11:01',
+                'NetMHC',
+                'NNalign',
+                output_dir.name,
+                '-e1', '9',
+                '-e2', '15',
+                '--top-score-metric=lowest',
+                '-d', 'full',
+                *additional_params,
+            ])
+
+        for file_name in (
+            os.path.join('MHC_Class_I', 'Test.tsv'),
+            os.path.join('MHC_Class_I', 'Test.all_epitopes.tsv'),
+            os.path.join('MHC_Class_I', 'Test.filtered.tsv'),
+            os.path.join('MHC_Class_II', 'Test.tsv'),
+            os.path.join('MHC_Class_II', 'Test.all_epitopes.tsv'),
+            os.path.join('MHC_Class_II', 'Test.filtered.tsv'),
+            os.path.join('combined', 'Test.all_epitopes.tsv'),
+            os.path.join('combined', 'Test.filtered.tsv'),
+        ):
+            output_file   = os.path.join(concurrent_output_dir.name, file_name)
+            expected_file = os.path.join(sequential_output_dir.name, file_name)
+            self.assertTrue(cmp(output_file, expected_file, False), "files don't match %s - %s" %(output_file, expected_file))
+        sequential_output_dir.cleanup()
+        concurrent_output_dir.cleanup()
+
+    @patch('requests.post', unittest.mock.Mock(side_effect = lambda url, data, files=None: make_response(
+        data,
+        files,
+        test_data_directory()
+    )))
+    @patch('requests.Session.post', unittest.mock.Mock(side_effect = lambda url, data, files=None: make_response(
+        data,
+        files,
+        test_data_directory()
+    )))
     def test_pvacseq_pipeline_additional_report_columns(self):
         output_dir = tempfile.TemporaryDirectory()
         params = [
@@ -434,6 +535,11 @@ class PvacseqTests(unittest.TestCase):
         files,
         test_data_directory()
     )))
+    @patch('requests.Session.post', unittest.mock.Mock(side_effect = lambda url, data, files=None: make_response(
+        data,
+        files,
+        test_data_directory()
+    )))
     def test_pvacseq_pipeline_proximal_variants_vcf(self):
         output_dir = tempfile.TemporaryDirectory()
 
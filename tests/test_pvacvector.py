@@ -162,7 +162,7 @@ class TestPvacvector(unittest.TestCase):
             data,
             test_data_directory(),
             'fa_input',
-        ))) as mock_request:
+        ))) as mock_request, patch('requests.Session.post', mock_request):
             output_dir = tempfile.TemporaryDirectory()
 
             run.main([
@@ -203,7 +203,7 @@ class TestPvacvector(unittest.TestCase):
             data,
             test_data_directory(),
             'generate_fa',
-        ))) as mock_request:
+        ))) as mock_request, patch('requests.Session.post', mock_request):
             output_dir = tempfile.TemporaryDirectory()
 
             run.main([
@@ -238,7 +238,7 @@ class TestPvacvector(unittest.TestCase):
             data,
             test_data_directory(),
             'negative_start',
-        ))) as mock_request:
+        ))) as mock_request, patch('requests.Session.post', mock_request):
             output_dir = tempfile.TemporaryDirectory()
 
             run.main([
@@ -0,0 +1,71 @@
+import unittest
+import os
+import tempfile
+import py_compile
+import numpy as np
+
+from pvactools.lib.reference_proteome_index import ReferenceProteomeIndex
+import pvactools.tools.build_reference_proteome_index as build_reference_proteome_index
+from tests.utils import *
+
+class ReferenceProteomeIndexTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.test_data_dir = os.path.join(pvactools_directory(), "tests", "test_data", "reference_proteome_index")
+        cls.reference_fasta = os.path.join(cls.test_data_dir, 'reference.fasta')
+
+    def setUp(self):
+        self.output_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.output_dir.cleanup()
+
+    def test_source_compiles(self):
+        self.assertTrue(py_compile.compile(os.path.join(pvactools_directory(), 'pvactools', 'lib', 'reference_proteome_index.py')))
+
+    def test_build_and_match(self):
+        index = ReferenceProteomeIndex.build(self.reference_fasta, self.output_dir.name)
+        self.assertEqual(index.match_length, 8)
+        self.assertEqual(index.species, None)
+        self.assertEqual(index.protein_ids, ['NP_001034230.1', 'NP_061900.2', 'NP_000000.1'])
+        self.assertTrue(np.all(index.kmers[:-1] <= index.kmers[1:]))
+        self.assertIsInstance(index.kmers, np.memmap)
+
+        matches = index.matches('WWWPPRHPPSDWWW')
+        self.assertEqual(matches, [{
+            'Hit ID': 'NP_001034230.1',
+            'Hit Definition': 'TRIO and F-actin-binding protein isoform 6 [Homo sapiens]',
+            'Query Window': 'PPRHPPSD',
+            'Match Sequence': 'PPRHPPSD',
+            'Match Start': 25,
+            'Match Stop': 32,
+        }])
+        self.assertEqual(index.matches('PPRHPPS'), [])
+        self.assertEqual(index.matches('PPRHPPS*'), [])
+
+    def test_repeated_kmers_report_every_position(self):
+        index = ReferenceProteomeIndex.build(self.reference_fasta, self.output_dir.name, match_length=10)
+        matches = index.matches('AAAAAAAAAA')
+        self.assertEqual([(match['Hit ID'], match['Match Start']) for match in matches], [('NP_061900.2', i) for i in range(489, 493)])
+
+    def test_index_is_reloaded_from_disk(self):
+        ReferenceProteomeIndex.build(self.reference_fasta, self.output_dir.name, species='human')
+        index = ReferenceProteomeIndex(self.output_dir.name)
+        self.assertEqual(index.species, 'human')
+        self.assertEqual(len(index.matches('AAAAAAAVIPTVSTP')), 8)
+
+    def test_match_length_too_long(self):
+        with self.assertRaises(Exception) as context:
+            ReferenceProteomeIndex.build(self.reference_fasta, self.output_dir.name, match_length=13)
+        self.assertIn("maximum match length of 12", str(context.exception))
+
+    def test_missing_index(self):
+        with self.assertRaises(Exception) as context:
+            ReferenceProteomeIndex(self.output_dir.name)
+        self.assertIn("is not a reference proteome index directory", str(context.exception))
+
+    def test_build_reference_proteome_index_command(self):
+        build_reference_proteome_index.main([self.reference_fasta, self.output_dir.name, '--match-length', '9'])
+        index = ReferenceProteomeIndex(self.output_dir.name)
+        self.assertEqual(index.match_length, 9)
+        self.assertEqual(index.species, 'human')
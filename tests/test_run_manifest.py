@@ -0,0 +1,76 @@
+import unittest
+import os
+import tempfile
+import pickle
+
+from pvactools.lib.run_manifest import RunManifest
+
+class RunManifestTests(unittest.TestCase):
+    def setUp(self):
+        self.output_dir = tempfile.TemporaryDirectory()
+        self.manifest_file = os.path.join(self.output_dir.name, 'run_manifest.json')
+        self.input_file = self.write_file('input.tsv', 'a\tb\n1\t2\n')
+        self.output_file = self.write_file('output.tsv', 'a\n1\n')
+
+    def tearDown(self):
+        self.output_dir.cleanup()
+
+    def write_file(self, name, content):
+        path = os.path.join(self.output_dir.name, name)
+        with open(path, 'w') as fh:
+            fh.write(content)
+        return path
+
+    def test_unrecorded_output_is_not_current(self):
+        RunManifest(self.manifest_file)
+        manifest = RunManifest(self.manifest_file)
+        self.assertFalse(manifest.is_current([self.output_file], [self.input_file]))
+
+    def test_outputs_without_a_manifest_are_reused_and_recorded(self):
+        manifest = RunManifest(self.manifest_file)
+        self.assertTrue(manifest.is_current([self.output_file], [self.input_file]))
+        self.write_file('input.tsv', 'a\tb\n3\t4\n')
+        manifest = RunManifest(self.manifest_file)
+        self.assertFalse(manifest.is_current([self.output_file], [self.input_file]))
+
+    def test_recorded_output_is_current_after_reload(self):
+        RunManifest(self.manifest_file).record([self.output_file], [self.input_file], {'epitope_length': 9})
+        manifest = RunManifest(self.manifest_file)
+        self.assertTrue(manifest.is_current([self.output_file], [self.input_file], {'epitope_length': 9}))
+
+    def test_changed_parameters_are_not_current(self):
+        manifest = RunManifest(self.manifest_file)
+        manifest.record([self.output_file], [self.input_file], {'epitope_length': 9})
+        self.assertFalse(manifest.is_current([self.output_file], [self.input_file], {'epitope_length': 10}))
+
+    def test_changed_input_content_is_not_current(self):
+        manifest = RunManifest(self.manifest_file)
+        manifest.record([self.output_file], [self.input_file])
+        self.write_file('input.tsv', 'a\tb\n3\t4\n')
+        self.assertFalse(manifest.is_current([self.output_file], [self.input_file]))
+
+    def test_additional_input_is_not_current(self):
+        manifest = RunManifest(self.manifest_file)
+        manifest.record([self.output_file], [self.input_file])
+        other_input_file = self.write_file('other_input.tsv', 'c\n')
+        self.assertFalse(manifest.is_current([self.output_file], [self.input_file, other_input_file]))
+
+    def test_modified_or_missing_output_is_not_current(self):
+        manifest = RunManifest(self.manifest_file)
+        manifest.record([self.output_file], [self.input_file])
+        self.write_file('output.tsv', 'a\n')
+        self.assertFalse(manifest.is_current([self.output_file], [self.input_file]))
+        manifest.record([self.output_file], [self.input_file])
+        os.unlink(self.output_file)
+        self.assertFalse(manifest.is_current([self.output_file], [self.input_file]))
+
+    def test_missing_inputs_are_ignored(self):
+        manifest = RunManifest(self.manifest_file)
+        manifest.record([self.output_file], [self.input_file, None])
+        self.assertTrue(manifest.is_current([self.output_file], [self.input_file, None]))
+
+    def test_manifest_can_be_pickled(self):
+        manifest = RunManifest(self.manifest_file)
+        manifest.record([self.output_file], [self.input_file])
+        manifest = pickle.loads(pickle.dumps(manifest))
+        self.assertTrue(manifest.is_current([self.output_file], [self.input_file]))
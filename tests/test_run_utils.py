@@ -4,6 +4,7 @@ import tempfile
 from filecmp import cmp
 import sys
 import py_compile
+import pandas as pd
 
 from pvactools.lib.run_utils import *
 from tests.utils import *
@@ -35,3 +36,31 @@ class RunUtilsTests(unittest.TestCase):
             sorted(combine_class_ii_alleles(["DRB9*01:02", "DRA*01:01"])),
             sorted(["DRB9*01:02", "DRA*01:01"])
         )
+
+    def test_split_n_threads(self):
+        self.assertEqual(split_n_threads(8, 2), [4, 4])
+        self.assertEqual(split_n_threads(5, 2), [3, 2])
+        self.assertEqual(split_n_threads(2, 3), [1, 1, 1])
+
+    def test_parquet_report_round_trip(self):
+        input_file = os.path.join(pvactools_directory(), "tests", "test_data", "aggregate_all_epitopes", "Test.all_epitopes.tsv")
+        output_dir = tempfile.TemporaryDirectory()
+        parquet_file = parquet_report_path(os.path.join(output_dir.name, "Test.all_epitopes.tsv"))
+        self.assertEqual(os.path.basename(parquet_file), "Test.all_epitopes.parquet")
+        write_parquet_report(read_report(input_file), parquet_file)
+        self.assertTrue(is_parquet_file(parquet_file))
+        self.assertFalse(is_parquet_file(input_file))
+        self.assertEqual(read_report_headers(parquet_file), read_report_headers(input_file))
+
+        #the values are read back as exactly the strings of the TSV report
+        self.assertTrue(read_report(parquet_file).equals(read_report(input_file)))
+        chunks = list(read_report(parquet_file, 10))
+        self.assertEqual(len(chunks[0]), 10)
+        self.assertTrue(pd.concat(chunks, ignore_index=True).equals(read_report(input_file)))
+
+        #numeric columns are typed, alleles are dictionary encoded
+        df = pd.read_parquet(parquet_file)
+        self.assertTrue(pd.api.types.is_float_dtype(df["Median MT Score"]))
+        self.assertTrue(pd.api.types.is_integer_dtype(df["Start"]))
+        self.assertTrue(isinstance(df["HLA Allele"].dtype, pd.CategoricalDtype))
+        output_dir.cleanup()
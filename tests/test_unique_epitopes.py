@@ -0,0 +1,164 @@
+import unittest
+import os
+import tempfile
+import time
+import py_compile
+import numpy as np
+import pandas as pd
+from Bio import SeqIO
+
+from pvactools.lib.unique_epitopes import *
+from pvactools.lib.pipeline import PvacbindPipeline
+
+from tests.utils import *
+
+class UniqueEpitopesTests(unittest.TestCase):
+    def setUp(self):
+        self.output_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.output_dir.cleanup()
+
+    def write_fasta(self, file_name, sequences):
+        path = os.path.join(self.output_dir.name, file_name)
+        with open(path, 'w') as fh:
+            for (index, sequence) in enumerate(sequences, 1):
+                fh.write(">{}\n{}\n".format(index, sequence))
+        return path
+
+    def write_predictions(self, fasta_file, output_file):
+        rows = ["allele\tseq_num\tstart\tend\tlength\tpeptide\tic50\tpercentile_rank"]
+        for record in SeqIO.parse(fasta_file, "fasta"):
+            peptide = str(record.seq)
+            rows.append("HLA-A*02:01\t{}\t1\t9\t9\t{}\t{}\t0.5".format(record.id, peptide, len(set(peptide))))
+        with open(output_file, 'w') as fh:
+            fh.write("\n".join(rows))
+
+    def test_source_compiles(self):
+        self.assertTrue(py_compile.compile(os.path.join(pvactools_directory(), 'pvactools', 'lib', 'unique_epitopes.py')))
+
+    def test_determine_epitopes(self):
+        fasta_file = self.write_fasta('input.fa', ['ACDEFGHIKL', 'ACDEFGHIK'])
+        self.assertEqual(determine_epitopes(fasta_file, 9), [
+            ('1', 1, 'ACDEFGHIK'),
+            ('1', 2, 'CDEFGHIKL'),
+            ('2', 1, 'ACDEFGHIK'),
+        ])
+        self.assertEqual(unique_peptides(determine_epitopes(fasta_file, 9)), ['ACDEFGHIK', 'CDEFGHIKL'])
+
+    def test_fan_out_predictions(self):
+        epitopes = [('1', 1, 'ACDEFGHIK'), ('1', 2, 'CDEFGHIKL'), ('2', 1, 'ACDEFGHIK')]
+        results = {
+            'ACDEFGHIK': [{'seq_num': '1', 'start': '1', 'end': '9', 'peptide': 'ACDEFGHIK', 'ic50': '10.5'}],
+        }
+        df = fan_out_predictions(epitopes, results, 9, ['seq_num', 'start', 'end', 'peptide', 'ic50'])
+        self.assertEqual(df.values.tolist(), [
+            ['1', '1', '9', 'ACDEFGHIK', '10.5'],
+            ['2', '1', '9', 'ACDEFGHIK', '10.5'],
+        ])
+
+    def test_merge_predictions_with_positions(self):
+        fasta_file = self.write_fasta('input.fa', ['ACDEFGHIKL', 'ACDEFGHIK'])
+        predictions = pd.DataFrame({
+            'peptide': ['CDEFGHIKL', 'ACDEFGHIK'],
+            'ic50': [20.5, 10.5],
+        })
+        df = merge_predictions_with_positions(epitope_positions(fasta_file, 9), predictions)
+        self.assertEqual(df.values.tolist(), [
+            ['1', 1, 'ACDEFGHIK', 10.5],
+            ['1', 2, 'CDEFGHIKL', 20.5],
+            ['2', 1, 'ACDEFGHIK', 10.5],
+        ])
+
+    def test_merge_predictions_with_positions_matches_per_epitope_fan_out(self):
+        input_file = os.path.join(pvactools_directory(), 'tests', 'test_data', 'call_iedb', 'input.fasta')
+        positions = epitope_positions(input_file, 9)
+        #the last peptide has no prediction and is left out
+        peptides = positions['peptide'].unique()[:-1]
+        predictions = pd.DataFrame({
+            'peptide': peptides,
+            'ic50': np.arange(len(peptides)) * 10.5,
+        })
+
+        #the per-epitope fan-out call_mhcnuggets used before the predictions were merged with the positions
+        epitope_seq_nums = {}
+        for record in SeqIO.parse(input_file, "fasta"):
+            sequence = str(record.seq)
+            for i in range(0, len(sequence)-9+1):
+                epitope_seq_nums.setdefault(sequence[i:i+9], []).append((record.id, i+1))
+        expected = []
+        for (peptide, ic50) in predictions.itertuples(index=False):
+            for (seq_num, start) in epitope_seq_nums[peptide]:
+                expected.append([seq_num, start, peptide, ic50])
+
+        df = merge_predictions_with_positions(positions, predictions)
+        self.assertEqual(sorted(df.values.tolist()), sorted(expected))
+
+    @unittest.skipUnless(os.environ.get('PVACTOOLS_BENCHMARK'), "Set PVACTOOLS_BENCHMARK=1 to run the benchmarks")
+    def test_merge_predictions_with_positions_scales_linearly(self):
+        epitope_count = int(os.environ.get('PVACTOOLS_BENCHMARK_EPITOPES', 10**6))
+
+        def merge_time(count):
+            peptide_count = max(1, count // 2)
+            positions = pd.DataFrame({
+                'seq_num': np.arange(count) // 100 + 1,
+                'start': np.arange(count) % 100 + 1,
+                'peptide': ["{:09d}".format(i % peptide_count) for i in range(count)],
+            })
+            predictions = pd.DataFrame({
+                'peptide': ["{:09d}".format(i) for i in range(peptide_count)],
+                'ic50': np.random.uniform(0, 50000, peptide_count),
+            })
+            timings = []
+            for i in range(3):
+                start = time.perf_counter()
+                df = merge_predictions_with_positions(positions, predictions)
+                timings.append(time.perf_counter() - start)
+            self.assertEqual(len(df), count)
+            return min(timings)
+
+        small_time = merge_time(epitope_count // 10)
+        large_time = merge_time(epitope_count)
+        #A quadratic implementation would take ~100 times longer for ten times the epitopes
+        self.assertLess(large_time, small_time * 30)
+
+    def test_pipeline_predicts_unique_epitopes_once(self):
+        chunk_1 = self.write_fasta('Test.9.fa.split_1-2', ['ACDEFGHIKL', 'ACDEFGHIKM'])
+        chunk_2 = self.write_fasta('Test.9.fa.split_3-4', ['ACDEFGHIKL', 'PQRSTVWY'])
+        pipeline = PvacbindPipeline(**{
+            'input_file': chunk_1,
+            'input_file_type': 'fasta',
+            'sample_name': 'Test',
+            'alleles': ['HLA-A*02:01'],
+            'prediction_algorithms': ['NetMHC'],
+            'output_dir': self.output_dir.name,
+            'epitope_lengths': [9],
+            'deduplicate_epitopes': True,
+        })
+        argument_sets = []
+        for (chunk, fasta_chunk) in ((chunk_1, '1-2'), (chunk_2, '3-4')):
+            argument_sets.append([
+                chunk,
+                os.path.join(self.output_dir.name, 'Test.ann.HLA-A*02:01.9.tsv_{}'.format(fasta_chunk)),
+                'NetMHC',
+                'HLA-A*02:01',
+                '-r', '5',
+                '-e', None,
+                '-l', '9',
+            ])
+        (deduplicated_argument_sets, fan_outs) = pipeline.deduplicate_argument_sets(argument_sets)
+        self.assertEqual(len(deduplicated_argument_sets), 1)
+        unique_fasta_file = deduplicated_argument_sets[0][0]
+        self.assertEqual(
+            [str(record.seq) for record in SeqIO.parse(unique_fasta_file, "fasta")],
+            ['ACDEFGHIK', 'CDEFGHIKL', 'CDEFGHIKM']
+        )
+
+        self.write_predictions(unique_fasta_file, deduplicated_argument_sets[0][1])
+        pipeline.fan_out_unique_predictions(fan_outs)
+        for arguments in argument_sets:
+            df = pd.read_csv(arguments[1], sep="\t", dtype=str)
+            for (seq_num, start, epitope) in determine_epitopes(arguments[0], 9):
+                row = df[(df['seq_num'] == seq_num) & (df['start'] == str(start))]
+                self.assertEqual(row['peptide'].tolist(), [epitope])
+                self.assertEqual(row['end'].tolist(), [str(start + 8)])
@@ -1,6 +1,7 @@
 import re
 import os
 import unittest
+from Bio import SeqIO
 
 def compare(path1, path2):
     r1 = open(path1)
@@ -25,6 +26,17 @@ def close_mock_fhs():
     for fh in mock_fhs:
         fh.close()
 
+blastp_queries = []
+def mock_blastp_run(arguments, stdout, check):
+    base_dir      = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
+    test_data_dir = os.path.join(base_dir, "tests", "test_data", "blastp_tabular_responses")
+    query_file = arguments[arguments.index('-query') + 1]
+    blastp_queries.append(query_file)
+    for record in SeqIO.parse(query_file, "fasta"):
+        with open(os.path.join(test_data_dir, '{}.tsv'.format(str(record.seq)[0:100])), 'r') as response_fh:
+            for line in response_fh:
+                stdout.write("{}\t{}".format(record.id, line))
+
 def make_response(data, files, path):
     if not files:
         filename = 'response_%s_%s_%s.tsv' % (data['allele'], data['length'], data['method'])